@@ -1,120 +1,132 @@
-from flask import Flask, render_template, request, redirect, session, flash, jsonify, send_file
+from flask import Flask, render_template, request, redirect, session, flash, jsonify, send_file, Response, g
+from flask import before_render_template, template_rendered
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-import os, json, subprocess, zipfile, psutil, re, time, shutil, hashlib, random, string
+from werkzeug.middleware.proxy_fix import ProxyFix
+import os, json, re, time, hashlib, hmac, math, string
 from datetime import datetime, timedelta
 import threading
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
+from paths import BOTS_DIR, USERS_DIR, LOGS_DIR, DATA_DIR
+import storage
+import cache
+import control
+import logtail
+import logwriter
+import logsearch
+import metrics
+import usage
+import ingest
+import blobs
+import envs
+import instrument
+import throttle
+
 app = Flask(__name__)
 app.secret_key = "devil-cloud-advanced-secret-key-2024"
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 
+# Behind a reverse proxy request.remote_addr is the proxy's address;
+# PROXY_HOPS is how many X-Forwarded-For entries to trust (1 on Render)
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+
 # -------------------------------
 # PATHS AND CONFIGURATION
 # -------------------------------
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-BOTS_DIR = os.path.join(BASE_DIR, "bots")
-USERS_DIR = os.path.join(BASE_DIR, "users")
-LOGS_DIR = os.path.join(BASE_DIR, "logs")
-DATA_DIR = os.path.join(BASE_DIR, "data")
 CONFIG_FILE = os.path.join(DATA_DIR, "config.json")
-USERS_FILE = os.path.join(DATA_DIR, "users.json")
-BOTS_FILE = os.path.join(DATA_DIR, "bots.json")
-STATS_FILE = os.path.join(DATA_DIR, "stats.json")
-
-# Create directories
-for dir_path in [BOTS_DIR, USERS_DIR, LOGS_DIR, DATA_DIR]:
-    os.makedirs(dir_path, exist_ok=True)
 
 # -------------------------------
 # CONFIGURATION LOAD/SAVE
 # -------------------------------
+@instrument.timed("registry_seconds")
 def load_config():
     default_config = {
         "site_name": "DEVIL CLOUD HOSTING",
         "admin_password": "admin123",
         "default_user_storage": 500,  # MB
         "default_user_bot_limit": 10,
+        "default_user_cpu_limit": 50,       # percent of one core
+        "default_user_memory_limit": 256,   # MB
+        "default_user_pids_limit": 64,
+        "default_user_fds_limit": 256,
         "allowed_extensions": [".py", ".php", ".js", ".txt", ".zip"],
         "theme": "dark",
         "auto_start_bots": False,
+        "zygote_mode": False,  # fork Python bots from a warm interpreter, see zygote.py
+        "metrics_token": "",   # bearer token for Prometheus scrapes of /metrics
+        "profile_slow_requests": False,
+        "profile_slow_ms": 500,
+        "login_attempts_per_minute": throttle.LOGIN_ATTEMPTS_PER_MINUTE,  # per client address, 0 = unlimited
+        "login_failures_allowed": throttle.LOGIN_FAILURES_ALLOWED,        # per address and username, 0 = unlimited
         "maintenance_mode": False
     }
     
     if os.path.exists(CONFIG_FILE):
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                return {**default_config, **json.load(f)}
+            return {**default_config, **cache.cached("config", lambda: cache.file_version(CONFIG_FILE), read_config_file)}
         except:
             return default_config
     else:
         save_config(default_config)
         return default_config
 
+def read_config_file():
+    with open(CONFIG_FILE, 'r') as f:
+        return json.load(f)
+
+@instrument.timed("registry_seconds")
 def save_config(config):
-    with open(CONFIG_FILE, 'w') as f:
+    # Write-then-rename so readers never parse a half-written file and the
+    # new inode invalidates every worker's cached copy.
+    tmp_path = f"{CONFIG_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
         json.dump(config, f, indent=4)
+    os.replace(tmp_path, CONFIG_FILE)
 
+# Registry documents below are cached per process and shared between
+# requests; mutate them through storage, never in place.
+@instrument.timed("registry_seconds")
 def load_users():
-    if os.path.exists(USERS_FILE):
-        try:
-            with open(USERS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
-
-def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=4)
+    return cache.cached("users", lambda: storage.table_version("users"), storage.list_users)
 
+@instrument.timed("registry_seconds")
 def load_bots():
-    if os.path.exists(BOTS_FILE):
-        try:
-            with open(BOTS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+    return cache.cached("bots", lambda: storage.table_version("bots"),
+                        lambda: {bot["id"]: bot for bot in storage.list_bots()})
 
-def save_bots(bots):
-    with open(BOTS_FILE, 'w') as f:
-        json.dump(bots, f, indent=4)
+@instrument.timed("registry_seconds")
+def load_user_bots(username):
+    return cache.cached(f"bots:{username}", lambda: storage.table_version("bots"),
+                        lambda: storage.list_bots(username=username))
 
+@instrument.timed("registry_seconds")
 def load_stats():
-    default_stats = {
-        "total_bots": 0,
-        "running_bots": 0,
-        "total_users": 0,
-        "total_uploads": 0,
-        "uptime": datetime.now().isoformat()
-    }
-    
-    if os.path.exists(STATS_FILE):
-        try:
-            with open(STATS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return default_stats
-    return default_stats
+    return cache.cached("stats", lambda: tuple(storage.table_version(t) for t in ("bots", "users", "stats")),
+                        storage.get_stats)
 
-def save_stats(stats):
-    with open(STATS_FILE, 'w') as f:
-        json.dump(stats, f, indent=4)
+@instrument.timed("registry_seconds")
+def load_system_snapshot():
+    """Host/fleet snapshot written by the supervisor; None if it never ran"""
+    try:
+        return cache.cached("system", lambda: cache.file_version(metrics.SNAPSHOT_FILE), metrics.read_snapshot)
+    except (OSError, ValueError):
+        return None
 
 # -------------------------------
 # USER MANAGEMENT FUNCTIONS
 # -------------------------------
 def create_user(username, email, password, is_admin=False):
-    users = load_users()
-    
-    if username in users:
+    if storage.get_user(username) is not None:
         return False, "Username already exists"
     
     user_id = hashlib.md5(f"{username}{email}".encode()).hexdigest()[:10]
+    config = load_config()
     
-    users[username] = {
+    user = {
         "id": user_id,
         "email": email,
         "password": generate_password_hash(password),
@@ -122,38 +134,85 @@ def create_user(username, email, password, is_admin=False):
         "created_at": datetime.now().isoformat(),
         "storage_limit": 500,  # MB
         "bot_limit": 10,
+        # Per-bot resource limits, applied by the supervisor (0 = unlimited)
+        "cpu_limit": config["default_user_cpu_limit"],
+        "memory_limit": config["default_user_memory_limit"],
+        "pids_limit": config["default_user_pids_limit"],
+        "fds_limit": config["default_user_fds_limit"],
         "active": True,
         "bots": []
     }
     
+    with storage.transaction():
+        if storage.get_user(username) is not None:
+            return False, "Username already exists"
+        storage.put_user(username, user)
+    
     # Create user directory
     user_dir = os.path.join(USERS_DIR, username)
     os.makedirs(user_dir, exist_ok=True)
     
-    save_users(users)
-    
-    # Update stats
-    stats = load_stats()
-    stats["total_users"] = len(users)
-    save_stats(stats)
-    
     return True, user_id
 
+# A failed login costs the same whether or not the account exists: unknown
+# and inactive usernames are checked against a throwaway hash. A pair that
+# failed moments ago fails again without hashing, for as long as the users
+# table is unchanged.
+FAILED_LOGIN_TTL = 60
+FAILED_LOGIN_CACHE_SIZE = 10000
+
+_dummy_hash = None
+_failed_logins = {}   # HMAC of (username, password) -> (expiry, users version)
+_failed_logins_key = os.urandom(32)
+_failed_logins_lock = threading.Lock()
+
+def dummy_password_hash():
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = generate_password_hash(os.urandom(16).hex())
+    return _dummy_hash
+
+def _login_digest(username, password):
+    message = f"{username}\0{password}".encode('utf-8', errors='surrogatepass')
+    return hmac.new(_failed_logins_key, message, hashlib.sha256).digest()
+
+def recently_failed(username, password, users_version):
+    digest = _login_digest(username, password)
+    with _failed_logins_lock:
+        entry = _failed_logins.get(digest)
+        if entry is None:
+            return False
+        if entry[0] < time.monotonic() or entry[1] != users_version:
+            del _failed_logins[digest]
+            return False
+        return True
+
+def remember_failed_login(username, password, users_version):
+    digest = _login_digest(username, password)
+    with _failed_logins_lock:
+        while len(_failed_logins) >= FAILED_LOGIN_CACHE_SIZE:
+            # Oldest first: dicts keep insertion order
+            del _failed_logins[next(iter(_failed_logins))]
+        _failed_logins[digest] = (time.monotonic() + FAILED_LOGIN_TTL, users_version)
+
 def authenticate_user(username, password):
-    users = load_users()
-    
-    if username not in users:
+    users_version = storage.table_version("users")
+    if recently_failed(username, password, users_version):
+        instrument.inc("login_attempts_total", result="cached_failure")
         return False, None
     
-    user = users[username]
+    user = storage.get_user(username)
+    if user is None or not user["active"]:
+        check_password_hash(dummy_password_hash(), password)
+        valid = False
+    else:
+        valid = check_password_hash(user["password"], password)
     
-    if not user["active"]:
+    instrument.inc("login_attempts_total", result="ok" if valid else "failed")
+    if not valid:
+        remember_failed_login(username, password, users_version)
         return False, None
-    
-    if check_password_hash(user["password"], password):
-        return True, user
-    
-    return False, None
+    return True, user
 
 # -------------------------------
 # BOT MANAGEMENT FUNCTIONS
@@ -169,51 +228,7 @@ def detect_language(filename):
     }
     return language_map.get(ext, 'unknown')
 
-def auto_install_dependencies(filepath, language):
-    if language != 'python':
-        return
-    
-    try:
-        with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
-    except:
-        return
-    
-    libs = set()
-    
-    # Find imports
-    import_patterns = [
-        r'^\s*import\s+([a-zA-Z0-9_\.]+)',
-        r'^\s*from\s+([a-zA-Z0-9_\.]+)\s+import'
-    ]
-    
-    for pattern in import_patterns:
-        matches = re.findall(pattern, content, re.MULTILINE)
-        for match in matches:
-            lib = match.split('.')[0]
-            if lib and lib not in ['os', 'sys', 'time', 'json', 're', 'math', 'random', 'subprocess', 'threading', 'asyncio', 'flask']:
-                libs.add(lib)
-    
-    # Install each library
-    for lib in libs:
-        try:
-            subprocess.run(['pip', 'install', '-q', lib], timeout=30)
-        except:
-            pass
-
 def create_bot(username, filename, original_name):
-    bots = load_bots()
-    users = load_users()
-    
-    if username not in users:
-        return False
-    
-    user = users[username]
-    
-    # Check bot limit
-    if len(user.get("bots", [])) >= user["bot_limit"]:
-        return False
-    
     bot_id = hashlib.md5(f"{username}{filename}{time.time()}".encode()).hexdigest()[:8]
     language = detect_language(filename)
     
@@ -232,125 +247,203 @@ def create_bot(username, filename, original_name):
         "restart_count": 0,
         "log_file": f"{username}_{bot_id}.log"
     }
+    # Resolved once here so the supervisor never rescans the tree to start it
+    envs.record_requirements(bot_data)
     
-    bots[bot_id] = bot_data
-    save_bots(bots)
-    
-    # Add to user's bot list
-    if "bots" not in user:
-        user["bots"] = []
-    user["bots"].append(bot_id)
-    save_users(users)
-    
-    # Update stats
-    stats = load_stats()
-    stats["total_bots"] = len(bots)
-    save_stats(stats)
+    with storage.transaction():
+        user = storage.get_user(username)
+        
+        if user is None:
+            return False
+        
+        # Check bot limit
+        if len(user.get("bots", [])) >= user["bot_limit"]:
+            return False
+        
+        storage.put_bot(bot_data)
+        
+        # Add to user's bot list
+        if "bots" not in user:
+            user["bots"] = []
+        user["bots"].append(bot_id)
+        storage.put_user(username, user)
     
     return bot_id
 
+# Process control lives in the supervisor (runner.py); the web workers only
+# send it commands so no bot ever becomes the child of a gunicorn worker.
+@instrument.timed("bot_action_seconds")
 def start_bot(bot_id):
-    bots = load_bots()
+    reply = control.request("start", bot_id=bot_id)
     
-    if bot_id not in bots:
+    if not reply["ok"]:
+        print(f"Error starting bot: {reply['error']}")
         return False
     
-    bot = bots[bot_id]
-    
-    if bot["status"] == "running":
-        return True
-    
-    bot_path = os.path.join(BOTS_DIR, bot["filename"])
-    log_path = os.path.join(LOGS_DIR, bot["log_file"])
-    
-    if not os.path.exists(bot_path):
-        return False
-    
-    # Create log file if not exists
-    os.makedirs(os.path.dirname(log_path), exist_ok=True)
-    
-    try:
-        if bot["language"] == "python":
-            cmd = ["python3", bot_path]
-        elif bot["language"] == "php":
-            cmd = ["php", bot_path]
-        elif bot["language"] == "node":
-            cmd = ["node", bot_path]
-        else:
-            cmd = ["bash", bot_path]
-        
-        with open(log_path, 'a') as log_file:
-            process = subprocess.Popen(
-                cmd,
-                stdout=log_file,
-                stderr=subprocess.STDOUT,
-                stdin=subprocess.DEVNULL,
-                start_new_session=True
-            )
-        
-        bot["pid"] = process.pid
-        bot["status"] = "running"
-        bot["last_started"] = datetime.now().isoformat()
-        save_bots(bots)
-        
-        # Auto install dependencies for Python
-        if bot["language"] == "python":
-            threading.Thread(target=auto_install_dependencies, args=(bot_path, "python")).start()
-        
-        return True
-    except Exception as e:
-        print(f"Error starting bot: {e}")
-        return False
+    return True
 
+@instrument.timed("bot_action_seconds")
 def stop_bot(bot_id):
-    bots = load_bots()
-    
-    if bot_id not in bots:
-        return False
-    
-    bot = bots[bot_id]
+    reply = control.request("stop", bot_id=bot_id)
     
-    if bot["status"] != "running" or not bot["pid"]:
-        bot["status"] = "stopped"
-        save_bots(bots)
-        return True
+    if not reply["ok"]:
+        print(f"Error stopping bot: {reply['error']}")
     
-    try:
-        process = psutil.Process(bot["pid"])
-        for child in process.children(recursive=True):
-            child.terminate()
-        process.terminate()
-        process.wait(timeout=5)
-    except:
-        try:
-            os.kill(bot["pid"], 9)
-        except:
-            pass
+    return reply["ok"]
+
+@instrument.timed("bot_action_seconds")
+def restart_bot(bot_id):
+    reply = control.request("restart", bot_id=bot_id)
     
-    bot["status"] = "stopped"
-    bot["pid"] = None
-    save_bots(bots)
+    if not reply["ok"]:
+        print(f"Error restarting bot: {reply['error']}")
     
-    return True
+    return reply["ok"]
 
-def get_bot_logs(bot_id, lines=100):
-    bots = load_bots()
-    
-    if bot_id not in bots:
-        return ""
+@instrument.timed("bot_action_seconds")
+def queue_bot_job(action, bot_id):
+    """Hand a slow action to the supervisor; the reply carries a job id to poll"""
+    return control.request(action, bot_id=bot_id, background=True)
+
+def remove_bot_files(bot):
+    """Delete a bot's code, logs, log archives, pipe and search index entries"""
+    sizes = usage.bot_usage(bot)
+    # A ZIP upload's whole directory goes with it; shared blobs stay until
+    # their last tree is gone
+    blobs.release(usage.bot_tree(bot))
+    
+    logwriter.remove_logs(bot['log_file'])
+    logwriter.remove_pipe(bot['id'])
+    logsearch.drop_bot(bot['id'])
+    usage.record(bot['username'], files=-sizes['files'], logs=-sizes['logs'])
+
+def add_uploaded_bot(username, filename, bot_name):
+    """Account for code saved under BOTS_DIR and register it; returns (bot_id, error)"""
+    tree = usage.bot_tree({"filename": filename})
+    code_bytes = usage.path_size(usage.bot_code_path({"filename": filename}))
+    if not usage.reserve(username, code_bytes):
+        blobs.release(tree)
+        return None, 'Storage limit exceeded. Delete some bots or logs first.'
+    
+    bot_id = create_bot(username, filename, bot_name)
+    if not bot_id:
+        blobs.release(tree)
+        usage.record(username, files=-code_bytes)
+        return None, 'Failed to upload bot. Check your bot limit.'
+    
+    # Auto-start if configured
+    if load_config().get('auto_start_bots', False):
+        start_bot(bot_id)
+    
+    return bot_id, None
+
+def upload_finished(bot_id, error):
+    if not bot_id:
+        flash(error, 'error')
+        return
     
-    bot = bots[bot_id]
+    flash(f'Bot uploaded successfully! ID: {bot_id}', 'success')
+    if load_config().get('auto_start_bots', False):
+        flash('Bot started automatically', 'info')
+
+def forget_bots(bots):
+    """Remove bot records and their owners' bot lists in one write"""
+    owned = {}
+    for bot in bots:
+        owned.setdefault(bot['username'], set()).add(bot['id'])
+    
+    def forget(bot_ids):
+        def update(user):
+            user['bots'] = [bot_id for bot_id in user.get('bots', []) if bot_id not in bot_ids]
+        return update
+    
+    with storage.transaction():
+        for bot in bots:
+            storage.delete_bot(bot['id'])
+        for username, bot_ids in owned.items():
+            storage.update_user(username, forget(bot_ids))
+
+def is_admin():
+    """Whether the session is an admin's: they see and manage every bot"""
+    return bool(session.get('is_admin'))
+
+def wants_json():
+    return request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'application/json'
+
+def action_error(message, status):
+    """Error reply for a bot action, as JSON for API clients or a flash for pages"""
+    if wants_json():
+        return jsonify({"ok": False, "error": message}), status
+    flash(message, 'error')
+    return redirect('/dashboard')
+
+@instrument.timed("log_read_seconds")
+def get_bot_log_page(bot, before=None, after=None, limit=100):
     log_path = os.path.join(LOGS_DIR, bot["log_file"])
     
     if not os.path.exists(log_path):
-        return "No logs available"
+        return {"lines": [], "start": 0, "end": 0, "size": 0, "has_older": False, "has_newer": False}
     
-    try:
-        with open(log_path, 'r') as f:
-            content = f.readlines()
-        return "".join(content[-lines:])
-    except:
-        return "Error reading logs"
+    return logtail.read_page(log_path, before=before, after=after, limit=limit)
+
+# -------------------------------
+# INSTRUMENTATION
+# -------------------------------
+# Every request is counted and timed by route (see instrument.py). Admins
+# can profile one request with ?profile=1; with profile_slow_requests on,
+# every request is sampled and the slow ones are kept.
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    config = load_config()
+    if is_admin() and request.args.get('profile'):
+        g.profile_threshold = 0
+    elif config.get('profile_slow_requests'):
+        g.profile_threshold = config.get('profile_slow_ms', 500) / 1000
+    else:
+        return
+    instrument.start_profile()
+
+def request_route():
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+def finish_request_profile():
+    """Stop a running profile; the saved profile's name, or None"""
+    if 'profile_threshold' not in g:
+        return None
+    threshold = g.pop('profile_threshold')
+    elapsed = time.perf_counter() - g.request_started
+    return instrument.finish_profile(f"{request.method} {request_route()}", elapsed, threshold)
+
+@app.after_request
+def record_request(response):
+    if 'request_started' not in g:
+        return response
+    route = request_route()
+    instrument.inc("http_requests_total", method=request.method, route=route, status=str(response.status_code))
+    instrument.observe("http_request_duration_seconds", time.perf_counter() - g.request_started,
+                       method=request.method, route=route)
+    profile = finish_request_profile()
+    if profile:
+        response.headers['X-Profile'] = profile
+    instrument.flush()
+    return response
+
+@app.teardown_request
+def record_failed_request(error):
+    if error is not None and 'request_started' in g:
+        instrument.inc("http_requests_total", method=request.method, route=request_route(), status="500")
+    finish_request_profile()
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.template_started = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_template(sender, template, context, **extra):
+    started = g.pop('template_started', None)
+    if started is not None:
+        instrument.observe("template_render_seconds", time.perf_counter() - started, template=template.name)
 
 # -------------------------------
 # ROUTES
@@ -370,9 +463,20 @@ def login():
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '')
         
+        # Throttled attempts are turned away before any password is checked
+        config = load_config()
+        ip = request.remote_addr or ""
+        retry_after = throttle.login_allowed(ip, username, config['login_attempts_per_minute'],
+                                             config['login_failures_allowed'])
+        if retry_after:
+            instrument.inc("login_attempts_total", result="throttled")
+            retry_after = math.ceil(retry_after)
+            flash(f'Too many login attempts. Try again in {retry_after} seconds.', 'error')
+            return render_template('login.html'), 429, {'Retry-After': str(retry_after)}
+        
         if username == 'admin':
-            config = load_config()
-            if password == config.get('admin_password', 'admin123'):
+            if hmac.compare_digest(password.encode(), str(config.get('admin_password', 'admin123')).encode()):
+                throttle.login_succeeded(ip, username)
                 session['logged_in'] = True
                 session['username'] = 'admin'
                 session['is_admin'] = True
@@ -381,12 +485,14 @@ def login():
         
         success, user = authenticate_user(username, password)
         if success:
+            throttle.login_succeeded(ip, username)
             session['logged_in'] = True
             session['username'] = username
             session['is_admin'] = user['is_admin']
             flash('Logged in successfully!', 'success')
             return redirect('/dashboard')
         else:
+            throttle.login_failed(ip, username, config['login_failures_allowed'])
             flash('Invalid username or password', 'error')
     
     return render_template('login.html')
@@ -430,33 +536,39 @@ def dashboard():
         return redirect('/login')
     
     username = session['username']
-    users = load_users()
     
-    if username not in users and username != 'admin':
+    if username != 'admin' and storage.get_user(username) is None:
         session.clear()
         return redirect('/login')
     
     # Get user's bots
-    user_bots = []
-    bots = load_bots()
-    
-    if username == 'admin':
-        user_bots = list(bots.values())
+    if is_admin():
+        user_bots = list(load_bots().values())
     else:
-        user = users[username]
-        for bot_id in user.get('bots', []):
-            if bot_id in bots:
-                user_bots.append(bots[bot_id])
+        user_bots = load_user_bots(username)
     
     # Get stats
     stats = load_stats()
     
     return render_template('dashboard.html',
                          username=username,
-                         is_admin=session.get('is_admin', False),
+                         is_admin=is_admin(),
                          bots=user_bots,
                          stats=stats,
-                         users_count=len(users))
+                         users_count=stats["total_users"])
+
+@app.route('/admin')
+def admin_panel():
+    if not session.get('logged_in'):
+        return redirect('/login')
+    if not is_admin():
+        return redirect('/dashboard')
+
+    return render_template('admin_panel.html',
+                         users=load_users(),
+                         bots=load_bots(),
+                         stats=load_stats(),
+                         config=load_config())
 
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_bot():
@@ -483,57 +595,67 @@ def upload_bot():
             flash('File type not allowed', 'error')
             return redirect('/upload')
         
-        # Save file
-        filename = secure_filename(f"{username}_{int(time.time())}_{file.filename}")
-        filepath = os.path.join(BOTS_DIR, filename)
-        file.save(filepath)
-        
-        # Handle ZIP files
-        if filename.lower().endswith('.zip'):
-            try:
-                extract_dir = os.path.join(BOTS_DIR, filename[:-4])
-                os.makedirs(extract_dir, exist_ok=True)
-                
-                with zipfile.ZipFile(filepath, 'r') as zip_ref:
-                    zip_ref.extractall(extract_dir)
-                
-                # Look for main files
-                main_files = ['main.py', 'bot.py', 'index.php', 'app.js', 'server.js']
-                for main_file in main_files:
-                    if os.path.exists(os.path.join(extract_dir, main_file)):
-                        filename = f"{filename[:-4]}/{main_file}"
-                        break
-                else:
-                    # Use first Python/PHP/JS file found
-                    for root, dirs, files in os.walk(extract_dir):
-                        for f in files:
-                            if f.endswith(('.py', '.php', '.js')):
-                                filename = f"{filename[:-4]}/{f}"
-                                break
-                        break
-                
-                os.remove(filepath)
-            except Exception as e:
-                flash(f'Error extracting ZIP: {str(e)}', 'error')
-                return redirect('/upload')
-        
-        # Create bot record
-        bot_id = create_bot(username, filename, bot_name)
+        # Cheap early reject; the real size is reserved once it is on disk
+        if not usage.has_room(username, request.content_length or 0):
+            flash('Storage limit exceeded. Delete some bots or logs first.', 'error')
+            return redirect('/upload')
         
-        if bot_id:
-            flash(f'Bot uploaded successfully! ID: {bot_id}', 'success')
+        # ZIP files are extracted by the ingest pool; the user then picks
+        # the entrypoint from the candidates it found
+        if file.filename.lower().endswith('.zip'):
+            job_id = storage.create_job('ingest', username=username)
+            file.save(ingest.archive_path(job_id))
+            room = usage.room(username)
+            max_bytes = ingest.MAX_UNCOMPRESSED_BYTES if room is None else min(room, ingest.MAX_UNCOMPRESSED_BYTES)
+            ingest.submit(job_id, max_bytes, name=secure_filename(file.filename[:-4]), bot_name=bot_name)
             
-            # Auto-start if configured
-            config = load_config()
-            if config.get('auto_start_bots', False):
-                start_bot(bot_id)
-                flash('Bot started automatically', 'info')
-        else:
-            flash('Failed to upload bot. Check your bot limit.', 'error')
+            if wants_json():
+                return jsonify({"ok": True, "job_id": job_id}), 202
+            return redirect(f'/upload?job={job_id}')
         
+        # Save file
+        filename = secure_filename(f"{username}_{int(time.time())}_{file.filename}")
+        file.save(os.path.join(BOTS_DIR, filename))
+        blobs.adopt(filename)
+        
+        bot_id, error = add_uploaded_bot(username, filename, bot_name)
+        upload_finished(bot_id, error)
         return redirect('/dashboard')
     
-    return render_template('upload.html')
+    return render_template('upload.html', job_id=request.args.get('job'))
+
+@app.route('/upload/<job_id>', methods=['POST'])
+def finish_upload(job_id):
+    """Create the bot from a finished ZIP upload, run from the chosen entrypoint"""
+    if not session.get('logged_in'):
+        return redirect('/login')
+    
+    username = session['username']
+    job = ingest.get_job(job_id)
+    
+    if job is None or job['kind'] != 'ingest' or job['username'] != username:
+        return action_error('Upload not found', 404)
+    
+    result = job['result'] or {}
+    entrypoint = request.form.get('entrypoint') or (request.get_json(silent=True) or {}).get('entrypoint')
+    if job['status'] != 'done' or entrypoint not in result.get('candidates', []):
+        return action_error('Choose one of the detected entrypoints', 400)
+    
+    dirname = secure_filename(f"{username}_{int(time.time())}_{result['name']}")
+    try:
+        claimed = ingest.claim(job_id, dirname)
+    except ingest.IngestError as e:
+        return action_error(str(e), 409)
+    if not claimed:
+        return action_error('This upload was already used or has expired', 410)
+    
+    bot_id, error = add_uploaded_bot(username, f"{dirname}/{entrypoint}", result['bot_name'])
+    
+    if wants_json():
+        return jsonify({"ok": bot_id is not None, "bot_id": bot_id, "error": error}), 200 if bot_id else 400
+    
+    upload_finished(bot_id, error)
+    return redirect('/dashboard')
 
 @app.route('/start/<bot_id>')
 def start_bot_route(bot_id):
@@ -541,20 +663,21 @@ def start_bot_route(bot_id):
         return redirect('/login')
     
     username = session['username']
-    bots = load_bots()
-    
-    if bot_id not in bots:
-        flash('Bot not found', 'error')
-        return redirect('/dashboard')
+    bot = storage.get_bot(bot_id)
     
-    bot = bots[bot_id]
+    if bot is None:
+        return action_error('Bot not found', 404)
     
     # Check permission
-    if username != 'admin' and bot['username'] != username:
-        flash('Access denied', 'error')
-        return redirect('/dashboard')
+    if not is_admin() and bot['username'] != username:
+        return action_error('Access denied', 403)
     
-    if start_bot(bot_id):
+    started = start_bot(bot_id)
+    
+    if wants_json():
+        return jsonify({"ok": started}), 200 if started else 503
+    
+    if started:
         flash('Bot started successfully', 'success')
     else:
         flash('Failed to start bot', 'error')
@@ -567,23 +690,24 @@ def stop_bot_route(bot_id):
         return redirect('/login')
     
     username = session['username']
-    bots = load_bots()
-    
-    if bot_id not in bots:
-        flash('Bot not found', 'error')
-        return redirect('/dashboard')
+    bot = storage.get_bot(bot_id)
     
-    bot = bots[bot_id]
+    if bot is None:
+        return action_error('Bot not found', 404)
     
     # Check permission
-    if username != 'admin' and bot['username'] != username:
-        flash('Access denied', 'error')
-        return redirect('/dashboard')
+    if not is_admin() and bot['username'] != username:
+        return action_error('Access denied', 403)
+    
+    reply = queue_bot_job('stop', bot_id)
     
-    if stop_bot(bot_id):
-        flash('Bot stopped successfully', 'success')
+    if wants_json():
+        return jsonify(reply), 202 if reply['ok'] else 503
+    
+    if reply['ok']:
+        flash('Bot is stopping', 'info')
     else:
-        flash('Failed to stop bot', 'error')
+        flash(f"Failed to stop bot: {reply['error']}", 'error')
     
     return redirect('/dashboard')
 
@@ -593,24 +717,25 @@ def restart_bot_route(bot_id):
         return redirect('/login')
     
     username = session['username']
-    bots = load_bots()
-    
-    if bot_id not in bots:
-        flash('Bot not found', 'error')
-        return redirect('/dashboard')
+    bot = storage.get_bot(bot_id)
     
-    bot = bots[bot_id]
+    if bot is None:
+        return action_error('Bot not found', 404)
     
     # Check permission
-    if username != 'admin' and bot['username'] != username:
-        flash('Access denied', 'error')
-        return redirect('/dashboard')
+    if not is_admin() and bot['username'] != username:
+        return action_error('Access denied', 403)
+    
+    reply = queue_bot_job('restart', bot_id)
+    
+    if wants_json():
+        return jsonify(reply), 202 if reply['ok'] else 503
     
-    stop_bot(bot_id)
-    time.sleep(2)
-    start_bot(bot_id)
+    if reply['ok']:
+        flash('Bot is restarting', 'info')
+    else:
+        flash(f"Failed to restart bot: {reply['error']}", 'error')
     
-    flash('Bot restarted successfully', 'success')
     return redirect('/dashboard')
 
 @app.route('/delete/<bot_id>')
@@ -619,49 +744,26 @@ def delete_bot_route(bot_id):
         return redirect('/login')
     
     username = session['username']
-    bots = load_bots()
-    
-    if bot_id not in bots:
-        flash('Bot not found', 'error')
-        return redirect('/dashboard')
+    bot = storage.get_bot(bot_id)
     
-    bot = bots[bot_id]
+    if bot is None:
+        return action_error('Bot not found', 404)
     
     # Check permission
-    if username != 'admin' and bot['username'] != username:
-        flash('Access denied', 'error')
-        return redirect('/dashboard')
-    
-    # Stop bot if running
-    if bot['status'] == 'running':
-        stop_bot(bot_id)
-    
-    # Remove bot file
-    bot_path = os.path.join(BOTS_DIR, bot['filename'])
-    if os.path.exists(bot_path):
-        # If it's a directory, remove the whole directory
-        if '/' in bot['filename']:
-            dir_path = os.path.dirname(bot_path)
-            shutil.rmtree(dir_path, ignore_errors=True)
-        else:
-            os.remove(bot_path)
+    if not is_admin() and bot['username'] != username:
+        return action_error('Access denied', 403)
     
-    # Remove log file
-    log_path = os.path.join(LOGS_DIR, bot['log_file'])
-    if os.path.exists(log_path):
-        os.remove(log_path)
+    # Stop bot if running. Don't wait for it: the files can go while the
+    # process is still winding down, and the supervisor ignores exits of
+    # bots that are no longer registered.
+    if bot['status'] != 'stopped':
+        queue_bot_job('stop', bot_id)
     
-    # Remove from bots list
-    del bots[bot_id]
-    save_bots(bots)
+    remove_bot_files(bot)
+    forget_bots([bot])
     
-    # Remove from user's bot list
-    users = load_users()
-    if bot['username'] in users:
-        user = users[bot['username']]
-        if 'bots' in user and bot_id in user['bots']:
-            user['bots'].remove(bot_id)
-            save_users(users)
+    if wants_json():
+        return jsonify({"ok": True, "deleted": bot_id})
     
     flash('Bot deleted successfully', 'success')
     return redirect('/dashboard')
@@ -672,17 +774,364 @@ def view_logs(bot_id):
         return redirect('/login')
     
     username = session['username']
-    bots = load_bots()
+    bot = storage.get_bot(bot_id)
     
-    if bot_id not in bots:
+    if bot is None:
         flash('Bot not found', 'error')
         return redirect('/dashboard')
     
-    bot = bots[bot_id]
-    
     # Check permission
-    if username != 'admin' and bot['username'] != username:
+    if not is_admin() and bot['username'] != username:
         flash('Access denied', 'error')
         return redirect('/dashboard')
     
-    logs = get_bot_logs(bot_id,
+    # The live stream picks up exactly where this snapshot ends and
+    # "Load older" pages backwards from where it starts
+    try:
+        page = get_bot_log_page(bot, limit=200)
+        logs = "".join(page['lines']) if page['size'] else "No logs available"
+    except OSError:
+        page = {"start": 0, "end": 0}
+        logs = "Error reading logs"
+    
+    return render_template('logs.html', bot=bot, logs=logs,
+                           log_start=page['start'], log_offset=page['end'])
+
+@app.route('/api/logs/<bot_id>')
+def log_page(bot_id):
+    if not session.get('logged_in'):
+        return jsonify({"error": "Not logged in"}), 401
+    
+    username = session['username']
+    bot = storage.get_bot(bot_id)
+    
+    if bot is None or (not is_admin() and bot['username'] != username):
+        return jsonify({"error": "Bot not found"}), 404
+    
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    
+    try:
+        return jsonify(get_bot_log_page(bot, before=before, after=after, limit=limit))
+    except OSError:
+        return jsonify({"error": "Error reading logs"}), 500
+
+def stream_position(last_event_id, offset, lines):
+    """(offset, lines) a log stream starts from.
+
+    The resume point is EventSource's Last-Event-ID on reconnect, else
+    ?offset=; without either the stream starts `lines` lines from the end.
+    """
+    offset = last_event_id if last_event_id is not None else offset
+    offset = int(offset) if offset and offset.isdigit() else None
+    lines = int(lines) if lines and lines.lstrip('-').isdigit() else 100
+    return offset, min(lines, 1000)
+
+@app.route('/api/logs/stream/<bot_id>')
+def stream_logs(bot_id):
+    if not session.get('logged_in'):
+        return jsonify({"error": "Not logged in"}), 401
+    
+    username = session['username']
+    bot = storage.get_bot(bot_id)
+    
+    if bot is None or (not is_admin() and bot['username'] != username):
+        return jsonify({"error": "Bot not found"}), 404
+    
+    offset, lines = stream_position(request.headers.get('Last-Event-ID'),
+                                    request.args.get('offset'), request.args.get('lines'))
+    log_path = os.path.join(LOGS_DIR, bot['log_file'])
+    return Response(logtail.sse_stream(log_path, offset, lines),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/logs/search')
+def search_logs():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Not logged in"}), 401
+    
+    query = request.args.get('q', '')
+    if not query or len(query) > 500:
+        return jsonify({"error": "Query must be 1-500 characters"}), 400
+    
+    # Users search their own bots; admins search everything unless narrowed
+    username = session['username']
+    if is_admin():
+        bots = storage.list_bots(username=request.args.get('username'))
+    else:
+        bots = storage.list_bots(username=username)
+    
+    bot_id = request.args.get('bot_id')
+    if bot_id:
+        bots = [bot for bot in bots if bot['id'] == bot_id]
+    
+    limit = max(1, min(request.args.get('limit', 100, type=int), 1000))
+    try:
+        return jsonify(logsearch.search(
+            bots, query,
+            regex=request.args.get('regex') == '1',
+            ignore_case=request.args.get('ignore_case') == '1',
+            limit=limit
+        ))
+    except re.error as e:
+        return jsonify({"error": f"Invalid regex: {e}"}), 400
+
+@app.route('/api/logs/<bot_id>/archive')
+def log_archive(bot_id):
+    if not session.get('logged_in'):
+        return jsonify({"error": "Not logged in"}), 401
+    
+    username = session['username']
+    bot = storage.get_bot(bot_id)
+    
+    if bot is None or (not is_admin() and bot['username'] != username):
+        return jsonify({"error": "Bot not found"}), 404
+    
+    # Optional time window in epoch seconds
+    since = request.args.get('since', type=float)
+    until = request.args.get('until', type=float)
+    
+    return jsonify({
+        "segments": logwriter.segments_between(bot['log_file'], since, until),
+        "disk_usage": logwriter.log_disk_usage(bot['log_file'])
+    })
+
+@app.route('/api/logs/<bot_id>/archive/<int:seq>')
+def download_log_segment(bot_id, seq):
+    if not session.get('logged_in'):
+        return jsonify({"error": "Not logged in"}), 401
+    
+    username = session['username']
+    bot = storage.get_bot(bot_id)
+    
+    if bot is None or (not is_admin() and bot['username'] != username):
+        return jsonify({"error": "Bot not found"}), 404
+    
+    for segment in logwriter.load_index(bot['log_file'])['segments']:
+        if segment['seq'] == seq:
+            path = os.path.join(logwriter.archive_dir(bot['log_file']), segment['file'])
+            if os.path.exists(path):
+                return send_file(path, as_attachment=True, download_name=segment['file'])
+            break
+    
+    return jsonify({"error": "Segment not found"}), 404
+
+@app.route('/api/stats')
+def api_stats():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Not logged in"}), 401
+    
+    # Every tab polls this. The answer only changes when the supervisor
+    # rewrites its snapshot or the registry changes, so the ETag comes from
+    # those change tokens and a repeat poll costs a stat() and a 304.
+    versions = (cache.file_version(metrics.SNAPSHOT_FILE),
+                tuple(storage.table_version(t) for t in ("bots", "users", "stats")))
+    etag = hashlib.md5(repr(versions).encode()).hexdigest()[:16]
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    
+    response = jsonify({**load_stats(), "system": load_system_snapshot()})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/api/metrics/<bot_id>')
+def bot_metrics(bot_id):
+    if not session.get('logged_in'):
+        return jsonify({"error": "Not logged in"}), 401
+    
+    username = session['username']
+    bot = storage.get_bot(bot_id)
+    
+    if bot is None or (not is_admin() and bot['username'] != username):
+        return jsonify({"error": "Bot not found"}), 404
+    
+    # second (last hour), minute (last day) or hour (last 30 days)
+    resolution = request.args.get('resolution', 'second')
+    if resolution not in metrics.RESOLUTIONS:
+        return jsonify({"error": "Unknown resolution"}), 400
+    
+    reply = control.request('metrics', bot_id=bot_id, resolution=resolution,
+                            points=max(1, min(request.args.get('points', 300, type=int), 3600)))
+    if not reply.get('ok'):
+        return jsonify({"error": reply.get('error')}), 503
+    return jsonify(reply)
+
+BULK_ACTIONS = ('start', 'stop', 'restart', 'delete')
+BULK_FILE_WORKERS = 8
+
+@app.route('/api/bots/bulk', methods=['POST'])
+def bulk_bot_action():
+    """Start/stop/restart/delete many bots in one call.
+
+    Body: {"action": ..., "bot_ids": [...]} or {"action": ..., "selector":
+    {"username": ..., "status": ..., "language": ...}}. Users can only
+    target their own bots. Process actions run as one supervisor job
+    (poll /api/jobs/<job_id>); deletes answer with the report directly.
+    """
+    if not session.get('logged_in'):
+        return jsonify({"error": "Not logged in"}), 401
+    
+    payload = request.get_json(silent=True) or {}
+    action = payload.get('action')
+    if action not in BULK_ACTIONS:
+        return jsonify({"error": f"action must be one of {', '.join(BULK_ACTIONS)}"}), 400
+    
+    username = session['username']
+    results = {}
+    
+    if 'bot_ids' in payload:
+        bot_ids = payload['bot_ids']
+        if not isinstance(bot_ids, list) or not all(isinstance(bot_id, str) for bot_id in bot_ids):
+            return jsonify({"error": "bot_ids must be a list of bot ids"}), 400
+        bots = []
+        for bot_id in dict.fromkeys(bot_ids):
+            bot = storage.get_bot(bot_id)
+            if bot is None or (not is_admin() and bot['username'] != username):
+                results[bot_id] = {"ok": False, "error": "Bot not found"}
+            else:
+                bots.append(bot)
+    elif isinstance(payload.get('selector'), dict):
+        selector = payload['selector']
+        bots = storage.list_bots(username=selector.get('username') if is_admin() else username,
+                                 status=selector.get('status'), language=selector.get('language'))
+    else:
+        return jsonify({"error": "Provide bot_ids or a selector"}), 400
+    
+    if action != 'delete':
+        reply = control.request('bulk', action=action, bot_ids=[bot['id'] for bot in bots],
+                                username=username, background=True)
+        if not reply['ok']:
+            return jsonify(reply), 503
+        
+        return jsonify({**reply, "matched": len(bots), "results": results}), 202
+    
+    # Delete: stop whatever still runs (without waiting, as a single delete
+    # does), remove files on a bounded pool, then drop every record at once
+    running = [bot['id'] for bot in bots if bot['status'] != 'stopped']
+    if running:
+        control.request('bulk', action='stop', bot_ids=running, username=username, background=True)
+    
+    with ThreadPoolExecutor(max_workers=BULK_FILE_WORKERS) as pool:
+        for bot, error in zip(bots, pool.map(lambda bot: _try(remove_bot_files, bot), bots)):
+            results[bot['id']] = {"ok": True, "deleted": True} if error is None else {"ok": False, "error": error}
+    
+    forget_bots([bot for bot in bots if results[bot['id']]['ok']])
+    return jsonify({"ok": True, "action": action, "matched": len(bots), "results": results})
+
+def _try(fn, *args):
+    """Run fn and return its error message, or None on success"""
+    try:
+        fn(*args)
+    except Exception as e:
+        return str(e)
+    return None
+
+# Fields a dashboard card shows; /api/events pushes changes to these only
+CARD_FIELDS = ("status", "cpu_usage", "memory_usage", "restart_count", "last_error")
+EVENTS_POLL_INTERVAL = 1
+
+def bot_cards(username, is_admin):
+    """{bot id: card fields} for the bots a viewer can see"""
+    bots = load_bots().values() if is_admin else load_user_bots(username)
+    return {bot["id"]: {field: bot.get(field) for field in CARD_FIELDS} for bot in bots}
+
+def card_changes(known, state):
+    """(changed fields by bot id, removed bot ids) going from one bot_cards() to the next"""
+    changed = {}
+    for bot_id, fields in state.items():
+        if bot_id not in known:
+            changed[bot_id] = fields
+            continue
+        delta = {field: value for field, value in fields.items() if known[bot_id][field] != value}
+        if delta:
+            changed[bot_id] = delta
+    removed = [bot_id for bot_id in known if bot_id not in state]
+    return changed, removed
+
+def bot_event_stream(username, is_admin):
+    """SSE deltas for the bots a viewer can see.
+
+    Polls the registry's bots version (one-row SELECT) and only diffs the
+    cached bot list when it moved, so an idle dashboard costs next to
+    nothing. The first event carries every card's state. asgi.py serves
+    the same events without holding a thread per dashboard.
+    """
+    yield "retry: 2000\n\n"
+    
+    known = {}
+    version = None
+    started = last_sent = time.monotonic()
+    while time.monotonic() - started < logtail.MAX_STREAM_SECONDS:
+        current = storage.table_version("bots")
+        if current != version:
+            version = current
+            state = bot_cards(username, is_admin)
+            changed, removed = card_changes(known, state)
+            known = state
+            
+            if changed or removed:
+                last_sent = time.monotonic()
+                yield logtail.sse_event(json.dumps({"changed": changed, "removed": removed}), event="bots")
+        
+        if time.monotonic() - last_sent >= logtail.HEARTBEAT_INTERVAL:
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+        time.sleep(EVENTS_POLL_INTERVAL)
+
+@app.route('/api/events')
+def bot_events():
+    if not session.get('logged_in'):
+        return jsonify({"error": "Not logged in"}), 401
+    
+    return Response(bot_event_stream(session['username'], is_admin()),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs/<job_id>')
+def job_status(job_id):
+    if not session.get('logged_in'):
+        return jsonify({"error": "Not logged in"}), 401
+    
+    username = session['username']
+    job = ingest.get_job(job_id)
+    
+    if job is None or (not is_admin() and job['username'] != username):
+        return jsonify({"error": "Job not found"}), 404
+    
+    return jsonify(job)
+
+@app.route('/api/cache')
+def cache_stats():
+    if not is_admin():
+        return jsonify({"error": "Access denied"}), 403
+    
+    return jsonify(cache.stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    token = load_config().get('metrics_token')
+    scraper = bool(token) and request.headers.get('Authorization') == f"Bearer {token}"
+    if not (scraper or is_admin()):
+        return jsonify({"error": "Access denied"}), 403
+    
+    return Response(instrument.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/profiles')
+@app.route('/api/profiles/<name>')
+def request_profiles(name=None):
+    if not is_admin():
+        return jsonify({"error": "Access denied"}), 403
+    
+    profiles = sorted(instrument.list_profiles(), reverse=True)
+    if name is None:
+        return jsonify({"profiles": profiles})
+    if name not in profiles:
+        return jsonify({"error": "Profile not found"}), 404
+    return send_file(os.path.join(instrument.PROFILES_DIR, name), mimetype='text/plain')
+
+if __name__ == '__main__':
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 10000)))
@@ -0,0 +1,358 @@
+import os, sys, json, time, asyncio
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.http import parse_cookie
+from werkzeug.routing import Map, Rule
+from werkzeug.exceptions import NotFound, MethodNotAllowed
+from itsdangerous import BadSignature
+
+from paths import LOGS_DIR
+import app as panel
+import storage
+import logtail
+import instrument
+
+# -------------------------------
+# ASYNC SERVING MODE
+# -------------------------------
+# A sync gunicorn worker spends a whole thread on every open log tail or
+# dashboard event stream, so a handful of open tabs can starve the panel.
+# This is an ASGI application for an asyncio server (gunicorn with
+# uvicorn's worker class, see gunicorn.conf.py): the two streaming routes
+# are served here as coroutines, where an idle connection costs a socket
+# and a few KB, and every other request goes to the Flask app on a
+# bounded thread pool, unchanged.
+#
+# The registry is polled once per process for all event streams rather
+# than once per connection; log tails stat their file every POLL_INTERVAL
+# on the event loop, which is cheap enough not to need a thread.
+WSGI_THREADS = int(os.environ.get("WSGI_THREADS", 16))
+# No worker timeout to stay under here; reconnecting every so often just
+# rebalances long-lived streams across workers
+MAX_STREAM_SECONDS = 3600
+
+SSE_HEADERS = [
+    (b"content-type", b"text/event-stream; charset=utf-8"),
+    (b"cache-control", b"no-cache"),
+    (b"x-accel-buffering", b"no"),
+]
+
+STREAM_ROUTES = Map([
+    Rule('/api/logs/stream/<bot_id>', endpoint='log_stream', methods=['GET']),
+    Rule('/api/events', endpoint='bot_events', methods=['GET']),
+])
+
+# -------------------------------
+# FLASK ON A THREAD POOL
+# -------------------------------
+class RequestBody:
+    """wsgi.input that pulls the ASGI request body from the event loop as the app reads it"""
+
+    def __init__(self, receive):
+        self.receive = receive
+        self.buffer = b""
+        self.done = False
+
+    def _fill(self):
+        message = self.receive()
+        if message["type"] == "http.disconnect":
+            self.done = True
+            return
+        self.buffer += message.get("body", b"")
+        self.done = not message.get("more_body", False)
+
+    def read(self, size=-1):
+        while not self.done and (size < 0 or len(self.buffer) < size):
+            self._fill()
+        if size < 0:
+            size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        while not self.done and b"\n" not in self.buffer and (size < 0 or len(self.buffer) < size):
+            self._fill()
+        end = self.buffer.find(b"\n") + 1 or len(self.buffer)
+        if size >= 0:
+            end = min(end, size)
+        data, self.buffer = self.buffer[:end], self.buffer[end:]
+        return data
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+class WsgiBridge:
+    """Runs a WSGI app for ASGI http requests, one pool thread per request in flight"""
+
+    def __init__(self, wsgi_app, threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="wsgi")
+
+    async def __call__(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, self.run, scope, receive, send, loop)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    @staticmethod
+    def environ(scope, body):
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+            "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+            "QUERY_STRING": scope["query_string"].decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "REMOTE_ADDR": client[0],
+            "REMOTE_PORT": str(client[1]),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.input_terminated": True,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for name, value in scope["headers"]:
+            name = name.decode("latin-1").upper().replace("-", "_")
+            value = value.decode("latin-1")
+            if name in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                environ[name] = value
+                continue
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+        return environ
+
+    def run(self, scope, receive, send, loop):
+        def call(coro):
+            return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            if exc_info and response.get("sent"):
+                raise exc_info[1].with_traceback(exc_info[2])
+            response["status"] = int(status.split(" ", 1)[0])
+            response["headers"] = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                                   for name, value in headers]
+            return write
+
+        def write(data):
+            # Headers go out with the first body chunk, as PEP 3333 asks
+            if not response.get("sent"):
+                response["sent"] = True
+                call(send({"type": "http.response.start", "status": response["status"],
+                           "headers": response["headers"]}))
+            if data:
+                call(send({"type": "http.response.body", "body": data, "more_body": True}))
+
+        result = self.wsgi_app(self.environ(scope, RequestBody(lambda: call(receive()))), start_response)
+        try:
+            for chunk in result:
+                write(chunk)
+            write(b"")
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        call(send({"type": "http.response.body", "body": b""}))
+
+# -------------------------------
+# SESSIONS
+# -------------------------------
+def load_session(scope):
+    """The Flask session a request carries, read from its signed cookie; {} if none"""
+    flask_app = panel.app
+    cookies = b"; ".join(value for name, value in scope["headers"] if name == b"cookie")
+    cookie = parse_cookie(cookies.decode("latin-1")).get(flask_app.config["SESSION_COOKIE_NAME"])
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    if not cookie or serializer is None:
+        return {}
+    try:
+        return serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+def header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+# -------------------------------
+# REGISTRY WATCH
+# -------------------------------
+class BotsWatch:
+    """One poll of the bots table version per process, shared by every event stream"""
+
+    def __init__(self):
+        self.version = None
+        self.changed = None
+        self.listeners = 0
+        self.task = None
+
+    async def __aenter__(self):
+        self.listeners += 1
+        if self.task is None:
+            self.changed = asyncio.Event()
+            self.task = asyncio.ensure_future(self.poll())
+        return self
+
+    async def __aexit__(self, *exc):
+        self.listeners -= 1
+        if not self.listeners and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def poll(self):
+        while True:
+            try:
+                version = await asyncio.to_thread(storage.table_version, "bots")
+            except Exception:
+                version = self.version
+            if version != self.version:
+                self.version = version
+                self.changed.set()
+                self.changed = asyncio.Event()
+            await asyncio.sleep(panel.EVENTS_POLL_INTERVAL)
+
+    async def wait(self, timeout):
+        """Until the version moves or timeout passes"""
+        try:
+            await asyncio.wait_for(self.changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+bots_watch = BotsWatch()
+
+# -------------------------------
+# STREAMING ROUTES
+# -------------------------------
+async def start(scope, send, route, status, headers):
+    instrument.inc("http_requests_total", method=scope["method"], route=route, status=str(status))
+    instrument.flush()
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+
+async def respond_json(scope, send, route, status, data):
+    await start(scope, send, route, status, [(b"content-type", b"application/json")])
+    await send({"type": "http.response.body", "body": json.dumps(data).encode()})
+
+async def send_event(send, text):
+    await send({"type": "http.response.body", "body": text.encode("utf-8"), "more_body": True})
+
+async def log_stream(scope, send, route, bot_id):
+    session = load_session(scope)
+    if not session.get('logged_in'):
+        return await respond_json(scope, send, route, 401, {"error": "Not logged in"})
+
+    username = session['username']
+    bot = await asyncio.to_thread(storage.get_bot, bot_id)
+    if bot is None or (not session.get('is_admin') and bot['username'] != username):
+        return await respond_json(scope, send, route, 404, {"error": "Bot not found"})
+
+    query = dict(parse_qsl(scope["query_string"].decode("latin-1")))
+    offset, lines = panel.stream_position(header(scope, b"last-event-id"), query.get('offset'), query.get('lines'))
+    log_path = os.path.join(LOGS_DIR, bot['log_file'])
+
+    await start(scope, send, route, 200, SSE_HEADERS)
+    for event in logtail.sse_steps(log_path, offset, lines, MAX_STREAM_SECONDS):
+        if event is logtail.WAIT:
+            await asyncio.sleep(logtail.POLL_INTERVAL)
+        else:
+            await send_event(send, event)
+    await send({"type": "http.response.body", "body": b""})
+
+async def bot_events(scope, send, route):
+    session = load_session(scope)
+    if not session.get('logged_in'):
+        return await respond_json(scope, send, route, 401, {"error": "Not logged in"})
+    username, is_admin = session['username'], session.get('is_admin', False)
+
+    await start(scope, send, route, 200, SSE_HEADERS)
+    await send_event(send, "retry: 2000\n\n")
+
+    known = {}
+    seen = object()  # nothing yet, so the first pass sends every card
+    started = last_sent = time.monotonic()
+    async with bots_watch:
+        while time.monotonic() - started < MAX_STREAM_SECONDS:
+            if bots_watch.version != seen:
+                seen = bots_watch.version
+                state = await asyncio.to_thread(panel.bot_cards, username, is_admin)
+                changed, removed = panel.card_changes(known, state)
+                known = state
+                if changed or removed:
+                    last_sent = time.monotonic()
+                    await send_event(send, logtail.sse_event(
+                        json.dumps({"changed": changed, "removed": removed}), event="bots"))
+
+            idle = time.monotonic() - last_sent
+            if idle >= logtail.HEARTBEAT_INTERVAL:
+                last_sent = time.monotonic()
+                await send_event(send, ": keep-alive\n\n")
+                continue
+            await bots_watch.wait(logtail.HEARTBEAT_INTERVAL - idle)
+    await send({"type": "http.response.body", "body": b""})
+
+async def until_disconnect(receive, stream):
+    """Run a streaming response until it ends or the client goes away"""
+    response = asyncio.ensure_future(stream)
+
+    async def watch():
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    disconnect = asyncio.ensure_future(watch())
+    try:
+        await asyncio.wait({response, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (response, disconnect):
+            task.cancel()
+        # Let the stream clean up before the server considers the request done
+        await asyncio.wait({response, disconnect})
+    if not response.cancelled():
+        response.result()  # raise what the stream raised
+
+# -------------------------------
+# APPLICATION
+# -------------------------------
+flask_bridge = WsgiBridge(panel.app.wsgi_app, WSGI_THREADS)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            flask_bridge.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        # No websockets: refuse the handshake
+        await send({"type": "websocket.close"})
+        return
+
+    try:
+        rule, args = STREAM_ROUTES.bind("").match(scope["path"], method=scope["method"], return_rule=True)
+    except (NotFound, MethodNotAllowed):
+        return await flask_bridge(scope, receive, send)
+
+    handler = log_stream if rule.endpoint == 'log_stream' else bot_events
+    await until_disconnect(receive, handler(scope, send, rule.rule, **args))
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run("asgi:app", host='0.0.0.0', port=int(os.environ.get('PORT', 10000)))
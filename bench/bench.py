@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""Benchmark and load test for the web panel and the bot supervisor.
+
+Seeds a scratch DEVIL_CLOUD_HOME with synthetic users and sleeping bots,
+starts runner.py and the web app against it, then measures:
+
+  web        p50/p99 latency and throughput of the dashboard, /api/stats,
+             log pages, uploads and start/stop under concurrent clients,
+             and the web server's RSS
+  lifecycle  spawn latency (control reply, first output in the log),
+             bulk start/stop throughput, crash-detection latency and the
+             supervisor's RSS and idle CPU with every bot running
+
+Results are one JSON document. With --compare, latencies and throughputs
+are checked against an earlier result and the exit status is 1 if any got
+worse by more than --tolerance.
+
+    python bench/bench.py --scale 1k --output bench-1k.json
+    python bench/bench.py --scale 1k --compare bench-1k.json
+"""
+import argparse, http.client, json, os, random, shutil, signal, socket, statistics
+import subprocess, sys, tempfile, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCALES = {"10": 10, "1k": 1000, "10k": 10000}  # bots
+BOTS_PER_USER = 10
+PASSWORD = "bench-password"
+SLEEPER = 'import time\nprint("ready", flush=True)\nwhile True:\n    time.sleep(3600)\n'
+
+# Request mix of one simulated panel user, by weight
+WEB_MIX = [("dashboard", 4), ("stats", 8), ("logs", 4), ("start_stop", 2), ("upload", 1)]
+
+# -------------------------------
+# HELPERS
+# -------------------------------
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+def summarize(latencies, errors=0, seconds=None):
+    summary = {
+        "count": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else None,
+    }
+    if seconds:
+        summary["per_second"] = round(len(latencies) / seconds, 1)
+    return summary
+
+def tree_rss(pid):
+    """RSS in MB of a process and its descendants"""
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+    except psutil.Error:
+        return None
+    total = 0
+    for proc in processes:
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return round(total / (1024 * 1024), 1)
+
+class PeakRSS:
+    """Samples a process tree's RSS in the background; tracks the peak"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, tree_rss(self.pid) or 0)
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+        return self.peak
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def log_contains(path, text):
+    try:
+        with open(path, 'rb') as f:
+            return text in f.read()
+    except OSError:
+        return False
+
+def wait_for(predicate, timeout, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return False
+
+# -------------------------------
+# SEEDING
+# -------------------------------
+def seed(n_bots):
+    """Users and stopped sleeper bots in the registry; returns {username: [bot ids]}"""
+    import storage, usage
+    from paths import BOTS_DIR, DATA_DIR
+    from werkzeug.security import generate_password_hash
+
+    # Every client logs in from 127.0.0.1, so the per-address login limits
+    # would turn most of them away
+    with open(os.path.join(DATA_DIR, "config.json"), 'w') as f:
+        json.dump({"login_attempts_per_minute": 0, "login_failures_allowed": 0}, f)
+
+    # One hash for everyone: hashing thousands of passwords isn't what we measure
+    password = generate_password_hash(PASSWORD)
+    owners = {}
+    with storage.transaction():
+        for n in range(n_bots):
+            username = f"bench{n // BOTS_PER_USER}"
+            if username not in owners:
+                owners[username] = []
+                storage.put_user(username, {
+                    "id": uuid.uuid4().hex[:10], "email": f"{username}@bench.invalid", "password": password,
+                    "is_admin": False, "created_at": "2024-01-01T00:00:00", "storage_limit": 0,
+                    "bot_limit": 10 * BOTS_PER_USER, "cpu_limit": 0, "memory_limit": 0, "pids_limit": 0,
+                    "fds_limit": 0, "active": True, "bots": [],
+                })
+
+            bot_id = f"b{n:05d}"
+            filename = f"{bot_id}.py"
+            with open(os.path.join(BOTS_DIR, filename), 'w') as f:
+                f.write(SLEEPER)
+            storage.put_bot({
+                "id": bot_id, "name": f"bench {n}", "filename": filename, "username": username,
+                "language": "python", "status": "stopped", "pid": None, "created_at": "2024-01-01T00:00:00",
+                "last_started": None, "cpu_usage": 0, "memory_usage": 0, "restart_count": 0,
+                "log_file": f"{username}_{bot_id}.log",
+            })
+            owners[username].append(bot_id)
+
+        for username, bot_ids in owners.items():
+            storage.update_user(username, lambda user, bot_ids=bot_ids: user.update(bots=list(bot_ids)))
+            usage.record(username, files=len(SLEEPER) * len(bot_ids))
+    return owners
+
+# -------------------------------
+# PROCESSES UNDER TEST
+# -------------------------------
+def start_runner(env):
+    import control
+    process = subprocess.Popen([sys.executable, os.path.join(REPO_DIR, "runner.py")], cwd=REPO_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+    if not wait_for(lambda: control.request("ping", timeout=1).get("ok"), 30):
+        process.kill()
+        raise SystemExit("runner.py did not come up")
+    return process
+
+def start_web(env, port, workers, threads):
+    try:
+        import gunicorn  # noqa: F401
+        command = [sys.executable, "-m", "gunicorn", "app:app", "--bind", f"127.0.0.1:{port}",
+                   "--workers", str(workers), "--threads", str(threads)]
+        server = "gunicorn"
+    except ImportError:
+        command = [sys.executable, "app.py"]
+        server = "flask"
+    process = subprocess.Popen(command, cwd=REPO_DIR, env={**env, "PORT": str(port)},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+    def listening():
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return True
+        except OSError:
+            return False
+    if not wait_for(listening, 30):
+        process.kill()
+        raise SystemExit("the web app did not come up")
+    return process, server
+
+def stop_bots():
+    """Bots run in their own sessions and outlive the supervisor; stop them first"""
+    import control, storage
+    running = [bot["id"] for bot in storage.list_bots() if bot.get("status") not in ("stopped", "error")]
+    if running:
+        control.request("bulk", timeout=600, action="stop", bot_ids=running)
+
+def stop_process(process):
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=10)
+    except (ProcessLookupError, subprocess.TimeoutExpired):
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+# -------------------------------
+# WEB LOAD
+# -------------------------------
+class PanelClient:
+    """One logged-in panel user over a keep-alive connection"""
+
+    def __init__(self, port, username, bot_ids):
+        self.port = port
+        self.username = username
+        self.bot_ids = bot_ids
+        self.cookie = None
+        self.etag = None
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        status, _ = self.request("POST", "/login", f"username={username}&password={PASSWORD}",
+                                 {"Content-Type": "application/x-www-form-urlencoded"})
+        if status != 302 or self.cookie is None:
+            raise RuntimeError(f"login failed for {username} ({status})")
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.HTTPException, OSError):
+            # The dev server closes idle connections; retry once on a fresh one
+            self.connection.close()
+            self.connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        data = response.read()
+        cookie = response.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        self.last_etag = response.getheader("ETag")
+        return response.status, data
+
+    def dashboard(self):
+        return self.request("GET", "/dashboard")[0] == 200
+
+    def stats(self):
+        headers = {"If-None-Match": self.etag} if self.etag else {}
+        status, _ = self.request("GET", "/api/stats", headers=headers)
+        if status == 200:
+            self.etag = self.last_etag
+        return status in (200, 304)
+
+    def logs(self):
+        return self.request("GET", f"/api/logs/{random.choice(self.bot_ids)}")[0] == 200
+
+    def start_stop(self):
+        bot_id = random.choice(self.bot_ids)
+        headers = {"Accept": "application/json"}
+        started = self.request("GET", f"/start/{bot_id}", headers=headers)[0] == 200
+        # Stops finish in the background: 202 and a job id
+        stopped = self.request("GET", f"/stop/{bot_id}", headers=headers)[0] in (200, 202)
+        return started and stopped
+
+    def upload(self):
+        boundary = uuid.uuid4().hex
+        filename = f"up_{uuid.uuid4().hex[:8]}.py"
+        body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"bot_name\"\r\n\r\n{filename}\r\n"
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"bot_file\"; filename=\"{filename}\"\r\n"
+                f"Content-Type: text/x-python\r\n\r\n{SLEEPER}\r\n--{boundary}--\r\n")
+        status, _ = self.request("POST", "/upload", body.encode(),
+                                 {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+        return status in (200, 302)
+
+def web_load(port, owners, clients, duration):
+    operations, weights = zip(*WEB_MIX)
+    latencies = {op: [] for op in operations}
+    errors = {op: 0 for op in operations}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client_loop(username):
+        try:
+            client = PanelClient(port, username, owners[username])
+        except Exception:
+            with lock:
+                errors["dashboard"] += 1
+            return
+        while time.monotonic() < deadline:
+            op = random.choices(operations, weights)[0]
+            started = time.perf_counter()
+            try:
+                ok = getattr(client, op)()
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies[op].append(elapsed)
+                else:
+                    errors[op] += 1
+
+    usernames = random.sample(list(owners), min(clients, len(owners)))
+    began = time.monotonic()
+    with ThreadPoolExecutor(max_workers=len(usernames)) as pool:
+        list(pool.map(client_loop, usernames))
+    seconds = time.monotonic() - began
+
+    total = sum(len(values) for values in latencies.values())
+    return {
+        "clients": len(usernames),
+        "seconds": round(seconds, 2),
+        "requests_per_second": round(total / seconds, 1),
+        "endpoints": {op: summarize(latencies[op], errors[op], seconds) for op in operations},
+    }
+
+# -------------------------------
+# BOT LIFECYCLE
+# -------------------------------
+def lifecycle(runner, bot_ids, samples):
+    import control, storage
+    from paths import LOGS_DIR
+
+    result = {}
+    sample_ids = bot_ids[:samples]
+    rest = bot_ids[samples:]
+
+    # Spawn latency, one bot at a time
+    replies, first_output = [], []
+    for bot_id in sample_ids:
+        log_path = os.path.join(LOGS_DIR, storage.get_bot(bot_id)["log_file"])
+        started = time.perf_counter()
+        reply = control.call("start", bot_id=bot_id)
+        replies.append(time.perf_counter() - started)
+        if reply.get("ok") and wait_for(lambda: log_contains(log_path, b"ready"), 30, 0.005):
+            first_output.append(time.perf_counter() - started)
+    result["spawn"] = {"reply": summarize(replies), "first_output": summarize(first_output)}
+
+    # Everything else in bulk
+    started = time.perf_counter()
+    reply = control.call("bulk", timeout=600, action="start", bot_ids=rest)
+    seconds = time.perf_counter() - started
+    failed = sum(1 for r in reply.get("results", {}).values() if not r.get("ok"))
+    result["bulk_start"] = {"bots": len(rest), "seconds": round(seconds, 3), "failed": failed,
+                            "per_second": round(len(rest) / seconds, 1) if rest and seconds else None}
+
+    # Supervisor cost with every bot up
+    time.sleep(2)
+    proc = psutil.Process(runner.pid)
+    cpu = proc.cpu_times()
+    time.sleep(5)
+    cpu_after = proc.cpu_times()
+    result["supervisor"] = {
+        "rss_mb": round(proc.memory_info().rss / (1024 * 1024), 1),
+        "idle_cpu_percent": round((cpu_after.user + cpu_after.system - cpu.user - cpu.system) / 5 * 100, 1),
+        "bots_running": storage.count_bots(status="running"),
+    }
+    result["bots_rss_mb"] = tree_rss(runner.pid)
+
+    # Crash detection: SIGKILL a bot, time until the supervisor notices
+    detections = []
+    for bot_id in sample_ids:
+        bot = storage.get_bot(bot_id)
+        if not bot or bot.get("status") != "running" or not bot.get("pid"):
+            continue
+        started = time.perf_counter()
+        try:
+            os.kill(bot["pid"], signal.SIGKILL)
+        except ProcessLookupError:
+            continue
+        if wait_for(lambda: storage.get_bot(bot_id).get("pid") != bot["pid"], 30, 0.002):
+            detections.append(time.perf_counter() - started)
+    result["crash_detection"] = summarize(detections)
+
+    started = time.perf_counter()
+    control.call("bulk", timeout=600, action="stop", bot_ids=bot_ids)
+    seconds = time.perf_counter() - started
+    result["bulk_stop"] = {"bots": len(bot_ids), "seconds": round(seconds, 3),
+                           "per_second": round(len(bot_ids) / seconds, 1) if seconds else None}
+    return result
+
+# -------------------------------
+# REGRESSION CHECK
+# -------------------------------
+def regressions(result, baseline, tolerance):
+    """Metrics that got worse than baseline by more than tolerance (a fraction)"""
+    found = []
+
+    def walk(current, previous, path):
+        for key, value in current.items():
+            before = previous.get(key) if isinstance(previous, dict) else None
+            if isinstance(value, dict):
+                walk(value, before, f"{path}{key}.")
+            elif isinstance(value, (int, float)) and isinstance(before, (int, float)) and before > 0:
+                worse = None
+                if key.endswith("_ms"):
+                    worse = value > before * (1 + tolerance)
+                elif key == "per_second" or key == "requests_per_second":
+                    worse = value < before * (1 - tolerance)
+                if worse:
+                    found.append({"metric": f"{path}{key}", "baseline": before, "current": value})
+
+    walk(result, baseline, "")
+    return found
+
+# -------------------------------
+# MAIN
+# -------------------------------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scale", choices=SCALES, default="10", help="bots to seed")
+    parser.add_argument("--home", help="scratch DEVIL_CLOUD_HOME (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch home afterwards")
+    parser.add_argument("--phases", default="web,lifecycle", help="comma-separated: web, lifecycle")
+    parser.add_argument("--clients", type=int, default=16, help="concurrent panel users")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of web load")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=16, help="gunicorn threads per worker")
+    parser.add_argument("--samples", type=int, default=20, help="bots timed one by one for spawn and crash latency")
+    parser.add_argument("--output", help="write the JSON result here instead of stdout")
+    parser.add_argument("--compare", help="earlier result to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    home = args.home or tempfile.mkdtemp(prefix="devil-cloud-bench-")
+    # Before the first app import: paths.py reads it once
+    os.environ["DEVIL_CLOUD_HOME"] = home
+    sys.path.insert(0, REPO_DIR)
+    env = dict(os.environ)
+    phases = set(args.phases.split(","))
+
+    result = {
+        "scale": args.scale,
+        "python": sys.version.split()[0],
+        "host": {"cpus": os.cpu_count(), "memory_mb": round(psutil.virtual_memory().total / (1024 * 1024))},
+    }
+    runner = web = None
+    try:
+        started = time.perf_counter()
+        owners = seed(SCALES[args.scale])
+        result["seed"] = {"bots": SCALES[args.scale], "users": len(owners), "seconds": round(time.perf_counter() - started, 2)}
+
+        started = time.perf_counter()
+        runner = start_runner(env)
+        result["runner_startup_seconds"] = round(time.perf_counter() - started, 3)
+
+        if "web" in phases:
+            port = free_port()
+            web, server = start_web(env, port, args.workers, args.threads)
+            peak = PeakRSS(web.pid)
+            result["web"] = {"server": server, **web_load(port, owners, args.clients, args.duration)}
+            result["web"]["rss_mb"] = tree_rss(web.pid)
+            result["web"]["peak_rss_mb"] = peak.stop()
+            stop_process(web)
+            web = None
+
+        if "lifecycle" in phases:
+            bot_ids = [bot_id for bot_ids in owners.values() for bot_id in bot_ids]
+            result["lifecycle"] = lifecycle(runner, bot_ids, min(args.samples, len(bot_ids)))
+    finally:
+        if web is not None:
+            stop_process(web)
+        if runner is not None:
+            stop_bots()
+            stop_process(runner)
+        if not args.keep and not args.home:
+            shutil.rmtree(home, ignore_errors=True)
+
+    status = 0
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            result["regressions"] = regressions(result, json.load(f), args.tolerance)
+        status = 1 if result["regressions"] else 0
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    sys.exit(status)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import os, shutil, hashlib
+
+from paths import BOTS_DIR
+import storage
+
+# -------------------------------
+# CONTENT-ADDRESSED BOT FILES
+# -------------------------------
+# Where the filesystem supports reflinks, every uploaded file is stored
+# once under BLOBS_DIR by its sha256, and a bot's working tree under
+# BOTS_DIR holds copy-on-write clones sharing the blob's data (so the bot
+# may still modify its own copy). Without reflinks nothing is shared:
+# trees keep their private copies and no blob is written, since a second
+# full copy would only add to disk use that storage_limit (which counts
+# tree bytes) doesn't see, and a hard link would make the bot's file the
+# read-only blob. The tree_files and blobs tables record every file's
+# digest either way and count references, so a blob is deleted with the
+# last tree that uses it.
+#
+# BLOBS_DIR sits inside BOTS_DIR so blobs and trees share a filesystem.
+BLOBS_DIR = os.path.join(BOTS_DIR, ".blobs")
+FICLONE = 0x40049409  # linux/fs.h
+HASH_CHUNK_SIZE = 1024 * 1024
+
+os.makedirs(BLOBS_DIR, exist_ok=True)
+
+def blob_path(digest):
+    return os.path.join(BLOBS_DIR, digest[:2], digest[2:])
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def reflink(src, dst):
+    """Make dst a copy-on-write clone of src; False (and no dst) if the filesystem can't"""
+    try:
+        import fcntl
+        with open(src, 'rb') as source, open(dst, 'wb') as target:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        return True
+    except (ImportError, OSError):
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        return False
+
+def tree_files(root):
+    """Regular files of a tree relative to it; a single-file tree is ""."""
+    if not os.path.isdir(root):
+        return [""]
+    files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                files.append(os.path.relpath(path, root))
+    return files
+
+def adopt(tree):
+    """Deduplicate the working tree BOTS_DIR/<tree> against the blob store"""
+    root = os.path.join(BOTS_DIR, tree)
+    for relpath in tree_files(root):
+        path = os.path.join(root, relpath) if relpath else root
+        digest = file_digest(path)
+        blob = blob_path(digest)
+
+        # Blobs are only created and deleted inside a registry write, so one
+        # can't vanish between this check and the reference being recorded
+        with storage.transaction():
+            storage.add_tree_file(tree, relpath, digest, os.path.getsize(path))
+            if not os.path.exists(blob):
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                tmp_path = f"{blob}.{os.getpid()}.tmp"
+                # Without reflinks only the digest is recorded
+                if reflink(path, tmp_path):
+                    os.chmod(tmp_path, 0o444)
+                    os.replace(tmp_path, blob)
+                continue
+
+        # Already stored: swap our copy for a clone sharing the blob's data
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if reflink(blob, tmp_path):
+            shutil.copymode(path, tmp_path)
+            os.replace(tmp_path, path)
+
+def release(tree):
+    """Delete the working tree BOTS_DIR/<tree>, and blobs no other tree uses"""
+    with storage.transaction():
+        for digest in storage.release_tree_files(tree):
+            try:
+                os.remove(blob_path(digest))
+            except OSError:
+                pass
+
+    path = os.path.join(BOTS_DIR, tree)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def rename(old_tree, new_tree):
+    """Move a working tree within BOTS_DIR along with its references.
+
+    Raises FileExistsError if new_tree is taken.
+    """
+    with storage.transaction():
+        if os.path.lexists(os.path.join(BOTS_DIR, new_tree)):
+            raise FileExistsError(f"{new_tree} already exists")
+        storage.rename_tree(old_tree, new_tree)
+        os.replace(os.path.join(BOTS_DIR, old_tree), os.path.join(BOTS_DIR, new_tree))
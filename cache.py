@@ -0,0 +1,51 @@
+import os, threading
+
+# -------------------------------
+# IN-PROCESS DOCUMENT CACHE
+# -------------------------------
+# Each entry remembers the version it was loaded at. A lookup asks the
+# version function first (a stat() or a one-row SELECT) and only re-runs the
+# loader when that changed. Versions live outside the process (file metadata
+# or the registry's meta table), so a write in one gunicorn worker
+# invalidates every other worker's copy too.
+#
+# Cached values are shared between requests: treat them as read-only and
+# write through storage/save_* instead.
+
+_lock = threading.Lock()
+_entries = {}
+_counters = {}
+
+def cached(key, version_fn, load_fn):
+    version = version_fn()
+    with _lock:
+        counter = _counters.setdefault(key, {"hits": 0, "misses": 0})
+        entry = _entries.get(key)
+        if entry is not None and version is not None and entry[0] == version:
+            counter["hits"] += 1
+            return entry[1]
+        counter["misses"] += 1
+
+    value = load_fn()
+    with _lock:
+        _entries[key] = (version, value)
+    return value
+
+def invalidate(key=None):
+    with _lock:
+        if key is None:
+            _entries.clear()
+        else:
+            _entries.pop(key, None)
+
+def file_version(path):
+    """Cheap change token for a file; None when it doesn't exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def stats():
+    with _lock:
+        return {key: dict(counter) for key, counter in _counters.items()}
@@ -0,0 +1,44 @@
+import os, json, socket
+
+from paths import DATA_DIR
+
+# -------------------------------
+# SUPERVISOR CONTROL CLIENT
+# -------------------------------
+# runner.py owns every bot process and listens here. Each call is one
+# newline-terminated JSON request and one JSON reply on a fresh connection:
+#   {"cmd": "start", "bot_id": "..."} -> {"ok": true, "status": "running", ...}
+SOCKET_PATH = os.path.join(DATA_DIR, "supervisor.sock")
+
+class SupervisorUnavailable(Exception):
+    pass
+
+def call(cmd, timeout=15, **args):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        try:
+            sock.connect(SOCKET_PATH)
+        except OSError as e:
+            raise SupervisorUnavailable(f"Supervisor is not running ({e})")
+
+        sock.sendall((json.dumps({"cmd": cmd, **args}) + "\n").encode())
+
+        buffer = b""
+        while b"\n" not in buffer:
+            chunk = sock.recv(65536)
+            if not chunk:
+                raise SupervisorUnavailable("Supervisor closed the connection")
+            buffer += chunk
+        return json.loads(buffer.split(b"\n", 1)[0])
+    except socket.timeout:
+        raise SupervisorUnavailable("Supervisor did not answer in time")
+    finally:
+        sock.close()
+
+def request(cmd, **args):
+    """Like call(), but folds an unreachable supervisor into an error reply"""
+    try:
+        return call(cmd, **args)
+    except SupervisorUnavailable as e:
+        return {"ok": False, "error": str(e)}
@@ -0,0 +1,227 @@
+import os, re, sys, ast, hashlib, sysconfig, threading
+
+import storage
+
+# -------------------------------
+# PYTHON DEPENDENCY DETECTION
+# -------------------------------
+# Finds the PyPI distributions a bot without a requirements.txt needs:
+# parses every .py file in the bot's tree with ast, drops the standard
+# library, the bot's own modules and relative or guarded-optional imports,
+# then maps the remaining import names to distribution names. Each file's
+# imports are cached by its sha256, so restarts and re-uploads (the same
+# blobs) parse nothing.
+MAX_FILES = 500
+MAX_FILE_BYTES = 1024 * 1024
+MEMORY_CACHE_SIZE = 10000
+PARSER_VERSION = 2  # part of the cache key: bump when parse_imports() changes
+
+# Import name -> distribution, where they differ. Dotted keys are matched
+# first, for namespace packages such as google.*.
+PACKAGE_NAMES = {
+    "PIL": "Pillow",
+    "telegram": "python-telegram-bot",
+    "telebot": "pyTelegramBotAPI",
+    "discord": "discord.py",
+    "cv2": "opencv-python",
+    "yaml": "PyYAML",
+    "bs4": "beautifulsoup4",
+    "sklearn": "scikit-learn",
+    "skimage": "scikit-image",
+    "dotenv": "python-dotenv",
+    "dateutil": "python-dateutil",
+    "jwt": "PyJWT",
+    "jose": "python-jose",
+    "Crypto": "pycryptodome",
+    "Cryptodome": "pycryptodomex",
+    "OpenSSL": "pyOpenSSL",
+    "nacl": "PyNaCl",
+    "serial": "pyserial",
+    "usb": "pyusb",
+    "socks": "PySocks",
+    "websocket": "websocket-client",
+    "magic": "python-magic",
+    "docx": "python-docx",
+    "pptx": "python-pptx",
+    "fitz": "PyMuPDF",
+    "git": "GitPython",
+    "github": "PyGithub",
+    "gi": "PyGObject",
+    "zmq": "pyzmq",
+    "MySQLdb": "mysqlclient",
+    "psycopg2": "psycopg2-binary",
+    "memcache": "python-memcached",
+    "ldap": "python-ldap",
+    "kafka": "kafka-python",
+    "Levenshtein": "python-Levenshtein",
+    "slugify": "python-slugify",
+    "multipart": "python-multipart",
+    "speech_recognition": "SpeechRecognition",
+    "tgcrypto": "TgCrypto",
+    "yt_dlp": "yt-dlp",
+    "Bio": "biopython",
+    "vlc": "python-vlc",
+    "attr": "attrs",
+    "pkg_resources": "setuptools",
+    "mpl_toolkits": "matplotlib",
+    "flask_sqlalchemy": "Flask-SQLAlchemy",
+    "flask_cors": "Flask-Cors",
+    "flask_login": "Flask-Login",
+    "googleapiclient": "google-api-python-client",
+    "google.genai": "google-genai",
+    "google.generativeai": "google-generativeai",
+    "google.protobuf": "protobuf",
+    "google.cloud.storage": "google-cloud-storage",
+    "google.cloud.firestore": "google-cloud-firestore",
+    "google.oauth2": "google-auth",
+    "google.auth": "google-auth",
+    "win32api": "pywin32",
+    "win32con": "pywin32",
+}
+
+# Guarded by `except ImportError:` or `except ModuleNotFoundError:`: the bot
+# copes without them. Broader handlers (`except Exception:`, a bare
+# `except:`) usually guard something else, so their imports still count.
+OPTIONAL_HANDLERS = {"ImportError", "ModuleNotFoundError"}
+
+IMPORT_PATTERNS = [r'^\s*import\s+([a-zA-Z0-9_\.]+)', r'^\s*from\s+([a-zA-Z0-9_\.]+)\s+import']
+
+_stdlib = None
+_cache = {}
+_cache_lock = threading.Lock()
+
+def stdlib_modules():
+    global _stdlib
+    if _stdlib is None:
+        names = set(getattr(sys, "stdlib_module_names", ()))
+        if not names:
+            # Python < 3.10: list the standard library directories
+            names.update(sys.builtin_module_names)
+            stdlib = sysconfig.get_paths()["stdlib"]
+            for directory in (stdlib, os.path.join(stdlib, "lib-dynload")):
+                try:
+                    entries = os.listdir(directory)
+                except OSError:
+                    continue
+                for entry in entries:
+                    if entry in ("site-packages", "dist-packages"):
+                        continue
+                    names.add(entry.split(".", 1)[0])
+        names.add("__future__")
+        _stdlib = frozenset(names)
+    return _stdlib
+
+# -------------------------------
+# PER-FILE IMPORTS
+# -------------------------------
+def _is_optional(handlers):
+    for handler in handlers:
+        if handler.type is None:
+            continue
+        types = handler.type.elts if isinstance(handler.type, ast.Tuple) else [handler.type]
+        if any(isinstance(t, ast.Name) and t.id in OPTIONAL_HANDLERS for t in types):
+            return True
+    return False
+
+def parse_imports(source):
+    """Absolute module names a file imports outside optional try blocks"""
+    try:
+        tree = ast.parse(source)
+    except (SyntaxError, ValueError):
+        # Not Python 3 (or not Python): fall back to matching lines
+        text = source.decode('utf-8', errors='ignore')
+        return {match for pattern in IMPORT_PATTERNS for match in re.findall(pattern, text, re.MULTILINE)}
+
+    modules = set()
+
+    def visit(node, optional):
+        if isinstance(node, ast.Import) and not optional:
+            modules.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and not optional and not node.level and node.module:
+            modules.add(node.module)
+            # from google import genai -> google.genai
+            modules.update(f"{node.module}.{alias.name}" for alias in node.names if alias.name != "*")
+        elif isinstance(node, ast.Try):
+            guarded = optional or _is_optional(node.handlers)
+            for child in node.body:
+                visit(child, guarded)
+            for child in node.handlers + node.orelse + node.finalbody:
+                visit(child, optional)
+            return
+        for child in ast.iter_child_nodes(node):
+            visit(child, optional)
+
+    visit(tree, False)
+    return modules
+
+def file_imports(path):
+    """parse_imports() of a file, cached by content hash"""
+    with open(path, 'rb') as f:
+        source = f.read(MAX_FILE_BYTES + 1)
+    if len(source) > MAX_FILE_BYTES:
+        return set()
+    digest = f"{PARSER_VERSION}:{hashlib.sha256(source).hexdigest()}"
+
+    with _cache_lock:
+        modules = _cache.get(digest)
+    if modules is None:
+        modules = storage.get_file_imports(digest)
+        if modules is None:
+            modules = sorted(parse_imports(source))
+            storage.put_file_imports(digest, modules)
+        with _cache_lock:
+            if len(_cache) >= MEMORY_CACHE_SIZE:
+                _cache.clear()
+            _cache[digest] = modules
+    return set(modules)
+
+# -------------------------------
+# WHOLE BOTS
+# -------------------------------
+def source_files(root):
+    """The .py files of a tree (or the single file it is) and the names it provides locally"""
+    if not os.path.isdir(root):
+        return [root], {os.path.splitext(os.path.basename(root))[0]}
+
+    files, local = [], set()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not d.startswith(".") and d != "__pycache__"]
+        # Any directory could be a package or sit on sys.path
+        local.update(dirnames)
+        for name in filenames:
+            stem, ext = os.path.splitext(name)
+            if ext in (".py", ".so", ".pyd"):
+                local.add(stem.split(".", 1)[0])
+            if ext == ".py" and len(files) < MAX_FILES:
+                files.append(os.path.join(dirpath, name))
+    return files, local
+
+def distribution(module):
+    """Distribution name for a dotted import, via PACKAGE_NAMES"""
+    parts = module.split(".")
+    for i in range(len(parts), 0, -1):
+        name = PACKAGE_NAMES.get(".".join(parts[:i]))
+        if name is not None:
+            return name
+    return parts[0]
+
+def requirements(root):
+    """Sorted distributions the Python code under root (a directory or one file) imports"""
+    files, local = source_files(root)
+    stdlib = stdlib_modules()
+
+    modules = set()
+    for path in files:
+        try:
+            modules |= file_imports(path)
+        except OSError:
+            continue
+
+    needed = set()
+    for module in modules:
+        top = module.split(".")[0]
+        if top and top not in stdlib and top not in local:
+            needed.add(distribution(module))
+    # "google" itself is only a namespace; keep its mapped members
+    needed.discard("google")
+    return sorted(needed)
@@ -0,0 +1,159 @@
+import os, sys, json, shutil, hashlib, subprocess, time
+
+from paths import BOTS_DIR, DATA_DIR
+import depscan
+
+# -------------------------------
+# PYTHON DEPENDENCY ENVIRONMENTS
+# -------------------------------
+# A Python bot runs from a virtualenv holding exactly its dependencies:
+# requirements.txt when the upload ships one, else the distributions its
+# imports resolve to (depscan.py). Environments are keyed by a hash of that
+# resolved set, so bots with the same dependencies share one, and the
+# supervisor builds each at most once, before the first bot that needs it
+# starts. pip's cache is shared too, so a new set only downloads what no
+# earlier build fetched.
+ENVS_DIR = os.path.join(DATA_DIR, "envs")
+PIP_CACHE_DIR = os.path.join(DATA_DIR, "pip-cache")
+BUILD_TIMEOUT = 600
+RETRY_AFTER = 600      # a failed set is not rebuilt for this long
+ENV_RETENTION = 7 * 24 * 3600  # unused environments are removed after this
+READY_MARKER = ".ready"
+FAILED_MARKER = ".failed"
+
+os.makedirs(ENVS_DIR, exist_ok=True)
+
+def read_requirements(path):
+    requirements = []
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        for line in f:
+            line = line.split(" #", 1)[0].strip()
+            # Options (-r, -e, --index-url, ...) could reach outside the set
+            if line and not line.startswith(("#", "-")):
+                requirements.append(line)
+    return requirements
+
+def requirements_for(bot):
+    """(sorted dependency set, strict) for a bot; the set is empty if it needs none.
+
+    A shipped requirements.txt is strict: if pip can't install it the bot
+    doesn't start. Packages guessed from imports are installed best effort.
+    """
+    if bot.get("language") != "python":
+        return [], False
+
+    bot_path = os.path.join(BOTS_DIR, bot["filename"])
+    tree_root = os.path.join(BOTS_DIR, bot["filename"].split("/")[0])
+    if "/" in bot["filename"]:
+        # Next to the entrypoint, else at the top of the uploaded ZIP
+        for directory in dict.fromkeys([os.path.dirname(bot_path), tree_root]):
+            candidate = os.path.join(directory, "requirements.txt")
+            if os.path.isfile(candidate):
+                return sorted(set(read_requirements(candidate))), True
+
+    return depscan.requirements(tree_root), False
+
+def recorded_requirements(bot):
+    """requirements_for() as stored on the record at upload; None if never resolved.
+
+    Resolving hashes the whole tree, so the supervisor reads this instead
+    and resolves (off its loop) only bots uploaded before it was recorded.
+    """
+    if bot.get("language") != "python":
+        return [], False
+    if "requirements" not in bot:
+        return None
+    return bot["requirements"], bot.get("requirements_strict", False)
+
+def record_requirements(bot):
+    bot["requirements"], bot["requirements_strict"] = requirements_for(bot)
+
+def env_key(requirements, strict):
+    if not requirements:
+        return None
+    spec = f"{sys.version_info[0]}.{sys.version_info[1]}\n{int(strict)}\n" + "\n".join(requirements)
+    return hashlib.sha256(spec.encode()).hexdigest()[:16]
+
+def env_path(key):
+    return os.path.join(ENVS_DIR, key)
+
+def python(key):
+    return os.path.join(env_path(key), "bin", "python")
+
+def is_ready(key):
+    return os.path.exists(os.path.join(env_path(key), READY_MARKER))
+
+def recent_failure(key):
+    """The error of a build that failed within RETRY_AFTER, else None"""
+    try:
+        with open(os.path.join(env_path(key), FAILED_MARKER), 'r') as f:
+            failure = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return failure["error"] if time.time() - failure["at"] < RETRY_AFTER else None
+
+def touch(key):
+    """Mark an environment as used, postponing its removal"""
+    try:
+        os.utime(os.path.join(env_path(key), READY_MARKER))
+    except OSError:
+        pass
+
+def _run(command):
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            stdin=subprocess.DEVNULL, timeout=BUILD_TIMEOUT)
+    if result.returncode != 0:
+        raise RuntimeError(result.stdout.decode('utf-8', errors='replace')[-2000:].strip())
+
+def build(key, requirements, strict):
+    """Create the environment for a dependency set.
+
+    Returns the packages that were skipped (best effort only); raises
+    RuntimeError with pip's output if the environment can't be used.
+    """
+    path = env_path(key)
+    # Whatever is here is a build that never finished
+    shutil.rmtree(path, ignore_errors=True)
+
+    pip = [os.path.join(path, "bin", "python"), "-m", "pip", "install", "-q",
+           "--disable-pip-version-check", "--cache-dir", PIP_CACHE_DIR]
+    skipped = []
+    try:
+        _run([sys.executable, "-m", "venv", path])
+        try:
+            _run(pip + requirements)
+        except RuntimeError:
+            if strict:
+                raise
+            # One unknown name shouldn't cost the bot the packages that exist
+            for requirement in requirements:
+                try:
+                    _run(pip + [requirement])
+                except RuntimeError:
+                    skipped.append(requirement)
+    except (RuntimeError, OSError, subprocess.TimeoutExpired) as e:
+        error = str(e) or "Dependency install failed"
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, FAILED_MARKER), 'w') as f:
+            json.dump({"error": error, "at": time.time()}, f)
+        raise RuntimeError(error)
+
+    with open(os.path.join(path, "requirements.txt"), 'w') as f:
+        f.write("\n".join(requirements) + "\n")
+    with open(os.path.join(path, READY_MARKER), 'w') as f:
+        f.write(str(time.time()))
+    return skipped
+
+def collect(keep):
+    """Remove environments unused for ENV_RETENTION, except the keys in `keep`"""
+    cutoff = time.time() - ENV_RETENTION
+    for key in os.listdir(ENVS_DIR):
+        if key in keep:
+            continue
+        path = env_path(key)
+        marker = os.path.join(path, READY_MARKER if is_ready(key) else FAILED_MARKER)
+        try:
+            if os.path.getmtime(marker) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
@@ -0,0 +1,53 @@
+import os, math
+
+# -------------------------------
+# GUNICORN SETTINGS
+# -------------------------------
+# gunicorn -c gunicorn.conf.py
+#
+# SERVER_MODE=async serves asgi.py on uvicorn workers: log tails and
+# dashboard event streams are coroutines instead of threads, so thousands
+# of them can stay open per worker. SERVER_MODE=sync (the default, or when
+# uvicorn isn't installed) serves app.py on threaded sync workers.
+# WEB_CONCURRENCY overrides the worker count picked from the CPUs.
+def available_cpus():
+    """CPUs this process may run on, capped by a cgroup v2 CPU quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    try:
+        with open("/sys/fs/cgroup/cpu.max", 'r') as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, cpus)
+
+mode = os.environ.get("SERVER_MODE", "sync")
+if mode == "async":
+    try:
+        import uvicorn.workers  # noqa: F401
+    except ImportError:
+        print("SERVER_MODE=async needs uvicorn; serving sync workers instead", flush=True)
+        mode = "sync"
+
+cpus = available_cpus()
+bind = f"0.0.0.0:{os.environ.get('PORT', 10000)}"
+timeout = 120
+
+if mode == "async":
+    wsgi_app = "asgi:app"
+    worker_class = "uvicorn.workers.UvicornWorker"
+    # One event loop per CPU; at least two so a recycled worker never
+    # leaves the panel without one
+    workers = max(2, cpus)
+else:
+    wsgi_app = "app:app"
+    worker_class = "gthread"
+    # Requests mostly wait on SQLite and files rather than the CPU
+    workers = 2 * cpus + 1
+    threads = 16
+
+workers = int(os.environ.get("WEB_CONCURRENCY", workers))
@@ -0,0 +1,198 @@
+import os, stat, threading, time, zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from paths import BOTS_DIR
+import storage
+import blobs
+
+# -------------------------------
+# ZIP INGESTION
+# -------------------------------
+# ZIP uploads are unpacked on a small worker pool instead of in the request.
+# The archive's headers are not trusted: every member path is checked before
+# anything is written, and members are streamed through a running byte count
+# that stops as soon as the archive expands past its budget (a zip bomb's
+# file_size fields lie). Output is staged in STAGING_DIR/<job_id>, deduplicated
+# against the blob store, and only moves under BOTS_DIR once the user picks
+# one of the entrypoint candidates.
+STAGING_DIR = os.path.join(BOTS_DIR, ".staging")
+INGEST_WORKERS = 2
+MAX_MEMBERS = 2000
+MAX_UNCOMPRESSED_BYTES = 200 * 1024 * 1024
+MAX_RATIO = 200  # per member, uncompressed / compressed, once past RATIO_GRACE
+RATIO_GRACE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+PROGRESS_INTERVAL = 0.5
+MAX_CANDIDATES = 20
+# A job still pending or running with no progress for this long lost its
+# worker (restarted or killed mid-extraction) and is reported as failed
+STALE_AFTER = 15 * 60
+
+# Conventional entrypoints rank first, in this order
+ENTRYPOINT_NAMES = ["main.py", "bot.py", "index.php", "app.js", "server.js", "index.js"]
+ENTRYPOINT_EXTENSIONS = (".py", ".php", ".js", ".sh")
+
+os.makedirs(STAGING_DIR, exist_ok=True)
+
+class IngestError(Exception):
+    pass
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+        return _pool
+
+def staging_path(job_id):
+    return os.path.join(STAGING_DIR, job_id)
+
+def staging_tree(job_id):
+    """staging_path() as a blobs tree name"""
+    return os.path.relpath(staging_path(job_id), BOTS_DIR)
+
+def archive_path(job_id):
+    return os.path.join(STAGING_DIR, f"{job_id}.zip")
+
+# -------------------------------
+# EXTRACTION
+# -------------------------------
+def member_path(info):
+    """Relative path an archive member extracts to ("" for the root); raises IngestError"""
+    name = info.filename.replace("\\", "/")
+    parts = [part for part in name.split("/") if part not in ("", ".")]
+    if name.startswith("/") or ".." in parts or (parts and ":" in parts[0]):
+        raise IngestError(f"Unsafe path in archive: {info.filename}")
+    if stat.S_ISLNK(info.external_attr >> 16):
+        raise IngestError(f"Symbolic links are not allowed: {info.filename}")
+    return "/".join(parts)
+
+def extract(zip_path, dest, max_bytes, progress=None):
+    """Stream a ZIP into dest within max_bytes; returns (file paths, bytes written)"""
+    with zipfile.ZipFile(zip_path) as archive:
+        members = archive.infolist()
+        if len(members) > MAX_MEMBERS:
+            raise IngestError(f"Archive has {len(members)} entries (limit {MAX_MEMBERS})")
+        # Reject the whole archive before writing a single file
+        members = [(info, member_path(info)) for info in members]
+
+        files, total = [], 0
+        reported = time.monotonic()
+        for done, (info, path) in enumerate(members, 1):
+            if not path:
+                continue
+            target = os.path.join(dest, path)
+            if info.is_dir():
+                os.makedirs(target, exist_ok=True)
+                continue
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            written = 0
+            with archive.open(info) as src, open(target, 'wb') as dst:
+                while True:
+                    chunk = src.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    total += len(chunk)
+                    if total > max_bytes:
+                        raise IngestError(f"Archive expands past the {max_bytes / (1024 * 1024):.1f} MB available")
+                    if written > RATIO_GRACE and written > info.compress_size * MAX_RATIO:
+                        raise IngestError(f"Suspicious compression ratio: {info.filename}")
+                    dst.write(chunk)
+            files.append(path)
+
+            if progress is not None and time.monotonic() - reported >= PROGRESS_INTERVAL:
+                reported = time.monotonic()
+                progress({"entries_done": done, "entries": len(members), "bytes": total})
+
+        return files, total
+
+def entrypoint_candidates(files):
+    """Runnable files of an archive, likeliest entrypoint first"""
+    def rank(path):
+        name = os.path.basename(path)
+        known = ENTRYPOINT_NAMES.index(name) if name in ENTRYPOINT_NAMES else len(ENTRYPOINT_NAMES)
+        return (path.count("/"), known, path)
+
+    runnable = [
+        path for path in files
+        if path.lower().endswith(ENTRYPOINT_EXTENSIONS)
+        and not any(part.startswith((".", "__")) for part in path.split("/"))
+    ]
+    return sorted(runnable, key=rank)[:MAX_CANDIDATES]
+
+# -------------------------------
+# JOBS
+# -------------------------------
+def submit(job_id, max_bytes, **info):
+    """Queue the archive saved at archive_path(job_id); info is copied into the result"""
+    sweep()
+    pool().submit(run, job_id, max_bytes, info)
+
+def run(job_id, max_bytes, info):
+    zip_path = archive_path(job_id)
+    dest = staging_path(job_id)
+    try:
+        # Picked up: time spent queued doesn't count towards STALE_AFTER
+        storage.update_job(job_id, {"entries_done": 0, "entries": 0, "bytes": 0})
+        os.makedirs(dest)
+        files, total = extract(zip_path, dest, max_bytes, lambda progress: storage.update_job(job_id, progress))
+        candidates = entrypoint_candidates(files)
+        if not candidates:
+            raise IngestError("No .py, .php, .js or .sh file found in the archive")
+        blobs.adopt(staging_tree(job_id))
+        result = {**info, "ok": True, "files": len(files), "bytes": total, "candidates": candidates}
+    except Exception as e:
+        blobs.release(staging_tree(job_id))
+        if isinstance(e, (IngestError, zipfile.BadZipFile)):
+            error = str(e)
+        else:
+            error = f"Error extracting ZIP: {e}"
+        result = {**info, "ok": False, "error": error}
+    finally:
+        try:
+            os.remove(zip_path)
+        except OSError:
+            pass
+    storage.finish_job(job_id, result)
+
+def sweep():
+    """Remove staged uploads nobody finished before their job expired"""
+    cutoff = time.time() - storage.JOB_RETENTION
+    for name in os.listdir(STAGING_DIR):
+        path = os.path.join(STAGING_DIR, name)
+        try:
+            if os.path.getmtime(path) >= cutoff:
+                continue
+            if os.path.isdir(path):
+                blobs.release(os.path.relpath(path, BOTS_DIR))
+            else:
+                os.remove(path)
+        except OSError:
+            pass
+
+def get_job(job_id):
+    """storage.get_job(), with a job whose worker died reported as failed"""
+    job = storage.get_job(job_id)
+    if job is not None and job['kind'] == 'ingest' and job['status'] in ('pending', 'running'):
+        if storage.expire_job(job_id, time.time() - STALE_AFTER,
+                              {"ok": False, "error": "The upload was interrupted. Please upload it again."}):
+            job = storage.get_job(job_id)
+    return job
+
+def claim(job_id, dirname):
+    """Move a finished upload to BOTS_DIR/dirname; False if it is already gone.
+
+    Raises IngestError if dirname is taken.
+    """
+    try:
+        blobs.rename(staging_tree(job_id), dirname)
+    except FileExistsError:
+        raise IngestError("A bot folder with this name already exists. Try again.")
+    except FileNotFoundError:
+        return False
+    return True
@@ -0,0 +1,301 @@
+import os, sys, json, time, fcntl, threading, functools, contextlib
+from collections import Counter
+
+from paths import DATA_DIR
+import procs
+
+# -------------------------------
+# INSTRUMENTATION
+# -------------------------------
+# Counters and latency histograms, kept in memory by each process (every
+# gunicorn worker and the supervisor) and written to METRICS_DIR at most
+# every FLUSH_INTERVAL. The /metrics endpoint merges all the files, so the
+# totals add up across processes no matter which worker serves the scrape.
+# A file whose process has exited is folded into ARCHIVE_FILE, so totals
+# never go backwards when workers are recycled.
+#
+# Recording is a lock and a few dict operations; nothing touches the disk
+# on the request path except the periodic flush.
+METRICS_DIR = os.path.join(DATA_DIR, "instrument")
+ARCHIVE_FILE = os.path.join(METRICS_DIR, "archive.json")
+LOCK_FILE = os.path.join(METRICS_DIR, ".lock")
+FLUSH_INTERVAL = 5
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "http_requests_total": ("counter", "Requests served, by route and status"),
+    "http_request_duration_seconds": ("histogram", "Time to produce a response, by route"),
+    "template_render_seconds": ("histogram", "Jinja rendering time, by template"),
+    "registry_seconds": ("histogram", "Registry and config reads/writes, by function"),
+    "registry_lock_wait_seconds": ("histogram", "Time waiting for the registry write lock"),
+    "registry_transaction_seconds": ("histogram", "Registry write transactions, lock held"),
+    "bot_action_seconds": ("histogram", "Bot actions requested from the panel, by function"),
+    "log_read_seconds": ("histogram", "Log reads for the panel, by function"),
+    "supervisor_task_seconds": ("histogram", "Supervisor work, by task"),
+    "bot_spawns_total": ("counter", "Bot processes started, by method"),
+    "env_builds_total": ("counter", "Dependency environment builds, by result"),
+    "login_attempts_total": ("counter", "Login attempts, by result"),
+}
+
+os.makedirs(METRICS_DIR, exist_ok=True)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_owner = None     # pid the numbers above belong to
+_flushed = 0.0
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def _check_owner():
+    # A forked child (a gunicorn worker) must not report its parent's numbers
+    global _owner, _flushed
+    pid = os.getpid()
+    if _owner != pid:
+        _owner = pid
+        _counters.clear()
+        _histograms.clear()
+        _flushed = time.monotonic()
+
+def inc(name, value=1, **labels):
+    with _lock:
+        _check_owner()
+        key = _key(name, labels)
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, seconds, **labels):
+    with _lock:
+        _check_owner()
+        key = _key(name, labels)
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # One count per bucket, then +Inf, then the sum
+            histogram = _histograms[key] = [0] * (len(BUCKETS) + 2)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram[i] += 1
+                break
+        else:
+            histogram[len(BUCKETS)] += 1
+        histogram[-1] += seconds
+
+@contextlib.contextmanager
+def timer(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+def timed(name, **labels):
+    """Decorator: observe each call's duration, labelled with the function name by default"""
+    def decorate(fn):
+        fn_labels = labels or {"function": fn.__name__}
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started, **fn_labels)
+        return wrapper
+    return decorate
+
+# -------------------------------
+# PER-PROCESS FILES
+# -------------------------------
+def _serialize(counters, histograms):
+    return {
+        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [[name, list(labels), values] for (name, labels), values in histograms.items()],
+    }
+
+def _process_file(pid):
+    # The start time tells this process's file from one of an earlier process with the same pid
+    return os.path.join(METRICS_DIR, f"{pid}-{procs.start_time(pid) or 0}.json")
+
+def _write_json(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def flush(force=False):
+    """Write this process's totals if FLUSH_INTERVAL has passed (or force)"""
+    global _flushed
+    with _lock:
+        _check_owner()
+        if not force and time.monotonic() - _flushed < FLUSH_INTERVAL:
+            return
+        _flushed = time.monotonic()
+        snapshot = _serialize(_counters, _histograms)
+    try:
+        _write_json(_process_file(os.getpid()), snapshot)
+    except OSError:
+        pass
+
+def _add(totals, kind, key, value):
+    current = totals[kind].get(key)
+    if current is None:
+        totals[kind][key] = value[:] if kind == "histograms" else value
+    elif kind == "histograms":
+        totals[kind][key] = [a + b for a, b in zip(current, value)]
+    else:
+        totals[kind][key] = current + value
+
+def _merge(totals, data):
+    for kind in ("counters", "histograms"):
+        for name, labels, value in data.get(kind, []):
+            _add(totals, kind, _key(name, dict(labels)), value)
+
+def _is_alive(filename):
+    try:
+        pid, start = map(int, filename[:-len(".json")].split("-"))
+    except ValueError:
+        return False
+    if not os.path.isdir(procs.PROC_DIR):
+        return procs.is_same(pid, None)
+    return procs.start_time(pid) == start
+
+def collect():
+    """Totals of every process, live or exited: {"counters": {...}, "histograms": {...}}"""
+    flush(force=True)
+    totals = {"counters": {}, "histograms": {}}
+    with open(LOCK_FILE, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive = {"counters": {}, "histograms": {}}
+        try:
+            with open(ARCHIVE_FILE, 'r') as f:
+                _merge(archive, json.load(f))
+        except (OSError, ValueError):
+            pass
+
+        archived = []
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.endswith(".json") or filename == os.path.basename(ARCHIVE_FILE):
+                continue
+            path = os.path.join(METRICS_DIR, filename)
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if _is_alive(filename):
+                _merge(totals, data)
+            else:
+                _merge(archive, data)
+                archived.append(path)
+
+        if archived:
+            _write_json(ARCHIVE_FILE, _serialize(archive["counters"], archive["histograms"]))
+            for path in archived:
+                os.remove(path)
+
+    for kind in ("counters", "histograms"):
+        for key, value in archive[kind].items():
+            _add(totals, kind, key, value)
+    return totals
+
+# -------------------------------
+# PROMETHEUS TEXT FORMAT
+# -------------------------------
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+def render(totals=None):
+    totals = totals if totals is not None else collect()
+    by_name = {}
+    for kind in ("counters", "histograms"):
+        for (name, labels), value in totals[kind].items():
+            by_name.setdefault(name, []).append((kind, labels, value))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, description = HELP.get(name, ("untyped", name))
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for series_kind, labels, value in sorted(by_name[name], key=lambda series: series[1]):
+            if series_kind == "counters":
+                lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), value):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {value[-1]}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+# -------------------------------
+# SAMPLING PROFILER
+# -------------------------------
+# Opt-in: a request being profiled registers its thread, and one daemon
+# thread per process samples the stacks of registered threads every
+# PROFILE_INTERVAL. Profiles of requests slower than the threshold are
+# saved in collapsed-stack format (flamegraph.pl, speedscope) under
+# PROFILES_DIR; the newest MAX_PROFILES are kept.
+PROFILES_DIR = os.path.join(DATA_DIR, "profiles")
+PROFILE_INTERVAL = 0.005
+MAX_PROFILES = 50
+
+_profiled = {}  # thread id -> Counter of collapsed stacks
+_profiler = None
+
+def _sample_loop():
+    while True:
+        time.sleep(PROFILE_INTERVAL)
+        with _lock:
+            if not _profiled:
+                continue
+            frames = sys._current_frames()
+            for thread_id, stacks in _profiled.items():
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    stacks[";".join(reversed(stack))] += 1
+
+def start_profile():
+    """Start sampling the calling thread"""
+    global _profiler
+    with _lock:
+        if _profiler is None or not _profiler.is_alive():
+            _profiler = threading.Thread(target=_sample_loop, name="profiler", daemon=True)
+            _profiler.start()
+        _profiled[threading.get_ident()] = Counter()
+
+def finish_profile(label, elapsed, threshold):
+    """Stop sampling the calling thread; save the profile if elapsed >= threshold. Returns its file name or None."""
+    with _lock:
+        stacks = _profiled.pop(threading.get_ident(), None)
+    if not stacks or elapsed < threshold:
+        return None
+
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    safe_label = "".join(c if c.isalnum() or c in "-_" else "_" for c in label).strip("_")[:60]
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(elapsed * 1000)}ms-{safe_label or 'request'}-{os.getpid()}.txt"
+    with open(os.path.join(PROFILES_DIR, name), 'w') as f:
+        f.write("".join(f"{stack} {count}\n" for stack, count in stacks.most_common()))
+
+    profiles = sorted(list_profiles(), reverse=True)
+    for old in profiles[MAX_PROFILES:]:
+        try:
+            os.remove(os.path.join(PROFILES_DIR, old))
+        except OSError:
+            pass
+    return name
+
+def list_profiles():
+    try:
+        return [name for name in os.listdir(PROFILES_DIR) if name.endswith(".txt")]
+    except OSError:
+        return []
@@ -0,0 +1,193 @@
+import os, json, resource
+
+from paths import DATA_DIR
+import cache
+
+# -------------------------------
+# PER-BOT RESOURCE LIMITS
+# -------------------------------
+# Limits come from the owner's plan fields (next to storage_limit and
+# bot_limit on the user record), else the default_user_* config keys.
+# 0 means unlimited.
+CONFIG_FILE = os.path.join(DATA_DIR, "config.json")
+DEFAULT_LIMITS = {
+    "cpu_limit": 50,      # percent of one core
+    "memory_limit": 256,  # MB
+    "pids_limit": 64,     # processes + threads
+    "fds_limit": 256,     # open files
+}
+DEFAULT_STORAGE_LIMIT = 500  # MB of code and logs per user, "default_user_storage" in config.json
+
+# Without cgroups the kernel can only cap address space, which runtimes
+# reserve generously (thread stacks, arenas), so allow some headroom; the
+# supervisor also kills trees whose sampled RSS passes memory_limit.
+ADDRESS_SPACE_HEADROOM = 4
+FALLBACK_NICE = 10
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+CONTROLLERS = ("cpu", "memory", "pids")
+CPU_PERIOD = 100000  # microseconds
+
+def config_defaults():
+    def read_defaults():
+        with open(CONFIG_FILE, 'r') as f:
+            config = json.load(f)
+        defaults = {field: config.get(f"default_user_{field}", default) for field, default in DEFAULT_LIMITS.items()}
+        defaults["storage_limit"] = config.get("default_user_storage", DEFAULT_STORAGE_LIMIT)
+        return defaults
+    try:
+        return cache.cached("limit_defaults", lambda: cache.file_version(CONFIG_FILE), read_defaults)
+    except (OSError, ValueError):
+        return {**DEFAULT_LIMITS, "storage_limit": DEFAULT_STORAGE_LIMIT}
+
+def plan_limits(user):
+    defaults = config_defaults()
+    limits = {}
+    for field in DEFAULT_LIMITS:
+        value = (user or {}).get(field, defaults[field])
+        limits[field] = int(value or 0)
+    return limits
+
+def storage_limit(user):
+    """Bytes a user may keep on disk, or None when unlimited"""
+    limit = int((user or {}).get("storage_limit", config_defaults()["storage_limit"]) or 0)
+    return limit * 1024 * 1024 if limit else None
+
+def _read(directory, name):
+    with open(os.path.join(directory, name), 'r') as f:
+        return f.read().strip()
+
+def _write(directory, name, value):
+    with open(os.path.join(directory, name), 'w') as f:
+        f.write(value)
+
+class Cgroups:
+    """cgroup v2 leaves for bots: <supervisor's cgroup>/bots/<bot_id>.
+
+    Needs the cpu, memory and pids controllers delegated to the cgroup the
+    supervisor was started in. When that isn't so, `base` is None and
+    bots get rlimits instead.
+    """
+
+    def __init__(self):
+        self.base = None
+        try:
+            self.base = self._setup()
+        except (OSError, StopIteration) as e:
+            print(f"cgroup v2 limits unavailable ({e}), using rlimits")
+
+    def _setup(self):
+        if not os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+            raise OSError("no unified cgroup hierarchy")
+
+        with open("/proc/self/cgroup", 'r') as f:
+            own = next(line.split("::", 1)[1].strip() for line in f if line.startswith("0::"))
+        own_dir = os.path.join(CGROUP_ROOT, own.lstrip("/"))
+        # A restarted supervisor may have been launched from our own leaf
+        if os.path.basename(own_dir) == "supervisor":
+            own_dir = os.path.dirname(own_dir)
+
+        missing = set(CONTROLLERS) - set(_read(own_dir, "cgroup.controllers").split())
+        if missing:
+            raise OSError(f"controllers not delegated: {', '.join(sorted(missing))}")
+
+        enable = " ".join("+" + controller for controller in CONTROLLERS)
+        try:
+            _write(own_dir, "cgroup.subtree_control", enable)
+        except OSError:
+            # "No internal processes": only a cgroup without member
+            # processes can hand controllers down, so step into a leaf
+            leaf = os.path.join(own_dir, "supervisor")
+            os.makedirs(leaf, exist_ok=True)
+            _write(leaf, "cgroup.procs", str(os.getpid()))
+            _write(own_dir, "cgroup.subtree_control", enable)
+
+        bots_dir = os.path.join(own_dir, "bots")
+        os.makedirs(bots_dir, exist_ok=True)
+        _write(bots_dir, "cgroup.subtree_control", enable)
+        return bots_dir
+
+    def path(self, bot_id):
+        if self.base is None:
+            return None
+        path = os.path.join(self.base, bot_id)
+        return path if os.path.isdir(path) else None
+
+    def prepare(self, bot_id, limits):
+        """Create or update the bot's leaf; returns its directory or None"""
+        if self.base is None:
+            return None
+        path = os.path.join(self.base, bot_id)
+        try:
+            os.makedirs(path, exist_ok=True)
+            cpu = limits["cpu_limit"]
+            _write(path, "cpu.max", f"{cpu * CPU_PERIOD // 100} {CPU_PERIOD}" if cpu else f"max {CPU_PERIOD}")
+            memory = limits["memory_limit"]
+            _write(path, "memory.max", str(memory * 1024 * 1024) if memory else "max")
+            _write(path, "pids.max", str(limits["pids_limit"]) if limits["pids_limit"] else "max")
+        except OSError as e:
+            print(f"Failed to prepare cgroup for {bot_id}: {e}")
+            return None
+        return path
+
+    def kill(self, bot_id):
+        """SIGKILL everything in the leaf, including processes that left the session"""
+        path = self.path(bot_id)
+        if path is not None:
+            try:
+                _write(path, "cgroup.kill", "1")
+            except OSError:
+                pass  # cgroup.kill needs Linux 5.14
+
+    def remove(self, bot_id):
+        path = self.path(bot_id)
+        if path is not None:
+            try:
+                os.rmdir(path)
+            except OSError:
+                pass  # still populated; the next start reuses it
+
+    def usage(self, bot_id):
+        """(cpu seconds, memory bytes) from the kernel's own accounting, or None"""
+        path = self.path(bot_id)
+        if path is None:
+            return None
+        try:
+            cpu_stat = dict(line.split() for line in _read(path, "cpu.stat").splitlines())
+            return int(cpu_stat["usage_usec"]) / 1e6, int(_read(path, "memory.current"))
+        except (OSError, KeyError, ValueError):
+            return None
+
+def preexec(cgroup_dir, limits, language):
+    """Function for Popen(preexec_fn=...) that puts the child under its limits.
+
+    Runs in the forked child before exec, so everything it needs is
+    computed here and the function itself only makes plain syscalls.
+    """
+    procs_path = os.path.join(cgroup_dir, "cgroup.procs") if cgroup_dir else None
+    fds = limits["fds_limit"]
+    address_space = limits["memory_limit"] * ADDRESS_SPACE_HEADROOM * 1024 * 1024
+    # V8 reserves far more address space than it uses
+    cap_address_space = bool(address_space) and language != "node"
+
+    def apply():
+        in_cgroup = False
+        if procs_path is not None:
+            try:
+                fd = os.open(procs_path, os.O_WRONLY)
+                try:
+                    os.write(fd, str(os.getpid()).encode())
+                    in_cgroup = True
+                finally:
+                    os.close(fd)
+            except OSError:
+                pass
+
+        if fds:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (fds, fds))
+        if not in_cgroup:
+            os.nice(FALLBACK_NICE)
+            if cap_address_space:
+                resource.setrlimit(resource.RLIMIT_AS, (address_space, address_space))
+
+    return apply
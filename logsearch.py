@@ -0,0 +1,292 @@
+import os, re, json, sqlite3, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import re._parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from paths import DATA_DIR, LOGS_DIR
+import logwriter
+
+# -------------------------------
+# LOG SEARCH INDEX
+# -------------------------------
+# The supervisor cuts every bot's output into blocks of whole lines (about
+# INDEX_BLOCK_BYTES, or whatever arrived within INDEX_FLUSH_INTERVAL) and
+# records which lowercased byte trigrams occur in each block. A query only
+# reads the blocks that contain every trigram its literal parts need, then
+# confirms matches with the real regex. Offsets are logical: they keep
+# counting across rotations, matching the segment index kept by logwriter.
+#
+# The index lives in its own database so indexing never competes with
+# registry writes in devilcloud.db.
+INDEX_FILE = os.path.join(DATA_DIR, "logindex.db")
+
+INDEX_BLOCK_BYTES = 128 * 1024
+INDEX_FLUSH_INTERVAL = 60
+MAX_QUERY_TRIGRAMS = 16
+MAX_SEARCH_SECONDS = 10
+MAX_LINE_BYTES = 4096  # longer matching lines are clipped in results
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS log_blocks (
+    id INTEGER PRIMARY KEY,
+    bot_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    log_file TEXT NOT NULL,
+    start_offset INTEGER NOT NULL,
+    end_offset INTEGER NOT NULL,
+    start_time REAL NOT NULL,
+    end_time REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_blocks_bot ON log_blocks(bot_id, end_offset);
+CREATE INDEX IF NOT EXISTS idx_blocks_time ON log_blocks(end_time);
+CREATE TABLE IF NOT EXISTS log_trigrams (
+    trigram BLOB NOT NULL,
+    block_id INTEGER NOT NULL,
+    PRIMARY KEY (trigram, block_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_trigrams_block ON log_trigrams(block_id);
+"""
+
+_local = threading.local()
+
+def get_connection():
+    """Return this thread's index connection, reopening it after a fork"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(INDEX_FILE, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+def _write(fn, *args):
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        fn(conn, *args)
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+
+# -------------------------------
+# TRIGRAMS
+# -------------------------------
+def block_trigrams(data):
+    """Distinct lowercased trigrams of a block, never spanning a newline"""
+    trigrams = set()
+    for line in data.lower().split(b"\n"):
+        trigrams.update(line[i:i + 3] for i in range(len(line) - 2))
+    return trigrams
+
+def _literal_runs(parsed):
+    """Literal strings every match of a parsed regex must contain"""
+    runs, current = [], []
+    for op, av in parsed:
+        if op is sre_parse.LITERAL:
+            current.append(av)
+            continue
+        runs.append(current)
+        current = []
+        if op is sre_parse.SUBPATTERN:
+            runs.extend(_literal_runs(av[-1]))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT) and av[0] >= 1:
+            runs.extend(_literal_runs(av[2]))
+    runs.append(current)
+    return [run for run in runs if len(run) >= 3]
+
+def query_trigrams(pattern):
+    """Trigrams a block must contain to possibly match a bytes pattern.
+
+    Empty when nothing is required (e.g. a pure character class), in which
+    case every block is a candidate.
+    """
+    trigrams = set()
+    for run in _literal_runs(sre_parse.parse(pattern.pattern, pattern.flags)):
+        literal = bytes(run).lower()
+        for i in range(len(literal) - 2):
+            trigram = literal[i:i + 3]
+            # Block trigrams never span a newline, so neither may these
+            if b"\n" in trigram:
+                continue
+            # Case-folding of non-ASCII bytes doesn't survive bytes.lower()
+            if not (pattern.flags & re.IGNORECASE) or trigram.isascii():
+                trigrams.add(trigram)
+    # Keep a spread across the query; more adds little selectivity
+    trigrams = sorted(trigrams)
+    step = max(1, len(trigrams) // MAX_QUERY_TRIGRAMS)
+    return trigrams[::step][:MAX_QUERY_TRIGRAMS]
+
+# -------------------------------
+# WRITING (supervisor side)
+# -------------------------------
+class LogIndex:
+    """Indexes blocks handed over by logwriter.BotLog on a worker thread.
+
+    Every write goes through one thread so a bot's blocks, and dropping
+    them, are applied in the order they were submitted.
+    """
+
+    block_bytes = INDEX_BLOCK_BYTES
+    flush_interval = INDEX_FLUSH_INTERVAL
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-index")
+
+    def indexed_end(self, bot_id):
+        row = get_connection().execute(
+            "SELECT MAX(end_offset) AS end FROM log_blocks WHERE bot_id = ?", (bot_id,)
+        ).fetchone()
+        return row["end"]
+
+    def add_block(self, bot_id, username, log_file, start_offset, data, start_time, end_time):
+        self.executor.submit(self._safely, self._add_block, bot_id, username, log_file, start_offset, data, start_time, end_time)
+
+    def drop_before(self, bot_id, offset):
+        """Forget blocks whose bytes were pruned from the archive"""
+        self.executor.submit(self._safely, _write, _drop_blocks, "bot_id = ? AND end_offset <= ?", (bot_id, offset))
+
+    def drop_bot(self, bot_id):
+        self.executor.submit(self._safely, drop_bot, bot_id)
+
+    def _safely(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"Log index error: {e}")
+
+    def _add_block(self, bot_id, username, log_file, start_offset, data, start_time, end_time):
+        # Oversized hand-overs are split on line boundaries
+        pos = 0
+        while pos < len(data):
+            cut = len(data)
+            if cut - pos > self.block_bytes:
+                newline = data.rfind(b"\n", pos, pos + self.block_bytes)
+                cut = newline + 1 if newline != -1 else pos + self.block_bytes
+            chunk = data[pos:cut]
+            _write(_insert_block, (bot_id, username, log_file, start_offset + pos,
+                                   start_offset + cut, start_time, end_time), block_trigrams(chunk))
+            pos = cut
+
+def _insert_block(conn, row, trigrams):
+    cursor = conn.execute(
+        "INSERT INTO log_blocks (bot_id, username, log_file, start_offset, end_offset, start_time, end_time) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)", row
+    )
+    block_id = cursor.lastrowid
+    conn.executemany("INSERT OR IGNORE INTO log_trigrams (trigram, block_id) VALUES (?, ?)",
+                     ((trigram, block_id) for trigram in trigrams))
+
+def _drop_blocks(conn, where, args):
+    conn.execute(f"DELETE FROM log_trigrams WHERE block_id IN (SELECT id FROM log_blocks WHERE {where})", args)
+    conn.execute(f"DELETE FROM log_blocks WHERE {where}", args)
+
+def drop_bot(bot_id):
+    _write(_drop_blocks, "bot_id = ?", (bot_id,))
+
+# -------------------------------
+# SEARCHING (web side)
+# -------------------------------
+def compile_query(query, regex=False, ignore_case=False):
+    """Bytes pattern for a query; raises re.error for a bad regex"""
+    source = query.encode() if regex else re.escape(query.encode())
+    return re.compile(source, re.MULTILINE | (re.IGNORECASE if ignore_case else 0))
+
+def candidate_blocks(bot_ids, trigrams):
+    """Blocks of the given bots holding every trigram, newest first"""
+    args = []
+    query = "SELECT b.* FROM log_blocks b "
+    if trigrams:
+        query += (
+            "JOIN (SELECT block_id FROM log_trigrams WHERE trigram IN (%s) "
+            "GROUP BY block_id HAVING COUNT(*) = ?) t ON t.block_id = b.id "
+        ) % ", ".join("?" * len(trigrams))
+        args += trigrams + [len(trigrams)]
+    query += "WHERE b.bot_id IN (SELECT value FROM json_each(?)) ORDER BY b.end_time DESC, b.start_offset DESC"
+    args.append(json.dumps(bot_ids))
+    return get_connection().execute(query, args).fetchall()
+
+def _matches(pattern, data, base_offset):
+    """(logical offset, line) for each line of `data` matching `pattern`"""
+    pos = 0
+    while True:
+        match = pattern.search(data, pos)
+        if match is None:
+            return
+        start = data.rfind(b"\n", 0, match.start()) + 1
+        end = data.find(b"\n", match.end())
+        end = len(data) if end == -1 else end
+        yield base_offset + start, data[start:min(end, start + MAX_LINE_BYTES)].decode('utf-8', errors='replace')
+        pos = end + 1
+        if pos > len(data):
+            return
+
+def search(bots, query, regex=False, ignore_case=False, limit=100):
+    """Search the logs of `bots` (dicts the caller may read).
+
+    Results are newest block first; `timestamp` is when the block holding
+    the line was flushed, so it is accurate to about INDEX_FLUSH_INTERVAL.
+    Output not yet handed to the index is scanned directly.
+    """
+    pattern = compile_query(query, regex, ignore_case)
+    trigrams = query_trigrams(pattern)
+    bots_by_id = {bot["id"]: bot for bot in bots}
+    deadline = time.monotonic() + MAX_SEARCH_SECONDS
+    results = []
+    truncated = False
+
+    def add(bot, offset, line, timestamp):
+        results.append({"bot_id": bot["id"], "bot_name": bot.get("name"), "offset": offset,
+                        "timestamp": timestamp, "line": line})
+        return len(results) >= limit
+
+    indexes = {}
+
+    def log_index(bot):
+        if bot["id"] not in indexes:
+            indexes[bot["id"]] = logwriter.load_index(bot["log_file"])
+        return indexes[bot["id"]]
+
+    # Newest output first: the not-yet-indexed tail of each active log
+    indexed_ends = dict(get_connection().execute(
+        "SELECT bot_id, MAX(end_offset) FROM log_blocks "
+        "WHERE bot_id IN (SELECT value FROM json_each(?)) GROUP BY bot_id", (json.dumps(list(bots_by_id)),)
+    ).fetchall())
+
+    for bot in bots:
+        if time.monotonic() > deadline:
+            return {"results": results, "truncated": True}
+        path = os.path.join(LOGS_DIR, bot["log_file"])
+        active_start = log_index(bot)["active_start_offset"]
+        start = max(indexed_ends.get(bot["id"]) or 0, active_start)
+        try:
+            data = logwriter.read_logical(bot["log_file"], start, None, log_index(bot))
+            mtime = os.path.getmtime(path)
+        except OSError:
+            continue
+        for offset, line in _matches(pattern, data, start):
+            if add(bot, offset, line, mtime):
+                return {"results": results, "truncated": True}
+
+    blocks = candidate_blocks(list(bots_by_id), trigrams)
+    for scanned, block in enumerate(blocks):
+        if time.monotonic() > deadline:
+            truncated = True
+            break
+        bot = bots_by_id[block["bot_id"]]
+        try:
+            data = logwriter.read_logical(bot["log_file"], block["start_offset"], block["end_offset"], log_index(bot))
+        except OSError:
+            continue  # pruned or deleted since it was indexed
+        for offset, line in _matches(pattern, data, block["start_offset"]):
+            if add(bot, offset, line, block["end_time"]):
+                return {"results": results, "truncated": scanned + 1 < len(blocks)}
+
+    return {"results": results, "truncated": truncated}
@@ -0,0 +1,191 @@
+import os, time
+
+# -------------------------------
+# LOG TAILING
+# -------------------------------
+BLOCK_SIZE = 8192
+POLL_INTERVAL = 0.5
+MAX_CHUNK = 64 * 1024         # largest single push to a client
+MAX_LAG = 1024 * 1024         # a client further behind than this skips ahead
+HEARTBEAT_INTERVAL = 15
+MAX_PAGE_BYTES = 1024 * 1024   # hard cap on one page, however long its lines are
+# Sync gunicorn workers are killed after 120 s; end the response well before
+# that and let EventSource reconnect with Last-Event-ID.
+MAX_STREAM_SECONDS = 55
+# Yielded by sse_steps() when there is nothing to send yet
+WAIT = None
+
+def log_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def tail_offset(path, lines, end=None):
+    """Byte offset where the last `lines` lines before `end` begin, reading backwards"""
+    with open(path, 'rb') as f:
+        if end is None:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+        if lines <= 0:
+            return end
+        pos = end
+        newlines = 0
+
+        # A trailing newline terminates the last line rather than starting a new one
+        if pos > 0:
+            f.seek(pos - 1)
+            if f.read(1) == b"\n":
+                newlines = -1
+
+        while pos > 0:
+            read_size = min(BLOCK_SIZE, pos)
+            pos -= read_size
+            f.seek(pos)
+            block = f.read(read_size)
+            count = block.count(b"\n")
+            if newlines + count >= lines:
+                # Walk this block from its end to find the exact line start
+                idx = len(block)
+                for _ in range(lines - newlines):
+                    idx = block.rindex(b"\n", 0, idx)
+                return pos + idx + 1
+            newlines += count
+        return 0
+
+def forward_offset(path, start, lines, end):
+    """Byte offset just past the next `lines` complete lines after `start`"""
+    with open(path, 'rb') as f:
+        pos = start
+        last_newline = None
+        while pos < end and lines > 0:
+            f.seek(pos)
+            block = f.read(min(BLOCK_SIZE, end - pos))
+            idx = -1
+            while lines > 0:
+                idx = block.find(b"\n", idx + 1)
+                if idx == -1:
+                    break
+                lines -= 1
+                last_newline = pos + idx
+            pos += len(block)
+        # Running out of file stops after the last complete line; a file with
+        # no newline at all is one partial line
+        return end if last_newline is None else last_newline + 1
+
+def read_range(path, start, end):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+def read_tail(path, lines, end=None):
+    """The last `lines` lines of a file as text; cost is O(lines), not O(file)"""
+    if end is None:
+        end = log_size(path)
+    start = max(tail_offset(path, lines, end), end - MAX_PAGE_BYTES)
+    return read_range(path, start, end).decode('utf-8', errors='replace')
+
+def read_page(path, before=None, after=None, limit=100):
+    """One page of lines addressed by byte offsets.
+
+    after=N reads forward from offset N, before=N reads the lines ending at
+    N, neither reads the end of the file. The returned start/end offsets are
+    what the next page request passes back as before/after.
+    """
+    size = log_size(path)
+
+    if after is not None:
+        start = min(after, size)
+        end = forward_offset(path, start, limit, size) if start < size else size
+        end = min(end, start + MAX_PAGE_BYTES)
+    else:
+        end = size if before is None else min(before, size)
+        start = tail_offset(path, limit, end) if end else 0
+        start = max(start, end - MAX_PAGE_BYTES)
+
+    data = read_range(path, start, end) if end > start else b""
+    return {
+        "lines": data.decode('utf-8', errors='replace').splitlines(keepends=True),
+        "start": start,
+        "end": end,
+        "size": size,
+        "has_older": start > 0,
+        "has_newer": end < size,
+    }
+
+def sse_event(data, event=None, event_id=None):
+    parts = []
+    if event:
+        parts.append(f"event: {event}")
+    if event_id is not None:
+        parts.append(f"id: {event_id}")
+    for line in data.split("\n"):
+        parts.append(f"data: {line.rstrip(chr(13))}")
+    return "\n".join(parts) + "\n\n"
+
+def sse_stream(path, offset=None, lines=100):
+    """sse_steps() for a sync worker: sleeps in place of WAIT"""
+    for event in sse_steps(path, offset, lines):
+        if event is WAIT:
+            time.sleep(POLL_INTERVAL)
+        else:
+            yield event
+
+def sse_steps(path, offset=None, lines=100, max_seconds=MAX_STREAM_SECONDS):
+    """Server-sent events for a log file: the last `lines` lines, then appended output.
+
+    Event ids are byte offsets so a reconnecting client resumes exactly where
+    it left off. Each push is capped at MAX_CHUNK; a client that falls more
+    than MAX_LAG behind (the generator only advances as fast as the socket
+    drains) jumps forward and gets a 'skipped' event instead of an unbounded
+    backlog. Yields WAIT when caught up; the caller pauses POLL_INTERVAL
+    before asking for more, so the same stream serves sync and async servers.
+    """
+    yield "retry: 1000\n\n"
+
+    size = log_size(path)
+    if offset is None or offset > size:
+        offset = tail_offset(path, lines) if size else 0
+    inode = _inode(path)
+
+    started = last_sent = time.monotonic()
+    while time.monotonic() - started < max_seconds:
+        current_inode = _inode(path)
+        size = log_size(path)
+
+        # Rotated or truncated underneath us: start over on the new file
+        if current_inode != inode or size < offset:
+            inode = current_inode
+            offset = 0
+            yield sse_event("log file was rotated", event="reset", event_id=0)
+
+        if size - offset > MAX_LAG:
+            skipped = size - MAX_LAG - offset
+            offset = size - MAX_LAG
+            yield sse_event(str(skipped), event="skipped", event_id=offset)
+
+        if size > offset:
+            chunk = read_range(path, offset, min(size, offset + MAX_CHUNK))
+            # Only push whole lines unless a single line fills the chunk
+            cut = chunk.rfind(b"\n")
+            if cut != -1:
+                chunk = chunk[:cut + 1]
+            elif len(chunk) < MAX_CHUNK:
+                chunk = b""
+
+            if chunk:
+                offset += len(chunk)
+                last_sent = time.monotonic()
+                yield sse_event(chunk.decode('utf-8', errors='replace').rstrip("\n"), event_id=offset)
+                continue
+
+        if time.monotonic() - last_sent >= HEARTBEAT_INTERVAL:
+            last_sent = time.monotonic()
+            yield ": keep-alive\n\n"
+        yield WAIT
+
+def _inode(path):
+    try:
+        return os.stat(path).st_ino
+    except OSError:
+        return None
@@ -0,0 +1,431 @@
+import os, json, gzip, shutil, time, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from paths import LOGS_DIR, DATA_DIR
+import storage
+import cache
+import limits
+
+# -------------------------------
+# MANAGED BOT LOGS
+# -------------------------------
+# Bots write into a per-bot FIFO; the supervisor drains it into the active
+# log file logs/<log_file>, rotating it into logs/archive/<stem>/ by size or
+# age and gzipping finished segments off the event loop. Each archive dir
+# has an index.json listing segments with their time range and logical byte
+# range, so a reader can find old output without decompressing everything.
+ARCHIVE_DIR = os.path.join(LOGS_DIR, "archive")
+PIPES_DIR = os.path.join(DATA_DIR, "pipes")
+CONFIG_FILE = os.path.join(DATA_DIR, "config.json")
+
+MAX_SEGMENT_BYTES = 10 * 1024 * 1024
+MAX_SEGMENT_AGE = 24 * 3600
+DEFAULT_USER_LOG_QUOTA = 200  # MB, overridable with "user_log_quota" in config.json
+PIPE_BUFFER_SIZE = 1024 * 1024
+F_SETPIPE_SZ = 1031
+QUOTA_NOTICE = b"\n[log quota or storage limit exceeded, output dropped until there is room]\n"
+
+os.makedirs(ARCHIVE_DIR, exist_ok=True)
+os.makedirs(PIPES_DIR, exist_ok=True)
+
+_compressor = None
+_compressor_lock = threading.Lock()
+
+def compressor():
+    global _compressor
+    with _compressor_lock:
+        if _compressor is None:
+            _compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="log-compress")
+        return _compressor
+
+# -------------------------------
+# SEGMENT INDEX
+# -------------------------------
+def archive_dir(log_file):
+    return os.path.join(ARCHIVE_DIR, os.path.splitext(log_file)[0])
+
+def index_path(log_file):
+    return os.path.join(archive_dir(log_file), "index.json")
+
+def load_index(log_file):
+    try:
+        with open(index_path(log_file), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"next_seq": 1, "active_start_offset": 0, "active_since": None, "segments": []}
+
+def save_index(log_file, index):
+    os.makedirs(archive_dir(log_file), exist_ok=True)
+    path = index_path(log_file)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=4)
+    os.replace(tmp_path, path)
+
+def segments_between(log_file, since=None, until=None):
+    """Archived segments whose time range overlaps [since, until] (epoch seconds)"""
+    return [
+        segment for segment in load_index(log_file)["segments"]
+        if (since is None or segment["end_time"] >= since) and (until is None or segment["start_time"] <= until)
+    ]
+
+def open_segment(log_file, segment):
+    path = os.path.join(archive_dir(log_file), segment["file"])
+    return gzip.open(path, 'rb') if segment.get("compressed") else open(path, 'rb')
+
+def read_logical(log_file, start, end=None, index=None):
+    """Bytes [start, end) of a bot's output by logical offset; end=None reads to the live end.
+
+    The range must lie within one segment or the active file, which holds
+    for search index blocks since those are cut at every rotation.
+    """
+    if index is None:
+        index = load_index(log_file)
+
+    active_start = index["active_start_offset"]
+    if start >= active_start:
+        with open(os.path.join(LOGS_DIR, log_file), 'rb') as f:
+            f.seek(start - active_start)
+            return f.read() if end is None else f.read(end - start)
+
+    for segment in index["segments"]:
+        segment_end = segment["start_offset"] + segment["bytes"]
+        if segment["start_offset"] <= start < segment_end:
+            with open_segment(log_file, segment) as f:
+                f.seek(start - segment["start_offset"])
+                return f.read(min(segment_end if end is None else end, segment_end) - start)
+
+    raise FileNotFoundError(f"Offset {start} of {log_file} is no longer archived")
+
+def log_disk_usage(log_file):
+    total = 0
+    try:
+        total += os.path.getsize(os.path.join(LOGS_DIR, log_file))
+    except OSError:
+        pass
+    for segment in load_index(log_file)["segments"]:
+        total += segment.get("compressed_bytes", segment["bytes"])
+    return total
+
+def remove_logs(log_file):
+    """Delete a bot's active log, archives and index"""
+    try:
+        os.remove(os.path.join(LOGS_DIR, log_file))
+    except OSError:
+        pass
+    shutil.rmtree(archive_dir(log_file), ignore_errors=True)
+
+def user_log_quota():
+    def read_quota():
+        with open(CONFIG_FILE, 'r') as f:
+            return json.load(f).get("user_log_quota", DEFAULT_USER_LOG_QUOTA)
+    try:
+        quota = cache.cached("log_quota", lambda: cache.file_version(CONFIG_FILE), read_quota)
+    except (OSError, ValueError):
+        quota = DEFAULT_USER_LOG_QUOTA
+    return quota * 1024 * 1024
+
+# -------------------------------
+# FIFOS
+# -------------------------------
+def pipe_path(bot_id):
+    return os.path.join(PIPES_DIR, f"{bot_id}.fifo")
+
+def open_bot_pipe(bot_id):
+    """Write end for a bot's stdout/stderr.
+
+    Opened O_RDWR so the child itself also counts as a reader: while the
+    supervisor is restarting, writes fill the pipe buffer and then block
+    instead of killing the bot with SIGPIPE.
+    """
+    path = pipe_path(bot_id)
+    if not os.path.exists(path):
+        os.mkfifo(path, 0o600)
+    fd = os.open(path, os.O_RDWR)
+    try:
+        import fcntl
+        fcntl.fcntl(fd, F_SETPIPE_SZ, PIPE_BUFFER_SIZE)
+    except (ImportError, OSError):
+        pass
+    return fd
+
+def open_pipe_reader(bot_id):
+    path = pipe_path(bot_id)
+    if not os.path.exists(path):
+        return None
+    return os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+
+def remove_pipe(bot_id):
+    try:
+        os.remove(pipe_path(bot_id))
+    except OSError:
+        pass
+
+# -------------------------------
+# WRITERS
+# -------------------------------
+class BotLog:
+    """Active log file of one bot, rotated by size and age"""
+
+    def __init__(self, manager, bot):
+        self.manager = manager
+        self.bot_id = bot["id"]
+        self.username = bot["username"]
+        self.log_file = bot["log_file"]
+        self.path = os.path.join(LOGS_DIR, self.log_file)
+        self.lock = threading.Lock()
+        self.dropping = False
+
+        self.index = load_index(self.log_file)
+        self.index["username"] = self.username
+        if not self.index.get("active_since"):
+            self.index["active_since"] = time.time()
+            save_index(self.log_file, self.index)
+
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+
+        # Output not yet handed to the search index. After a supervisor
+        # restart, whatever the index missed is re-read from the active file.
+        self.pending = bytearray()
+        self.pending_start = self.index["active_start_offset"] + self.size
+        self.pending_since = time.time()
+        if manager.search_index is not None:
+            indexed = max(manager.search_index.indexed_end(self.bot_id) or 0, self.index["active_start_offset"])
+            unindexed = min(self.pending_start - indexed, MAX_SEGMENT_BYTES)
+            if unindexed > 0:
+                with open(self.path, 'rb') as f:
+                    f.seek(self.size - unindexed)
+                    self.pending += f.read(unindexed)
+                self.pending_start -= unindexed
+                self.pending_since = self.index["active_since"]
+
+    def write(self, data):
+        if not self.manager.reserve(self.username, len(data)):
+            if not self.dropping:
+                self.dropping = True
+                # The notice is output like any other; it is skipped if even it doesn't fit
+                if self.manager.reserve(self.username, len(QUOTA_NOTICE)):
+                    self._append(QUOTA_NOTICE)
+            return
+
+        self.dropping = False
+        self._append(data)
+
+        search_index = self.manager.search_index
+        if search_index is not None and (len(self.pending) >= search_index.block_bytes or
+                                         time.time() - self.pending_since >= search_index.flush_interval):
+            self.flush_index()
+
+        if self.size >= MAX_SEGMENT_BYTES or time.time() - self.index["active_since"] >= MAX_SEGMENT_AGE:
+            self.rotate()
+
+    def _append(self, data):
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+        if self.manager.search_index is not None:
+            self.pending += data
+
+    def flush_index(self, final=False):
+        """Hand buffered output to the search index; whole lines only unless final"""
+        if self.manager.search_index is None or not self.pending:
+            return
+        cut = len(self.pending) if final else self.pending.rfind(b"\n") + 1
+        if cut == 0:
+            # One long unfinished line: wait for its end unless it fills a block
+            if len(self.pending) < self.manager.search_index.block_bytes:
+                return
+            cut = len(self.pending)
+
+        now = time.time()
+        self.manager.search_index.add_block(self.bot_id, self.username, self.log_file, self.pending_start,
+                                            bytes(self.pending[:cut]), self.pending_since, now)
+        del self.pending[:cut]
+        self.pending_start += cut
+        self.pending_since = now
+
+    def rotate(self):
+        if self.size == 0:
+            return
+        # Index blocks never straddle two segments
+        self.flush_index(final=True)
+        now = time.time()
+
+        with self.lock:
+            seq = self.index["next_seq"]
+            self.index["next_seq"] += 1
+            segment = {
+                "seq": seq,
+                "file": f"{os.path.splitext(self.log_file)[0]}.{seq}.log",
+                "start_offset": self.index["active_start_offset"],
+                "bytes": self.size,
+                "start_time": self.index["active_since"],
+                "end_time": now,
+                "compressed": False,
+            }
+
+            self.file.close()
+            os.makedirs(archive_dir(self.log_file), exist_ok=True)
+            os.replace(self.path, os.path.join(archive_dir(self.log_file), segment["file"]))
+
+            self.index["segments"].append(segment)
+            self.index["active_start_offset"] += self.size
+            self.index["active_since"] = now
+            save_index(self.log_file, self.index)
+
+            self.file = open(self.path, 'ab')
+            self.size = 0
+
+        compressor().submit(self._compress, segment)
+
+    def _compress(self, segment):
+        directory = archive_dir(self.log_file)
+        raw_path = os.path.join(directory, segment["file"])
+        gz_name = segment["file"] + ".gz"
+        tmp_path = os.path.join(directory, gz_name + ".tmp")
+
+        try:
+            with open(raw_path, 'rb') as src, gzip.open(tmp_path, 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(tmp_path, os.path.join(directory, gz_name))
+        except OSError as e:
+            print(f"Failed to compress {raw_path}: {e}")
+            return
+
+        compressed_bytes = os.path.getsize(os.path.join(directory, gz_name))
+        with self.lock:
+            segment["file"] = gz_name
+            segment["compressed"] = True
+            segment["compressed_bytes"] = compressed_bytes
+            save_index(self.log_file, self.index)
+        os.remove(raw_path)
+        self.manager.release(self.username, segment["bytes"] - compressed_bytes)
+
+    def close(self):
+        self.flush_index(final=True)
+        with self.lock:
+            self.file.close()
+
+class LogManager:
+    """Every open BotLog plus per-user on-disk totals for quota checks.
+
+    Totals are the "logs" rows of the storage.disk_usage ledger. Writes
+    adjust a local copy; sync_usage() adds the difference to the ledger and
+    picks up changes made by others, such as the web workers deleting a bot.
+    """
+
+    def __init__(self, search_index=None):
+        self.search_index = search_index
+        self.logs = {}
+        self.usage = {}       # username -> log bytes
+        self.unsynced = {}    # username -> bytes not yet added to the ledger
+        self.allowance = {}   # username -> bytes the user's logs may take
+        # Users with nothing left to prune. Pruning lists every bot's
+        # segments, so it is not retried on each write but only once
+        # something changes: a segment is compressed or usage is synced.
+        self.exhausted = set()
+        self.lock = threading.Lock()
+
+    def get(self, bot):
+        log = self.logs.get(bot["id"])
+        if log is None:
+            log = self.logs[bot["id"]] = BotLog(self, bot)
+        return log
+
+    def close(self, bot_id):
+        log = self.logs.pop(bot_id, None)
+        if log is not None:
+            log.close()
+
+    def _load(self, username):
+        if username in self.usage:
+            return
+        ledger = storage.get_usage(username)
+        if "logs" not in ledger:
+            # First sight of this user: count once from the segment indexes
+            ledger["logs"] = sum(log_disk_usage(bot["log_file"]) for bot in storage.list_bots(username=username))
+            storage.set_usage(username, "logs", ledger["logs"])
+        self.usage[username] = ledger["logs"]
+        self.unsynced[username] = 0
+        self.allowance[username] = self._allowance(username, ledger)
+
+    def _allowance(self, username, ledger):
+        """The log quota, or less when code already fills the storage limit"""
+        allowance = user_log_quota()
+        storage_limit = limits.storage_limit(storage.get_user(username))
+        if storage_limit is not None:
+            others = sum(nbytes for category, nbytes in ledger.items() if category != "logs")
+            allowance = min(allowance, storage_limit - others)
+        return allowance
+
+    def _adjust(self, username, nbytes):
+        self.usage[username] += nbytes
+        self.unsynced[username] += nbytes
+
+    def reserve(self, username, nbytes):
+        with self.lock:
+            self._load(username)
+            if self.usage[username] + nbytes > self.allowance[username] and username not in self.exhausted:
+                self._prune(username, nbytes)
+                if self.usage[username] + nbytes > self.allowance[username]:
+                    self.exhausted.add(username)
+            if self.usage[username] + nbytes > self.allowance[username]:
+                return False
+            self._adjust(username, nbytes)
+            return True
+
+    def release(self, username, nbytes):
+        with self.lock:
+            self.exhausted.discard(username)
+            if username in self.usage:
+                self._adjust(username, -nbytes)
+
+    def sync_usage(self):
+        """Flush local changes to the ledger and refresh totals and allowances from it"""
+        with self.lock, storage.transaction():
+            self.exhausted.clear()
+            for username in self.usage:
+                if self.unsynced[username]:
+                    storage.add_usage(username, "logs", self.unsynced[username])
+                ledger = storage.get_usage(username)
+                self.usage[username] = ledger.get("logs", 0)
+                self.unsynced[username] = 0
+                self.allowance[username] = self._allowance(username, ledger)
+
+    def reconcile(self, username, nbytes):
+        """Replace a user's log total with a fresh count from disk"""
+        with self.lock:
+            self.exhausted.discard(username)
+            storage.set_usage(username, "logs", nbytes)
+            if username in self.usage:
+                self.usage[username] = nbytes
+                self.unsynced[username] = 0
+
+    def _prune(self, username, needed):
+        """Drop the user's oldest compressed segments until `needed` more bytes fit"""
+        candidates = []
+        for bot in storage.list_bots(username=username):
+            log = self.logs.get(bot["id"])
+            index = log.index if log is not None else load_index(bot["log_file"])
+            for segment in index["segments"]:
+                if segment.get("compressed"):
+                    candidates.append((segment["end_time"], bot["id"], bot["log_file"], index, segment, log))
+
+        for _, bot_id, log_file, index, segment, log in sorted(candidates, key=lambda c: c[0]):
+            if self.usage[username] + needed <= self.allowance[username]:
+                break
+            try:
+                os.remove(os.path.join(archive_dir(log_file), segment["file"]))
+            except OSError:
+                pass
+            if log is not None:
+                with log.lock:
+                    index["segments"].remove(segment)
+                    save_index(log_file, index)
+            else:
+                index["segments"].remove(segment)
+                save_index(log_file, index)
+            self._adjust(username, -segment["compressed_bytes"])
+            if self.search_index is not None:
+                self.search_index.drop_before(bot_id, segment["start_offset"] + segment["bytes"])
@@ -0,0 +1,286 @@
+import os, json, time
+from array import array
+
+import psutil
+
+from paths import HOME_DIR, DATA_DIR
+
+# -------------------------------
+# PER-BOT RESOURCE METRICS
+# -------------------------------
+# The supervisor samples every bot's process tree in one pass over the
+# process table per interval and keeps the results in fixed-size ring
+# buffers: SAMPLE_INTERVAL samples for an hour, plus minute and hour
+# averages. Memory per bot is fixed, however long it runs. Buffers are
+# allocated on a bot's first sample and freed once a stopped bot's samples
+# have all aged out of them, so bots that don't run cost next to nothing.
+SAMPLE_INTERVAL = 1
+PRUNE_INTERVAL = 60
+FIELDS = ["cpu", "memory", "threads", "fds", "read_bps", "write_bps"]
+# resolution in seconds -> number of slots
+RESOLUTIONS = {
+    "second": (SAMPLE_INTERVAL, 3600),
+    "minute": (60, 1440),
+    "hour": (3600, 720),
+}
+
+class Series:
+    """Ring buffer of samples at a fixed resolution.
+
+    A sample lands in slot (time // resolution) % capacity, and each slot
+    remembers which period it holds, so gaps (bot stopped, missed samples)
+    read back as None instead of stale values.
+    """
+
+    def __init__(self, resolution, capacity):
+        self.resolution = resolution
+        self.capacity = capacity
+        self.periods = None
+        self.values = None
+        self.newest = None  # newest period written
+
+    def add(self, timestamp, sample):
+        if self.periods is None:
+            self.periods = array('q', [-1]) * self.capacity
+            self.values = {field: array('f', [0.0]) * self.capacity for field in FIELDS}
+        period = int(timestamp // self.resolution)
+        i = period % self.capacity
+        self.periods[i] = period
+        self.newest = period if self.newest is None else max(self.newest, period)
+        for field in FIELDS:
+            self.values[field][i] = sample[field]
+
+    def expired(self, now):
+        """Whether every sample held is too old to be read back"""
+        return self.newest is None or int(now // self.resolution) - self.newest >= self.capacity
+
+    def release(self):
+        self.periods = None
+        self.values = None
+        self.newest = None
+
+    def read(self, now, points):
+        points = max(1, min(points, self.capacity))
+        last = int(now // self.resolution)
+        first = last - points + 1
+        series = {field: [] for field in FIELDS}
+        for period in range(first, last + 1):
+            i = period % self.capacity
+            present = self.periods is not None and self.periods[i] == period
+            for field in FIELDS:
+                series[field].append(round(self.values[field][i], 2) if present else None)
+        return {"start": first * self.resolution, "step": self.resolution, "series": series}
+
+class Rollup:
+    """Averages samples over one period of `series` and stores the result"""
+
+    def __init__(self, series):
+        self.series = series
+        self.period = None
+        self.sums = dict.fromkeys(FIELDS, 0.0)
+        self.count = 0
+
+    def add(self, timestamp, sample):
+        period = int(timestamp // self.series.resolution)
+        if period != self.period:
+            self.flush()
+            self.period = period
+        for field in FIELDS:
+            self.sums[field] += sample[field]
+        self.count += 1
+
+    def flush(self):
+        if self.count:
+            self.series.add(self.period * self.series.resolution,
+                            {field: total / self.count for field, total in self.sums.items()})
+        self.sums = dict.fromkeys(FIELDS, 0.0)
+        self.count = 0
+
+class BotMetrics:
+    def __init__(self):
+        self.series = {name: Series(*spec) for name, spec in RESOLUTIONS.items()}
+        self.minute = Rollup(self.series["minute"])
+        self.hour = Rollup(self.series["hour"])
+        self.latest = None
+
+    def add(self, timestamp, sample):
+        self.latest = sample
+        self.series["second"].add(timestamp, sample)
+        self.minute.add(timestamp, sample)
+        self.hour.add(timestamp, sample)
+
+    def prune(self, now):
+        """Free what a stopped bot no longer needs; True once nothing is left"""
+        for rollup in (self.minute, self.hour):
+            if rollup.count and rollup.period != int(now // rollup.series.resolution):
+                rollup.flush()
+        for series in self.series.values():
+            if series.periods is not None and series.expired(now):
+                series.release()
+        return all(series.periods is None for series in self.series.values()) and \
+            not self.minute.count and not self.hour.count
+
+    def read(self, resolution, points):
+        now = time.time()
+        data = self.series[resolution].read(now, points)
+        # The newest point may be a period that is still being averaged
+        rollup = {"minute": self.minute, "hour": self.hour}.get(resolution)
+        if rollup is not None and rollup.count and rollup.period == int(now // rollup.series.resolution):
+            i = len(data["series"]["cpu"]) - 1
+            for field in FIELDS:
+                data["series"][field][i] = round(rollup.sums[field] / rollup.count, 2)
+        return data
+
+# -------------------------------
+# SAMPLER
+# -------------------------------
+# Read only for processes in a bot's tree; finding them needs just ppid
+SAMPLE_ATTRS = ["create_time", "cpu_times", "memory_info", "num_threads", "num_fds", "io_counters"]
+
+class Sampler:
+    """Samples the process trees rooted at a set of pids in one walk of the process table.
+
+    CPU and I/O are per-pid counter deltas between passes, so children that
+    come and go between samples are still accounted for while they live.
+    """
+
+    def __init__(self):
+        self.bots = {}
+        self.previous = {}  # pid -> (cpu seconds, read bytes, write bytes)
+        self.previous_cgroup = {}  # bot_id -> cpu seconds
+        self.last_sample = None
+        self.last_prune = 0
+        # Prime the host-wide counter behind system_snapshot()'s cpu figure
+        psutil.cpu_percent(interval=None)
+
+    def metrics(self, bot_id):
+        if bot_id not in self.bots:
+            self.bots[bot_id] = BotMetrics()
+        return self.bots[bot_id]
+
+    def forget(self, bot_id):
+        self.bots.pop(bot_id, None)
+
+    def sample(self, roots, cgroup_usage=None):
+        """roots: {pid: bot_id}. Returns {bot_id: sample} and records each one.
+
+        cgroup_usage(bot_id) -> (cpu seconds, memory bytes) or None; where
+        the kernel accounts a bot's cgroup, its CPU and memory come from
+        there instead, which also counts processes that left the tree.
+        """
+        now = time.time()
+        elapsed = now - self.last_sample if self.last_sample else None
+        self.last_sample = now
+
+        # No bots, no per-process pass: an idle supervisor stays idle
+        procs = {proc.pid: proc for proc in psutil.process_iter(["ppid"])} if roots else {}
+
+        # Walk each pid up to a bot's root pid, remembering the answers
+        owner = dict(roots)
+
+        def find_owner(pid):
+            path = []
+            while pid not in owner:
+                proc = procs.get(pid)
+                ppid = proc.info["ppid"] if proc is not None else None
+                if not ppid or ppid == pid:
+                    owner[pid] = None
+                    break
+                path.append(pid)
+                pid = ppid
+            for visited in path:
+                owner[visited] = owner[pid]
+            return owner[pid]
+
+        samples = {bot_id: dict.fromkeys(FIELDS, 0.0) for bot_id in roots.values()}
+        previous, self.previous = self.previous, {}
+        for pid, proc in procs.items():
+            bot_id = find_owner(pid)
+            if bot_id is None:
+                continue
+            try:
+                info = proc.as_dict(SAMPLE_ATTRS)
+            except psutil.NoSuchProcess:
+                continue
+            sample = samples[bot_id]
+
+            cpu = sum(info["cpu_times"][:2]) if info["cpu_times"] else 0.0
+            io = info["io_counters"]
+            read_bytes, write_bytes = (io.read_bytes, io.write_bytes) if io else (0, 0)
+            self.previous[pid] = (cpu, read_bytes, write_bytes)
+
+            if elapsed:
+                last = previous.get(pid)
+                if last is None:
+                    # New since the last pass: all of its usage is recent.
+                    # Otherwise (e.g. just adopted) it only sets a baseline.
+                    started = info["create_time"] or 0
+                    last = (0.0, 0, 0) if started >= now - elapsed else self.previous[pid]
+                last_cpu, last_read, last_write = last
+                sample["cpu"] += max(0.0, cpu - last_cpu) / elapsed * 100
+                sample["read_bps"] += max(0, read_bytes - last_read) / elapsed
+                sample["write_bps"] += max(0, write_bytes - last_write) / elapsed
+
+            if info["memory_info"]:
+                sample["memory"] += info["memory_info"].rss / (1024 * 1024)
+            sample["threads"] += info["num_threads"] or 0
+            sample["fds"] += info["num_fds"] or 0
+
+        previous_cgroup, self.previous_cgroup = self.previous_cgroup, {}
+        for bot_id, sample in samples.items():
+            usage = cgroup_usage(bot_id) if cgroup_usage else None
+            if usage is not None:
+                cpu, memory = usage
+                self.previous_cgroup[bot_id] = cpu
+                if elapsed and bot_id in previous_cgroup:
+                    sample["cpu"] = max(0.0, cpu - previous_cgroup[bot_id]) / elapsed * 100
+                sample["memory"] = memory / (1024 * 1024)
+            self.metrics(bot_id).add(now, sample)
+
+        if now - self.last_prune >= PRUNE_INTERVAL:
+            self.last_prune = now
+            for bot_id in [bot_id for bot_id in self.bots if bot_id not in samples]:
+                if self.bots[bot_id].prune(now):
+                    del self.bots[bot_id]
+        return samples
+
+# -------------------------------
+# SYSTEM SNAPSHOT
+# -------------------------------
+# Host and fleet totals, refreshed by the supervisor every SNAPSHOT_INTERVAL
+# and served to any number of dashboard pollers from this one file.
+SNAPSHOT_FILE = os.path.join(DATA_DIR, "system.json")
+SNAPSHOT_INTERVAL = 5
+
+def system_snapshot(samples):
+    """samples: the Sampler's latest {bot_id: sample} for supervised bots"""
+    memory = psutil.virtual_memory()
+    disk = psutil.disk_usage(HOME_DIR)
+    return {
+        # Since the previous snapshot: the supervisor is the only caller
+        "cpu": psutil.cpu_percent(interval=None),
+        "cpu_count": psutil.cpu_count(),
+        "memory_percent": memory.percent,
+        "memory_used": memory.used / (1024 * 1024),
+        "memory_total": memory.total / (1024 * 1024),
+        "disk_percent": disk.percent,
+        "disk_used": round(disk.used / (1024 ** 3), 1),
+        "disk_total": round(disk.total / (1024 ** 3), 1),
+        "uptime": int(time.time() - psutil.boot_time()),
+        "fleet": {
+            "supervised_bots": len(samples),
+            "cpu": round(sum(sample["cpu"] for sample in samples.values()), 1),
+            "memory": round(sum(sample["memory"] for sample in samples.values()), 1),
+        },
+        "sampled_at": time.time(),
+    }
+
+def write_snapshot(snapshot):
+    tmp_path = f"{SNAPSHOT_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(snapshot, f)
+    os.replace(tmp_path, SNAPSHOT_FILE)
+
+def read_snapshot():
+    with open(SNAPSHOT_FILE, 'r') as f:
+        return json.load(f)
@@ -0,0 +1,16 @@
+import os
+
+# -------------------------------
+# SHARED PATHS
+# -------------------------------
+# Code lives next to this file. State (bots, users, logs, data) lives under
+# DEVIL_CLOUD_HOME when it is set, e.g. to benchmark against a scratch copy.
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+HOME_DIR = os.environ.get("DEVIL_CLOUD_HOME") or BASE_DIR
+BOTS_DIR = os.path.join(HOME_DIR, "bots")
+USERS_DIR = os.path.join(HOME_DIR, "users")
+LOGS_DIR = os.path.join(HOME_DIR, "logs")
+DATA_DIR = os.path.join(HOME_DIR, "data")
+
+for dir_path in [BOTS_DIR, USERS_DIR, LOGS_DIR, DATA_DIR]:
+    os.makedirs(dir_path, exist_ok=True)
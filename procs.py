@@ -0,0 +1,86 @@
+import os
+
+import psutil
+
+# -------------------------------
+# PROCESS IDENTITY
+# -------------------------------
+# A pid alone doesn't name a process: after a reboot, or once enough
+# processes have come and gone, the pid in a bot record can belong to
+# something else entirely. A bot's record therefore also keeps its
+# process's identity: the kernel boot id, the start time in clock ticks
+# since boot (both from /proc, so they can't drift with the wall clock),
+# and its command line. A recorded pid is only trusted while all three
+# still match.
+PROC_DIR = "/proc"
+BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
+
+_boot_id = None
+
+def boot_id():
+    global _boot_id
+    if _boot_id is None:
+        try:
+            with open(BOOT_ID_FILE, 'r') as f:
+                _boot_id = f.read().strip()
+        except OSError:
+            _boot_id = ""
+    return _boot_id
+
+def start_time(pid):
+    """Start time of a process in clock ticks since boot, or None if it is gone"""
+    try:
+        with open(os.path.join(PROC_DIR, str(pid), "stat"), 'rb') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # comm (field 2) may contain spaces and parentheses; starttime is field 22
+    fields = stat[stat.rindex(b")") + 2:].split()
+    return int(fields[19])
+
+def cmdline(pid):
+    try:
+        with open(os.path.join(PROC_DIR, str(pid), "cmdline"), 'rb') as f:
+            return [arg.decode('utf-8', errors='replace') for arg in f.read().split(b"\0") if arg]
+    except OSError:
+        return None
+
+def identity(pid):
+    """Identity to record for a process just started, or None without /proc"""
+    start = start_time(pid)
+    if start is None:
+        return None
+    return {"boot": boot_id(), "start": start, "cmdline": cmdline(pid)}
+
+def scan():
+    """{pid: start time} of every process, in one pass over /proc; None without /proc"""
+    try:
+        entries = os.listdir(PROC_DIR)
+    except OSError:
+        return None
+    starts = {}
+    for entry in entries:
+        if entry.isdigit():
+            start = start_time(entry)
+            if start is not None:
+                starts[int(entry)] = start
+    return starts
+
+def is_same(pid, recorded, starts=None, fallback_arg=None):
+    """Whether pid is still the process recorded for it.
+
+    starts is a scan() to look the pid up in instead of reading /proc
+    again. A record from before identities were kept (recorded is None)
+    matches a live process whose command line contains fallback_arg, if
+    one is given.
+    """
+    start = starts.get(pid) if starts is not None else start_time(pid)
+    if start is None:
+        # Gone, unless there is no /proc to tell and existence is all we know
+        return not os.path.isdir(PROC_DIR) and psutil.pid_exists(pid)
+
+    if recorded is None:
+        return fallback_arg is None or fallback_arg in (cmdline(pid) or [])
+    return (recorded.get("boot") == boot_id()
+            and recorded.get("start") == start
+            and recorded.get("cmdline") == cmdline(pid))
@@ -1,100 +1,1131 @@
-import psutil, json, subprocess, time, os, signal
+import json, socket, subprocess, time, os, signal, selectors, heapq, itertools, threading, random
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-DATA_DIR = "data"
-BOTS_FILE = os.path.join(DATA_DIR, "bots.json")
-LOGS_DIR = "logs"
-BOTS_DIR = "bots"
+from paths import BOTS_DIR
+from control import SOCKET_PATH
+import storage
+import logwriter
+import logsearch
+import metrics
+import limits
+import usage
+import envs
+import zygote
+import procs
+import instrument
 
-def monitor_bots():
-    print("DEVIL CLOUD - Bot Monitor Started")
-    
-    while True:
+# pidfd_open (Linux 5.3+) gives a pollable fd per process, including ones we
+# did not spawn. Without it we fall back to SIGCHLD for our own children and
+# a slow poll for adopted ones.
+HAS_PIDFD = hasattr(os, "pidfd_open")
+ADOPTED_POLL_INTERVAL = 5
+STOP_GRACE_PERIOD = 5
+BULK_CONCURRENCY = 16      # bot operations a bulk command keeps in flight
+METRICS_SAVE_INTERVAL = 15  # how often cpu_usage/memory_usage reach the registry
+# Each write bumps the bots table version and with it every cached bot list
+# and dashboard diff, so smaller moves than these (percent, MB) are not saved
+CPU_USAGE_DEADBAND = 1.0
+MEMORY_USAGE_DEADBAND = 1.0
+# Record fields spawn() fills in, written back after it returns
+SPAWN_FIELDS = ("status", "pid", "pid_identity", "last_started", "last_error", "log_file", "restart_count",
+                "requirements", "requirements_strict")
+BUILD_WORKERS = 2           # dependency environments built at once
+ENV_COLLECT_INTERVAL = 3600
+
+# After a supervisor (or host) restart, bots that have to be started again
+# go through a StartScheduler instead of all at once
+BOOT_START_CONCURRENCY = max(2, os.cpu_count() or 1)
+BOOT_START_SETTLE = 2.0     # seconds a started bot holds its slot while it boots
+BOOT_START_JITTER = 0.25
+BOOT_STATUSES = ("running", "restarting", "building")  # in start order
+
+# -------------------------------
+# RESTART POLICY
+# -------------------------------
+class RestartPolicy:
+    """Exponential backoff with crash-loop detection for one bot"""
+
+    def __init__(self, base_delay=1.0, max_delay=300.0, stable_after=60.0, crash_window=120.0, max_crashes=5):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stable_after = stable_after
+        self.crash_window = crash_window
+        self.max_crashes = max_crashes
+        self.reset()
+
+    def reset(self):
+        self.delay = self.base_delay
+        self.crashes = deque()
+
+    def next_delay(self, started_at, now):
+        """Record a crash; return seconds to wait before restarting, or None to give up"""
+        if now - started_at >= self.stable_after:
+            self.reset()
+
+        self.crashes.append(now)
+        while now - self.crashes[0] > self.crash_window:
+            self.crashes.popleft()
+
+        if len(self.crashes) >= self.max_crashes:
+            return None
+
+        delay = self.delay
+        self.delay = min(self.delay * 2, self.max_delay)
+        return delay
+
+# -------------------------------
+# BOOT-TIME STARTS
+# -------------------------------
+class StartScheduler:
+    """Start queued bots in priority order, at most `concurrency` booting at once.
+
+    A bot holds its slot for `settle` seconds after it starts (its
+    interpreter is still loading), or until it fails to start. Each launch
+    waits a random fraction of `jitter` so starts don't land in lockstep.
+    """
+
+    def __init__(self, supervisor, concurrency=BOOT_START_CONCURRENCY, settle=BOOT_START_SETTLE, jitter=BOOT_START_JITTER):
+        self.supervisor = supervisor
+        self.concurrency = concurrency
+        self.settle = settle
+        self.jitter = jitter
+        self.queue = []
+        self.seq = itertools.count()
+        self.active = 0
+        self.began = None
+        self.started = self.failed = 0
+
+    def add(self, bot_id, priority):
+        heapq.heappush(self.queue, (priority, next(self.seq), bot_id))
+
+    def run(self):
+        if self.began is None:
+            self.began = time.monotonic()
+        while self.queue and self.active < self.concurrency:
+            _, _, bot_id = heapq.heappop(self.queue)
+            self.active += 1
+            self.supervisor.call_later(random.uniform(0, self.jitter), self._launch, bot_id)
+        if not self.queue and not self.active:
+            self.supervisor.boot_finished(self.started, self.failed, time.monotonic() - self.began)
+
+    def _launch(self, bot_id):
         try:
-            if not os.path.exists(BOTS_FILE):
-                time.sleep(10)
-                continue
-            
-            with open(BOTS_FILE, 'r') as f:
-                bots = json.load(f)
-            
-            updated = False
-            
-            for bot_id, bot in list(bots.items()):
-                if bot.get("status") == "running" and bot.get("pid"):
-                    pid = bot["pid"]
-                    
-                    # Check if process is still running
-                    if not psutil.pid_exists(pid):
-                        print(f"Bot {bot_id} crashed, restarting...")
-                        
-                        # Update status
-                        bot["status"] = "stopped"
-                        bot["pid"] = None
-                        bots[bot_id] = bot
-                        updated = True
-                        
-                        # Auto-restart
-                        restart_bot(bot)
-            
-            if updated:
-                with open(BOTS_FILE, 'w') as f:
-                    json.dump(bots, f, indent=4)
-            
-            time.sleep(5)
-            
+            started = self.supervisor.boot_start(bot_id)
         except Exception as e:
-            print(f"Monitor error: {e}")
-            time.sleep(10)
+            print(f"Failed to start bot {bot_id}: {e}")
+            started = False
+        if started:
+            self.started += 1
+            self.supervisor.call_later(self.settle, self._release)
+            return
+        if started is False:
+            self.failed += 1
+        self._release()
 
-def restart_bot(bot):
-    """Restart a crashed bot"""
+    def _release(self):
+        self.active -= 1
+        self.run()
+
+def boot_priority(bot):
+    """Bots that were running first, then those that crash least, most recently started first"""
     try:
+        last_started = datetime.fromisoformat(bot["last_started"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        last_started = 0
+    return (BOOT_STATUSES.index(bot["status"]), bot.get("restart_count", 0), -last_started)
+
+# -------------------------------
+# SUPERVISOR
+# -------------------------------
+def bot_command(bot, bot_path, python="python3"):
+    if bot["language"] == "python":
+        return [python, bot_path]
+    elif bot["language"] == "php":
+        return ["php", bot_path]
+    elif bot["language"] == "node":
+        return ["node", bot_path]
+    return ["bash", bot_path]
+
+class Child:
+    def __init__(self, bot_id, pid, proc=None):
+        self.bot_id = bot_id
+        self.pid = pid
+        self.proc = proc
+        self.pidfd = None
+        self.started_at = time.monotonic()
+        self.stopping = False
+        self.kill_timer = None
+        self.exit_waiters = []
+        self.limits = None
+        self.cgroup = None
+        self.env = None
+        self.zygote = None  # the zygote that forked it and reports its exit
+        self.identity = None  # procs.identity() recorded for it
+
+def bot_state(bot):
+    return {
+        "id": bot["id"],
+        "status": bot.get("status"),
+        "pid": bot.get("pid"),
+        "last_started": bot.get("last_started"),
+        "restart_count": bot.get("restart_count", 0),
+        "last_error": bot.get("last_error"),
+    }
+
+# -------------------------------
+# CONTROL SOCKET
+# -------------------------------
+class ControlConnection:
+    """One client of the control socket: JSON lines in, JSON lines out"""
+
+    def __init__(self, supervisor, sock):
+        self.supervisor = supervisor
+        self.sock = sock
+        self.rbuf = b""
+        self.wbuf = b""
+        self.closed = False
+        sock.setblocking(False)
+        supervisor.selector.register(sock, selectors.EVENT_READ, self.on_event)
+
+    def on_event(self, mask):
+        if mask & selectors.EVENT_READ:
+            try:
+                data = self.sock.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                data = b""
+            if not data:
+                self.close()
+                return
+
+            self.rbuf += data
+            while b"\n" in self.rbuf and not self.closed:
+                line, self.rbuf = self.rbuf.split(b"\n", 1)
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    self.send({"ok": False, "error": "Malformed request"})
+                    continue
+                self.supervisor.handle_command(request, self.send)
+
+        if mask & selectors.EVENT_WRITE:
+            self.flush()
+
+    def send(self, message):
+        if self.closed:
+            return
+        self.wbuf += (json.dumps(message) + "\n").encode()
+        self.flush()
+
+    def flush(self):
+        try:
+            sent = self.sock.send(self.wbuf)
+            self.wbuf = self.wbuf[sent:]
+        except (BlockingIOError, InterruptedError):
+            pass
+        except OSError:
+            self.close()
+            return
+        events = selectors.EVENT_READ | (selectors.EVENT_WRITE if self.wbuf else 0)
+        self.supervisor.selector.modify(self.sock, events, self.on_event)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.supervisor.selector.unregister(self.sock)
+            self.sock.close()
+
+class Supervisor:
+    """Single-threaded event loop that owns bot processes and reacts to their exits"""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.children = {}
+        self.policies = {}
+        self.restart_timers = {}
+        self.cgroups = limits.Cgroups()
+        self.logs = logwriter.LogManager(search_index=logsearch.LogIndex())
+        self.log_readers = {}
+        self.sampler = metrics.Sampler()
+        self.builds = {}  # env key -> {bot_id: start note} waiting for it
+        self.spawned = None  # inside spawn_batch(): [(bot, then)] not yet written
+        self.build_pool = ThreadPoolExecutor(max_workers=BUILD_WORKERS, thread_name_prefix="env-build")
+        self.zygotes = {}  # env key (None for the system python3) -> zygote.Zygote
+        self.boot_starts = StartScheduler(self)
+        self.boot_report = {}
+        self.metrics_saved = 0
+        self.saved_usage = {}  # bot_id -> (cpu_usage, memory_usage) last written
+        self.snapshot_taken = 0
+        self.timers = []
+        self.seq = itertools.count()
+        self.commands = {
+            "ping": lambda request, reply: reply({"ok": True, "pid": os.getpid(), "boot": self.boot_report}),
+            "start": lambda request, reply: self.start_bot(request.get("bot_id"), reply),
+            "stop": lambda request, reply: self.stop_bot(request.get("bot_id"), reply),
+            "restart": lambda request, reply: self.restart(request.get("bot_id"), reply),
+            "status": self.cmd_status,
+            "bulk_status": self.cmd_bulk_status,
+            "metrics": self.cmd_metrics,
+            "bulk": self.cmd_bulk,
+        }
+
+        # Worker threads hand results back to the loop through this pipe
+        self.loop_calls = deque()
+        self.notify_r, self.notify_w = os.pipe()
+        os.set_blocking(self.notify_r, False)
+        os.set_blocking(self.notify_w, False)
+        self.selector.register(self.notify_r, selectors.EVENT_READ, self._on_notify)
+
+        if not HAS_PIDFD:
+            self._install_sigchld()
+
+    # ---- timers ----
+    def call_later(self, delay, fn, *args):
+        timer = [time.monotonic() + delay, next(self.seq), fn, args, False]
+        heapq.heappush(self.timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        timer[4] = True
+
+    def _run_timers(self):
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            _, _, fn, args, cancelled = heapq.heappop(self.timers)
+            if not cancelled:
+                self._safely(fn, *args)
+
+    def call_soon_threadsafe(self, fn, *args):
+        self.loop_calls.append((fn, args))
+        try:
+            os.write(self.notify_w, b"\0")
+        except BlockingIOError:
+            pass  # already woken
+
+    def _on_notify(self, mask):
+        try:
+            while os.read(self.notify_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+        while self.loop_calls:
+            fn, args = self.loop_calls.popleft()
+            self._safely(fn, *args)
+
+    def _safely(self, fn, *args):
+        try:
+            fn(*args)
+        except Exception as e:
+            print(f"Supervisor error in {getattr(fn, '__name__', fn)}: {e}")
+
+    # ---- main loop ----
+    def run(self):
+        self.listen()
+        print("DEVIL CLOUD - Bot Supervisor Started")
+        self.sync_registry()
+        self.call_later(0, self.sample_metrics)
+        self.call_later(usage.RECONCILE_DELAY, self.reconcile_usage)
+        self.call_later(ENV_COLLECT_INTERVAL, self.collect_envs)
+
+        while True:
+            timeout = None
+            if self.timers:
+                timeout = max(0, self.timers[0][0] - time.monotonic())
+            for key, mask in self.selector.select(timeout):
+                self._safely(key.data, mask)
+            self._run_timers()
+
+    def listen(self):
+        if os.path.exists(SOCKET_PATH):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(SOCKET_PATH)
+                raise SystemExit(f"Another supervisor is already listening on {SOCKET_PATH}")
+            except OSError:
+                os.unlink(SOCKET_PATH)
+            finally:
+                probe.close()
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(SOCKET_PATH)
+        os.chmod(SOCKET_PATH, 0o600)
+        self.server.listen(128)
+        self.server.setblocking(False)
+        self.selector.register(self.server, selectors.EVENT_READ, self._accept)
+
+    def _accept(self, mask):
+        try:
+            sock, _ = self.server.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        ControlConnection(self, sock)
+
+    # ---- exit detection ----
+    def _install_sigchld(self):
+        self.wakeup_r, wakeup_w = os.pipe()
+        os.set_blocking(self.wakeup_r, False)
+        os.set_blocking(wakeup_w, False)
+        signal.set_wakeup_fd(wakeup_w)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        self.selector.register(self.wakeup_r, selectors.EVENT_READ, self._on_sigchld)
+
+    def _on_sigchld(self, mask):
+        try:
+            while os.read(self.wakeup_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+        # Only reap our own pids; waitpid(-1) would steal exit codes from
+        # subprocess calls made elsewhere in this process.
+        for child in list(self.children.values()):
+            if child.proc is not None and child.proc.poll() is not None:
+                self.on_exit(child, child.proc.returncode)
+
+    def watch(self, child):
+        self.children[child.bot_id] = child
+        if child.zygote is not None:
+            return
+        if HAS_PIDFD:
+            try:
+                child.pidfd = os.pidfd_open(child.pid)
+            except ProcessLookupError:
+                self.call_later(0, self.on_exit, child, None)
+                return
+            self.selector.register(child.pidfd, selectors.EVENT_READ, lambda mask: self._on_pidfd(child))
+        elif child.proc is None:
+            self.call_later(ADOPTED_POLL_INTERVAL, self._poll_adopted, child)
+
+    def _on_pidfd(self, child):
+        self.selector.unregister(child.pidfd)
+        os.close(child.pidfd)
+        child.pidfd = None
+        code = child.proc.wait() if child.proc is not None else None
+        self.on_exit(child, code)
+
+    def _poll_adopted(self, child):
+        if self.children.get(child.bot_id) is not child:
+            return
+        if procs.is_same(child.pid, child.identity):
+            self.call_later(ADOPTED_POLL_INTERVAL, self._poll_adopted, child)
+        else:
+            self.on_exit(child, None)
+
+    def forget(self, child):
+        if self.children.get(child.bot_id) is child:
+            del self.children[child.bot_id]
+            self.saved_usage.pop(child.bot_id, None)
+        if child.pidfd is not None:
+            self.selector.unregister(child.pidfd)
+            os.close(child.pidfd)
+            child.pidfd = None
+
+    def on_exit(self, child, code):
+        self.forget(child)
+        if child.kill_timer is not None:
+            self.cancel(child.kill_timer)
+        if child.stopping:
+            # Sweep anything the bot left behind in its process group
+            self.signal_child(child, signal.SIGKILL)
+
+        try:
+            self._handle_exit(child, code)
+            if child.cgroup is not None:
+                self.cgroups.remove(child.bot_id)
+        finally:
+            for waiter in child.exit_waiters:
+                self._safely(waiter)
+
+    def _handle_exit(self, child, code):
+        with storage.transaction():
+            bot = storage.get_bot(child.bot_id)
+
+            if bot and bot.get("status") == "stopping" and bot.get("pid") == child.pid:
+                mark_stopped(bot)
+                storage.put_bot(bot)
+                return
+
+            if not bot:
+                self.discard_logs(child.bot_id)
+                self.sampler.forget(child.bot_id)
+                return
+
+            # Stopped or restarted from the panel: nothing to do
+            if bot.get("status") != "running" or bot.get("pid") != child.pid:
+                return
+
+            policy = self.policies.setdefault(child.bot_id, RestartPolicy())
+            delay = policy.next_delay(child.started_at, time.monotonic())
+            bot["pid"] = bot["pid_identity"] = None
+            bot["cpu_usage"] = bot["memory_usage"] = 0
+
+            if delay is None:
+                print(f"Bot {child.bot_id} is crash-looping, giving up")
+                bot["status"] = "error"
+                bot["last_error"] = f"Crashed {policy.max_crashes} times within {policy.crash_window:.0f}s"
+                storage.put_bot(bot)
+                return
+
+            print(f"Bot {child.bot_id} exited (code {code}), restarting in {delay:.0f}s...")
+            bot["status"] = "restarting"
+            storage.put_bot(bot)
+
+        self.restart_timers[child.bot_id] = self.call_later(delay, self.restart_bot, child.bot_id)
+
+    # ---- spawning ----
+    # spawn() can take a while (hashing the bot's tree, a zygote round trip,
+    # cgroup setup), so it never runs inside a registry transaction: that
+    # would hold up every write from the web workers. The record is read
+    # without a lock, spawned from, and the fields spawn() fills in are
+    # written back afterwards. Only the supervisor starts bots and it does
+    # so on this one thread, so nothing else changes those fields meanwhile.
+
+    def save_spawned(self, bot, then=None):
+        """Write back what spawn() recorded in `bot`, then call then()"""
+        if self.spawned is not None:
+            self.spawned.append((bot, then))
+        else:
+            self._write_spawned([(bot, then)])
+
+    @contextmanager
+    def spawn_batch(self):
+        """Collect save_spawned() writes in the block into one short transaction"""
+        if self.spawned is not None:
+            yield  # joins the enclosing batch
+            return
+        self.spawned = []
+        try:
+            yield
+        finally:
+            spawned, self.spawned = self.spawned, None
+            self._write_spawned(spawned)
+
+    def _write_spawned(self, spawned):
+        if not spawned:
+            return
+        deleted = []
+        with storage.transaction():
+            for bot, _ in spawned:
+                current = storage.get_bot(bot["id"])
+                if current is None:
+                    deleted.append(bot["id"])
+                    continue
+                current.update({field: bot[field] for field in SPAWN_FIELDS if field in bot})
+                storage.put_bot(current)
+        # Deleted from the panel while it was starting
+        for bot_id in deleted:
+            if bot_id in self.children:
+                self.stop_bot(bot_id, lambda result: None)
+        for _, then in spawned:
+            if then is not None:
+                self._safely(then)
+
+    def restart_bot(self, bot_id):
+        """Restart a crashed bot unless someone changed its state meanwhile"""
+        self.restart_timers.pop(bot_id, None)
+        bot = storage.get_bot(bot_id)
+        if not bot or bot.get("status") != "restarting":
+            return
+        if self.spawn(bot, note="Bot auto-restarted"):
+            bot["restart_count"] = bot.get("restart_count", 0) + 1
+        else:
+            bot["status"] = "error"
+        self.save_spawned(bot)
+
+    @instrument.timed("supervisor_task_seconds", task="spawn")
+    def spawn(self, bot, note=None):
+        """Launch a bot and record it as running in the given record"""
         bot_path = os.path.join(BOTS_DIR, bot["filename"])
-        
+
         if not os.path.exists(bot_path):
             print(f"Bot file not found: {bot_path}")
-            return
-        
-        log_path = os.path.join(LOGS_DIR, bot.get("log_file", f"bot_{int(time.time())}.log"))
-        os.makedirs(os.path.dirname(log_path), exist_ok=True)
-        
-        with open(log_path, 'a') as log_file:
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log_file.write(f"\n[{timestamp}] Bot auto-restarted\n")
-            
-            if bot["language"] == "python":
-                cmd = ["python3", bot_path]
-            elif bot["language"] == "php":
-                cmd = ["php", bot_path]
-            elif bot["language"] == "node":
-                cmd = ["node", bot_path]
-            else:
-                cmd = ["bash", bot_path]
-            
-            process = subprocess.Popen(
-                cmd,
-                stdout=log_file,
-                stderr=subprocess.STDOUT,
-                stdin=subprocess.DEVNULL,
-                start_new_session=True
-            )
-        
-        # Update bot data
+            bot["last_error"] = "Bot file not found"
+            return False
+
+        bot.setdefault("log_file", f"{bot['username']}_{bot['id']}.log")
+
+        recorded = envs.recorded_requirements(bot)
+        if recorded is None:
+            return self.wait_for_scan(bot, note)
+        requirements, strict = recorded
+        env = envs.env_key(requirements, strict)
+        if env is not None and not envs.is_ready(env):
+            return self.wait_for_env(bot, env, requirements, strict, note)
+
+        bot_limits = limits.plan_limits(storage.get_user(bot["username"]))
+
+        try:
+            if note:
+                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                self.logs.get(bot).write(f"\n[{timestamp}] {note}\n".encode())
+
+            # Output goes through the bot's FIFO into the managed log writer
+            writer = logwriter.open_bot_pipe(bot["id"])
+            cgroup_dir = self.cgroups.prepare(bot["id"], bot_limits)
+            try:
+                self.attach_log(bot)
+                process, forked_by = None, None
+                pid = self.fork_bot(bot, env, bot_path, writer, cgroup_dir, bot_limits)
+                if pid is not None:
+                    forked_by = self.zygotes[env]
+                else:
+                    process = subprocess.Popen(
+                        bot_command(bot, bot_path, envs.python(env) if env else "python3"),
+                        stdout=writer,
+                        stderr=subprocess.STDOUT,
+                        stdin=subprocess.DEVNULL,
+                        cwd=os.path.dirname(bot_path),
+                        start_new_session=True,
+                        preexec_fn=limits.preexec(cgroup_dir, bot_limits, bot["language"])
+                    )
+                    pid = process.pid
+            finally:
+                os.close(writer)
+        except Exception as e:
+            print(f"Failed to start bot {bot['id']}: {e}")
+            bot["last_error"] = str(e)
+            return False
+
+        instrument.inc("bot_spawns_total", method="zygote" if forked_by is not None else "popen")
         bot["status"] = "running"
-        bot["pid"] = process.pid
+        bot["pid"] = pid
+        bot["pid_identity"] = procs.identity(pid)
         bot["last_started"] = datetime.now().isoformat()
-        bot["restart_count"] = bot.get("restart_count", 0) + 1
-        
-        print(f"Bot {bot.get('name', 'unknown')} restarted (PID: {process.pid})")
-        
-    except Exception as e:
-        print(f"Failed to restart bot: {e}")
+        child = Child(bot["id"], pid, process)
+        child.identity = bot["pid_identity"]
+        child.limits = bot_limits
+        child.cgroup = cgroup_dir
+        child.env = env
+        child.zygote = forked_by
+        if env is not None:
+            envs.touch(env)
+        self.watch(child)
+        if forked_by is not None and forked_by.exits:
+            # It already exited while we waited for the zygote's reply
+            self.call_later(0, self._on_zygote, forked_by)
+
+        print(f"Bot {bot.get('name', 'unknown')} started (PID: {pid})")
+        return True
+
+    # ---- zygotes ----
+    def fork_bot(self, bot, env, bot_path, writer, cgroup_dir, bot_limits):
+        """Start a Python bot as a fork of its environment's zygote; None to use Popen instead"""
+        enabled, preload = zygote.settings()
+        if not enabled or bot["language"] != "python":
+            return None
+
+        forked_by = self.zygotes.get(env)
+        if forked_by is None:
+            try:
+                forked_by = zygote.Zygote(envs.python(env) if env else "python3", preload)
+            except OSError as e:
+                print(f"Failed to start zygote: {e}")
+                return None
+            self.zygotes[env] = forked_by
+            self.selector.register(forked_by, selectors.EVENT_READ, lambda mask: self._on_zygote(forked_by))
+
+        try:
+            return forked_by.spawn(bot_path, writer, cgroup_dir, bot_limits)
+        except (zygote.ZygoteError, ValueError) as e:
+            print(f"Zygote failed to fork bot {bot['id']}, starting it directly: {e}")
+            self.drop_zygote(forked_by)
+            return None
+
+    def _on_zygote(self, forked_by):
+        if forked_by.sock.fileno() == -1:
+            return
+        try:
+            exits = forked_by.read_exits()
+        except (zygote.ZygoteError, ValueError) as e:
+            print(f"Lost zygote: {e}")
+            self.drop_zygote(forked_by)
+            return
+        for pid, code in exits:
+            for child in list(self.children.values()):
+                if child.zygote is forked_by and child.pid == pid:
+                    self.on_exit(child, code)
+
+    def drop_zygote(self, forked_by):
+        """Close a zygote; the bots it forked are watched like adopted ones from now on"""
+        for env, current in list(self.zygotes.items()):
+            if current is forked_by:
+                del self.zygotes[env]
+        if forked_by.sock.fileno() != -1:
+            self.selector.unregister(forked_by)
+            forked_by.close()
+        for child in list(self.children.values()):
+            if child.zygote is forked_by:
+                child.zygote = None
+                self.watch(child)
+
+    def prune_zygotes(self, keep):
+        """Close zygotes no running bot came from, unless their environment is in keep"""
+        enabled, _ = zygote.settings()
+        in_use = {child.zygote for child in self.children.values()}
+        for env, forked_by in list(self.zygotes.items()):
+            if forked_by not in in_use and not (enabled and (env is None or env in keep)):
+                self.drop_zygote(forked_by)
+
+    # ---- dependency environments ----
+    def wait_for_scan(self, bot, note):
+        """Resolve the dependency set of a bot uploaded before it was recorded; spawn it after"""
+        self.scan_requirements(dict(bot), lambda scanned: self.requirements_scanned(scanned, note))
+        bot["status"] = "building"
+        bot["pid"] = bot["pid_identity"] = None
+        return True
+
+    def scan_requirements(self, bot, then):
+        """Run envs.record_requirements() on the build pool, then(record) back on the loop"""
+        def scan():
+            # Runs on the build pool
+            try:
+                envs.record_requirements(bot)
+            except Exception as e:
+                print(f"Failed to resolve dependencies of bot {bot['id']}: {e}")
+                bot["requirements"], bot["requirements_strict"] = [], False
+            self.call_soon_threadsafe(then, bot)
+
+        self.build_pool.submit(scan)
+
+    def requirements_scanned(self, scanned, note):
+        bot = storage.get_bot(scanned["id"])
+        # Stopped or deleted while it waited
+        if bot is None or bot.get("status") != "building":
+            return
+        bot["requirements"], bot["requirements_strict"] = scanned["requirements"], scanned["requirements_strict"]
+        if not self.spawn(bot, note=note):
+            bot["status"] = "error"
+        self.save_spawned(bot)
+
+    def wait_for_env(self, bot, env, requirements, strict, note):
+        """Queue the build of a bot's environment; the bot is spawned once it is ready"""
+        error = envs.recent_failure(env)
+        if error is not None:
+            bot["last_error"] = f"Dependency install failed: {error}"
+            return False
+
+        if env not in self.builds:
+            self.builds[env] = {}
+            self.build_pool.submit(self._build_env, env, requirements, strict)
+        self.builds[env][bot["id"]] = note
+
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.logs.get(bot).write(f"\n[{timestamp}] Installing dependencies: {', '.join(requirements)}\n".encode())
+        bot["status"] = "building"
+        bot["pid"] = bot["pid_identity"] = None
+        return True
+
+    def _build_env(self, env, requirements, strict):
+        # Runs on the build pool
+        try:
+            with instrument.timer("supervisor_task_seconds", task="env_build"):
+                skipped, error = envs.build(env, requirements, strict), None
+        except Exception as e:
+            skipped, error = [], str(e)
+        instrument.inc("env_builds_total", result="failed" if error is not None else "ok")
+        self.call_soon_threadsafe(self.env_built, env, skipped, error)
+
+    def env_built(self, env, skipped, error):
+        with self.spawn_batch():
+            for bot_id, note in self.builds.pop(env, {}).items():
+                bot = storage.get_bot(bot_id)
+                # Stopped or deleted while it waited
+                if bot is None or bot.get("status") != "building":
+                    continue
+
+                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                if error is not None:
+                    self.logs.get(bot).write(f"\n[{timestamp}] Dependency install failed:\n{error}\n".encode())
+                elif skipped:
+                    self.logs.get(bot).write(f"\n[{timestamp}] Could not install: {', '.join(skipped)}\n".encode())
+
+                if not self.spawn(bot, note=note):
+                    bot["status"] = "error"
+                self.save_spawned(bot)
+
+    def collect_envs(self):
+        self.call_later(ENV_COLLECT_INTERVAL, self.collect_envs)
+        keep = set(self.builds) | {child.env for child in self.children.values() if child.env}
+        self.prune_zygotes(keep)
+        self.build_pool.submit(self._safely, envs.collect, keep)
+
+    # ---- log pipes ----
+    def attach_log(self, bot):
+        """Start draining a bot's FIFO into its managed log file"""
+        if bot["id"] in self.log_readers:
+            return
+        reader = logwriter.open_pipe_reader(bot["id"])
+        if reader is None:
+            return
+        self.log_readers[bot["id"]] = reader
+        self.selector.register(reader, selectors.EVENT_READ, lambda mask: self._on_log_output(bot, reader))
+
+    def _on_log_output(self, bot, reader):
+        try:
+            data = os.read(reader, 65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        if data:
+            self.logs.get(bot).write(data)
+            return
+
+        # EOF: the bot and everything it forked have exited
+        self.detach_log(bot["id"])
+        self.logs.close(bot["id"])
+
+    def detach_log(self, bot_id):
+        reader = self.log_readers.pop(bot_id, None)
+        if reader is not None:
+            self.selector.unregister(reader)
+            os.close(reader)
+
+    def discard_logs(self, bot_id):
+        """The bot was deleted: drop its pipe and writer without recreating files"""
+        self.detach_log(bot_id)
+        self.logs.close(bot_id)
+        self.logs.search_index.drop_bot(bot_id)
+        logwriter.remove_pipe(bot_id)
+
+    def signal_child(self, child, sig):
+        try:
+            if os.getpgid(child.pid) == child.pid:
+                os.killpg(child.pid, sig)
+            else:
+                os.kill(child.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            pass
+        if sig == signal.SIGKILL and child.cgroup is not None:
+            self.cgroups.kill(child.bot_id)
+
+    def _cancel_restart(self, bot_id):
+        timer = self.restart_timers.pop(bot_id, None)
+        if timer is not None:
+            self.cancel(timer)
+
+    # ---- commands ----
+    def handle_command(self, request, reply):
+        handler = self.commands.get(request.get("cmd"))
+        if handler is None:
+            reply({"ok": False, "error": f"Unknown command: {request.get('cmd')}"})
+            return
+
+        if request.get("background"):
+            # Kick the work off (signals go out synchronously), answer with a
+            # job id and record the outcome whenever it lands
+            bot = storage.get_bot(request.get("bot_id")) if request.get("bot_id") else None
+            username = request.get("username") or (bot["username"] if bot else None)
+            job_id = storage.create_job(request["cmd"], request.get("bot_id"), username)
+            handler(request, lambda result: storage.finish_job(job_id, result))
+            reply({"ok": True, "job_id": job_id, "status": "pending"})
+            return
+
+        handler(request, reply)
+
+    def start_bot(self, bot_id, reply):
+        self._cancel_restart(bot_id)
+        self.policies.pop(bot_id, None)
+
+        child = self.children.get(bot_id)
+        if child is not None and child.stopping:
+            # Still shutting down from a stop; start once it is gone
+            child.exit_waiters.append(lambda: self.start_bot(bot_id, reply))
+            return
+
+        bot = storage.get_bot(bot_id)
+        if bot is None:
+            reply({"ok": False, "error": "Bot not found"})
+            return
+        if child is not None:
+            reply({"ok": True, **bot_state(bot)})
+            return
+
+        started = self.spawn(bot)
+
+        def replied():
+            if started:
+                reply({"ok": True, **bot_state(bot)})
+            else:
+                reply({"ok": False, "error": bot.get("last_error") or "Failed to start bot"})
+        self.save_spawned(bot, replied)
+
+    def stop_bot(self, bot_id, reply):
+        """SIGTERM the bot's process group, SIGKILL it after a grace period, reply once it is gone"""
+        self._cancel_restart(bot_id)
+        child = self.children.get(bot_id)
+
+        def mark_stopping(bot):
+            if child is None:
+                mark_stopped(bot)
+            else:
+                bot["status"] = "stopping"
+
+        bot = storage.update_bot(bot_id, mark_stopping)
+        if child is None:
+            if bot is None:
+                reply({"ok": False, "error": "Bot not found"})
+            else:
+                reply({"ok": True, **bot_state(bot)})
+            return
+
+        # Even if the record is already gone the process still has to die
+        def finished():
+            current = storage.get_bot(bot_id) or bot
+            reply({"ok": True, **bot_state(current)} if current else {"ok": True, "id": bot_id, "status": "stopped"})
+
+        child.exit_waiters.append(finished)
+        if not child.stopping:
+            child.stopping = True
+            self.signal_child(child, signal.SIGTERM)
+            child.kill_timer = self.call_later(STOP_GRACE_PERIOD, self.signal_child, child, signal.SIGKILL)
+
+    def restart(self, bot_id, reply):
+        def then_start(result):
+            if result["ok"]:
+                self.start_bot(bot_id, reply)
+            else:
+                reply(result)
+
+        self.stop_bot(bot_id, then_start)
+
+    def cmd_bulk(self, request, reply):
+        """Run start/stop/restart over many bots, at most BULK_CONCURRENCY at a time.
+
+        The records of each batch of starts are written back in one short
+        transaction once the batch has spawned. Replies once with a per-bot
+        result report.
+        """
+        handler = {"start": self.start_bot, "stop": self.stop_bot, "restart": self.restart}.get(request.get("action"))
+        if handler is None:
+            reply({"ok": False, "error": f"Unknown bulk action: {request.get('action')}"})
+            return
+
+        bot_ids = list(dict.fromkeys(request.get("bot_ids") or []))
+        pending = deque(bot_ids)
+        in_flight = set()
+        results = {}
+        scheduled = [False]
+
+        def launch():
+            scheduled[0] = False
+            with self.spawn_batch():
+                while pending and len(in_flight) < BULK_CONCURRENCY:
+                    bot_id = pending.popleft()
+                    in_flight.add(bot_id)
+                    try:
+                        handler(bot_id, lambda result, bot_id=bot_id: finished(bot_id, result))
+                    except Exception as e:
+                        finished(bot_id, {"ok": False, "error": str(e)})
+
+        def finished(bot_id, result):
+            in_flight.discard(bot_id)
+            results[bot_id] = result
+            if len(results) == len(bot_ids):
+                reply({"ok": True, "action": request["action"], "results": results})
+            elif pending and not scheduled[0]:
+                scheduled[0] = True
+                self.call_later(0, launch)
+
+        if not bot_ids:
+            reply({"ok": True, "action": request["action"], "results": {}})
+            return
+        launch()
+
+    def cmd_status(self, request, reply):
+        bot = storage.get_bot(request.get("bot_id"))
+        if bot is None:
+            reply({"ok": False, "error": "Bot not found"})
+            return
+        reply({"ok": True, **bot_state(bot), "supervised": bot["id"] in self.children})
+
+    def cmd_bulk_status(self, request, reply):
+        bot_ids = request.get("bot_ids")
+        if bot_ids is None:
+            bots = storage.list_bots()
+        else:
+            bots = [bot for bot in map(storage.get_bot, bot_ids) if bot is not None]
+        reply({"ok": True, "bots": {
+            bot["id"]: {**bot_state(bot), "supervised": bot["id"] in self.children} for bot in bots
+        }})
+
+    def cmd_metrics(self, request, reply):
+        resolution = request.get("resolution", "second")
+        if resolution not in metrics.RESOLUTIONS:
+            reply({"ok": False, "error": f"Unknown resolution: {resolution}"})
+            return
+        bot_metrics = self.sampler.bots.get(request.get("bot_id")) or metrics.BotMetrics()
+        reply({"ok": True, "resolution": resolution, "fields": metrics.FIELDS,
+               "latest": bot_metrics.latest, **bot_metrics.read(resolution, int(request.get("points", 300)))})
+
+    # ---- resource metrics ----
+    @instrument.timed("supervisor_task_seconds", task="sample_metrics")
+    def sample_metrics(self):
+        self.call_later(metrics.SAMPLE_INTERVAL, self.sample_metrics)
+        instrument.flush()
+        samples = self.sampler.sample({child.pid: bot_id for bot_id, child in self.children.items()},
+                                      cgroup_usage=self.cgroups.usage)
+        self.enforce_memory_limits(samples)
+
+        if time.monotonic() - self.snapshot_taken >= metrics.SNAPSHOT_INTERVAL:
+            self.snapshot_taken = time.monotonic()
+            metrics.write_snapshot(metrics.system_snapshot(samples))
+
+        if time.monotonic() - self.metrics_saved < METRICS_SAVE_INTERVAL:
+            return
+        self.metrics_saved = time.monotonic()
+        self.logs.sync_usage()
+
+        changed = {}
+        for bot_id, sample in samples.items():
+            cpu, memory = round(sample["cpu"], 1), round(sample["memory"], 1)
+            saved = self.saved_usage.get(bot_id)
+            if (saved is None or abs(cpu - saved[0]) >= CPU_USAGE_DEADBAND
+                    or abs(memory - saved[1]) >= MEMORY_USAGE_DEADBAND):
+                changed[bot_id] = (cpu, memory)
+        if not changed:
+            return
+
+        with storage.transaction():
+            for bot_id, (cpu, memory) in changed.items():
+                bot = storage.get_bot(bot_id)
+                if bot and bot.get("status") == "running" and \
+                        (bot.get("cpu_usage"), bot.get("memory_usage")) != (cpu, memory):
+                    bot["cpu_usage"] = cpu
+                    bot["memory_usage"] = memory
+                    storage.put_bot(bot)
+        self.saved_usage.update(changed)
+
+    def reconcile_usage(self):
+        """Recount disk usage off the event loop; the walk is O(files)"""
+        self.call_later(usage.RECONCILE_INTERVAL, self.reconcile_usage)
+        threading.Thread(target=self._safely, args=(usage.reconcile, self.logs), daemon=True).start()
+
+    def enforce_memory_limits(self, samples):
+        """Without a memory cgroup, act as the OOM killer from sampled RSS"""
+        for bot_id, sample in samples.items():
+            child = self.children.get(bot_id)
+            if child is None or child.cgroup is not None or child.stopping or not child.limits:
+                continue
+            limit = child.limits["memory_limit"]
+            if not limit or sample["memory"] <= limit:
+                continue
+
+            message = f"Memory limit exceeded ({sample['memory']:.0f} MB > {limit} MB), killed"
+            print(f"Bot {bot_id}: {message}")
+            bot = storage.update_bot(bot_id, lambda bot: bot.update(last_error=message))
+            if bot is not None:
+                self.logs.get(bot).write(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {message}\n".encode())
+            # Exits like a crash, so the restart policy takes over
+            self.signal_child(child, signal.SIGKILL)
+
+    # ---- registry sync ----
+    @instrument.timed("supervisor_task_seconds", task="sync_registry")
+    def sync_registry(self):
+        """Reconcile the registry with the processes alive now, e.g. after a supervisor or host restart.
+
+        A bot whose recorded process is still the same one (pid, start time
+        and command line, from one pass over /proc) is adopted. Every other
+        bot that should be running is queued on the boot scheduler rather
+        than restarted on the spot. Decisions are made from one read of the
+        registry; only the resulting status changes are written, in one
+        short transaction, so the panel isn't locked out for the whole pass.
+        """
+        began = time.monotonic()
+        starts = procs.scan()
+        adopted, stopping, queued = 0, [], []
+        changes = {}  # bot_id -> (status it was decided on, fields to write)
+
+        for bot in storage.list_bots():
+            status = bot.get("status")
+            if bot["id"] in self.children or status not in BOOT_STATUSES + ("stopping",):
+                continue
+
+            alive = bool(bot.get("pid")) and procs.is_same(
+                bot["pid"], bot.get("pid_identity"), starts, os.path.join(BOTS_DIR, bot["filename"]))
+            if alive and status in ("running", "stopping"):
+                self.adopt(bot)
+                adopted += 1
+                if status == "stopping":
+                    # Finish the stop the last supervisor had in flight
+                    stopping.append(bot["id"])
+                continue
+
+            if status == "stopping":
+                fields = {}
+                mark_stopped(fields)
+            else:
+                queued.append(boot_priority(bot) + (bot["id"],))
+                fields = {"status": "restarting", "pid": None, "pid_identity": None}
+            changes[bot["id"]] = (status, fields)
+
+        skipped = set()
+        with storage.transaction():
+            for bot_id, (status, fields) in changes.items():
+                bot = storage.get_bot(bot_id)
+                # Changed from the panel since it was read: the panel's write stands
+                if bot is None or bot.get("status") != status:
+                    skipped.add(bot_id)
+                    continue
+                bot.update(fields)
+                storage.put_bot(bot)
+        queued = [entry for entry in queued if entry[-1] not in skipped]
+
+        for bot_id in stopping:
+            self.stop_bot(bot_id, lambda result: None)
+        for entry in queued:
+            self.boot_starts.add(entry[-1], entry[:-1])
+
+        elapsed = time.monotonic() - began
+        self.boot_report = {"reconcile_ms": round(elapsed * 1000, 1), "adopted": adopted, "queued": len(queued)}
+        print(f"Reconciled the registry in {elapsed * 1000:.0f} ms: {adopted} bots adopted, {len(queued)} to start")
+        self.boot_starts.run()
+
+    def boot_start(self, bot_id):
+        """Start a bot queued by sync_registry; None if it no longer needs starting"""
+        if bot_id in self.children or bot_id in self.restart_timers:
+            return None
+        bot = storage.get_bot(bot_id)
+        # Started or stopped from the panel meanwhile
+        if bot is None or bot.get("status") != "restarting":
+            return None
+        started = self.spawn(bot, note="Bot started after a supervisor restart")
+        if not started:
+            bot["status"] = "error"
+        self.save_spawned(bot)
+        return started
+
+    def boot_finished(self, started, failed, elapsed):
+        self.boot_report.update(started=started, failed=failed, start_seconds=round(elapsed, 2))
+        if started or failed:
+            print(f"Started {started} bots in {elapsed:.1f}s ({failed} failed)")
+
+    def adopt(self, bot):
+        child = Child(bot["id"], bot["pid"])
+        child.identity = bot.get("pid_identity")
+        child.limits = limits.plan_limits(storage.get_user(bot["username"]))
+        child.cgroup = self.cgroups.path(bot["id"])
+        recorded = envs.recorded_requirements(bot)
+        if recorded is not None:
+            child.env = envs.env_key(*recorded)
+        else:
+            self.scan_requirements(dict(bot), lambda scanned: self.adopted_scanned(child, scanned))
+        self.watch(child)
+        self.attach_log(bot)
+
+    def adopted_scanned(self, child, scanned):
+        child.env = envs.env_key(scanned["requirements"], scanned["requirements_strict"])
+        with storage.transaction():
+            bot = storage.get_bot(scanned["id"])
+            if bot is not None:
+                bot["requirements"], bot["requirements_strict"] = scanned["requirements"], scanned["requirements_strict"]
+                storage.put_bot(bot)
+
+def mark_stopped(bot):
+    bot["status"] = "stopped"
+    bot["pid"] = bot["pid_identity"] = None
+    bot["cpu_usage"] = bot["memory_usage"] = 0
 
 if __name__ == "__main__":
-    # Ensure directories exist
-    os.makedirs(DATA_DIR, exist_ok=True)
-    os.makedirs(LOGS_DIR, exist_ok=True)
-    os.makedirs(BOTS_DIR, exist_ok=True)
-    
-    monitor_bots()
+    Supervisor().run()
@@ -46,5 +46,7 @@ chmod -R 755 data bots users logs
 echo "Setup complete!"
 echo "To run the application:"
 echo "1. Install dependencies: pip install -r requirements.txt"
-echo "2. Run: python app.py"
-echo "3. Access at: http://localhost:10000"
+echo "2. Start the bot supervisor: python runner.py &"
+echo "3. Run: python app.py"
+echo "   or, with many open log tails: SERVER_MODE=async gunicorn -c gunicorn.conf.py"
+echo "4. Access at: http://localhost:10000"
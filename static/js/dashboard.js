@@ -1,32 +1,33 @@
 // Dashboard JavaScript
 class DevilCloudDashboard {
     constructor() {
+        this.botEvents = null;
         this.initializeEventListeners();
         this.startAutoRefresh();
+        this.startBotEvents();
     }
     
     initializeEventListeners() {
-        // Bot action confirmations
+        // Bot deletion (templates confirm inline; don't ask twice)
         document.querySelectorAll('a[href*="/delete/"]').forEach(link => {
-            link.addEventListener('click', function(e) {
-                if (!confirm('Are you sure you want to delete this bot?')) {
+            link.addEventListener('click', (e) => {
+                if (!link.hasAttribute('onclick') && !confirm('Are you sure you want to delete this bot?')) {
                     e.preventDefault();
                 }
+                if (e.defaultPrevented) {
+                    return;
+                }
+                e.preventDefault();
+                this.runBotAction(link);
             });
         });
         
-        // Start/Stop buttons with loading states
-        document.querySelectorAll('a[href*="/start/"], a[href*="/stop/"]').forEach(btn => {
-            btn.addEventListener('click', function(e) {
-                const originalHTML = this.innerHTML;
-                this.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Processing...';
-                this.disabled = true;
-                
-                // Re-enable after 5 seconds even if page doesn't reload
-                setTimeout(() => {
-                    this.innerHTML = originalHTML;
-                    this.disabled = false;
-                }, 5000);
+        // Start/Stop/Restart go through the JSON action API; the event
+        // stream then patches the affected card instead of reloading
+        document.querySelectorAll('a[href*="/start/"], a[href*="/stop/"], a[href*="/restart/"]').forEach(btn => {
+            btn.addEventListener('click', (e) => {
+                e.preventDefault();
+                this.runBotAction(btn);
             });
         });
         
@@ -43,6 +44,113 @@ class DevilCloudDashboard {
         }
     }
     
+    async runBotAction(btn) {
+        const originalHTML = btn.innerHTML;
+        btn.innerHTML = '<i class="fas fa-spinner fa-spin"></i> Processing...';
+        
+        try {
+            const response = await fetch(btn.getAttribute('href'), {
+                headers: { 'Accept': 'application/json' }
+            });
+            const reply = await response.json();
+            if (!reply.ok) {
+                throw new Error(reply.error || 'Request failed');
+            }
+            
+            // Stop/restart run as background jobs on the server; poll until done
+            if (reply.job_id) {
+                const job = await this.waitForJob(reply.job_id);
+                if (job.status !== 'done') {
+                    throw new Error((job.result && job.result.error) || job.error || 'Operation failed');
+                }
+            }
+            
+            if (reply.deleted) {
+                this.removeBot(reply.deleted);
+            } else if (!this.botEvents) {
+                // No event stream to patch the card: re-render the page
+                window.location.reload();
+                return;
+            }
+        } catch (error) {
+            this.showToast(error.message, 'error');
+        }
+        btn.innerHTML = originalHTML;
+    }
+    
+    async waitForJob(jobId, interval = 500) {
+        while (true) {
+            const response = await fetch(`/api/jobs/${jobId}`);
+            const job = await response.json();
+            if (!response.ok || job.status === 'done' || job.status === 'failed') {
+                return job;
+            }
+            await new Promise(resolve => setTimeout(resolve, interval));
+        }
+    }
+    
+    // Live bot cards: /api/events pushes only the fields that changed
+    startBotEvents() {
+        if (typeof EventSource === 'undefined' || !document.querySelector('[data-bot-id]')) {
+            return;
+        }
+        
+        this.botEvents = new EventSource('/api/events');
+        this.botEvents.addEventListener('bots', (event) => {
+            const update = JSON.parse(event.data);
+            Object.entries(update.changed).forEach(([botId, fields]) => this.patchBot(botId, fields));
+            update.removed.forEach(botId => this.removeBot(botId));
+        });
+    }
+    
+    patchBot(botId, fields) {
+        document.querySelectorAll(`[data-bot-id="${botId}"]`).forEach(card => {
+            if (fields.status !== undefined) {
+                const badge = card.querySelector('.bot-status');
+                if (badge) {
+                    badge.className = `bot-status status-${fields.status}`;
+                    badge.innerHTML = '<i class="fas fa-circle"></i> ';
+                    badge.appendChild(document.createTextNode(fields.status.toUpperCase()));
+                }
+                card.querySelectorAll('[data-when]').forEach(el => {
+                    el.hidden = !this.statusMatches(el.dataset.when, fields.status);
+                });
+            }
+            
+            ['cpu_usage', 'memory_usage'].forEach(field => {
+                if (fields[field] === undefined || fields[field] === null) {
+                    return;
+                }
+                card.querySelectorAll(`[data-field="${field}"]`).forEach(el => {
+                    el.textContent = Number(fields[field]).toFixed(1);
+                });
+            });
+            
+            const cpuBar = card.querySelector('[data-bar="cpu_usage"]');
+            if (cpuBar && fields.cpu_usage != null) {
+                cpuBar.style.width = fields.cpu_usage + '%';
+            }
+            const memoryBar = card.querySelector('[data-bar="memory_usage"]');
+            if (memoryBar && fields.memory_usage != null) {
+                memoryBar.style.width = (fields.memory_usage / 100) + '%';
+            }
+        });
+    }
+    
+    statusMatches(when, status) {
+        switch (when) {
+            case 'running': return status === 'running';
+            case 'not-running': return status !== 'running';
+            case 'stopped': return status === 'stopped';
+            case 'not-stopped': return status !== 'stopped';
+            default: return true;
+        }
+    }
+    
+    removeBot(botId) {
+        document.querySelectorAll(`[data-bot-id="${botId}"]`).forEach(card => card.remove());
+    }
+    
     toggleTheme() {
         const html = document.documentElement;
         const currentTheme = html.getAttribute('data-theme');
@@ -207,21 +315,36 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 
 // Real-time logs updates
-function startLogsStream(botId) {
+function startLogsStream(botId, offset) {
     if (typeof EventSource !== 'undefined') {
-        const eventSource = new EventSource(`/api/logs/stream/${botId}`);
+        const query = offset !== undefined ? `?offset=${offset}` : '';
+        const eventSource = new EventSource(`/api/logs/stream/${botId}${query}`);
         
-        eventSource.onmessage = function(event) {
+        const append = function(text) {
             const logsContainer = document.getElementById('logs-container');
             if (logsContainer) {
-                logsContainer.innerHTML += event.data + '\n';
+                const target = logsContainer.querySelector('pre') || logsContainer;
+                target.appendChild(document.createTextNode(text + '\n'));
                 logsContainer.scrollTop = logsContainer.scrollHeight;
             }
         };
         
+        eventSource.onmessage = function(event) {
+            append(event.data);
+        };
+        
+        eventSource.addEventListener('skipped', function(event) {
+            append(`... ${event.data} bytes skipped ...`);
+        });
+        
+        eventSource.addEventListener('reset', function(event) {
+            append(`--- ${event.data} ---`);
+        });
+        
+        // The server ends each stream after a while; EventSource reconnects
+        // on its own and resumes from the last event id.
         eventSource.onerror = function() {
-            console.error('EventSource failed.');
-            eventSource.close();
+            console.warn('Log stream interrupted, reconnecting...');
         };
         
         return eventSource;
@@ -0,0 +1,436 @@
+import os, json, sqlite3, threading, time, uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from paths import DATA_DIR
+import instrument
+
+# -------------------------------
+# REGISTRY STORE (SQLite, WAL mode)
+# -------------------------------
+# Every gunicorn worker and runner.py open their own connection to the same
+# database file. Writers serialize on BEGIN IMMEDIATE, so a read-modify-write
+# of a single bot or user row can never lose a concurrent update.
+DB_FILE = os.path.join(DATA_DIR, "devilcloud.db")
+LEGACY_FILES = {
+    "users": os.path.join(DATA_DIR, "users.json"),
+    "bots": os.path.join(DATA_DIR, "bots.json"),
+    "stats": os.path.join(DATA_DIR, "stats.json"),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bots (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    status TEXT NOT NULL,
+    language TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_bots_username ON bots(username);
+CREATE INDEX IF NOT EXISTS idx_bots_status ON bots(status);
+CREATE TABLE IF NOT EXISTS stats (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    bot_id TEXT,
+    username TEXT,
+    status TEXT NOT NULL,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_created ON jobs(created_at);
+CREATE TABLE IF NOT EXISTS disk_usage (
+    username TEXT NOT NULL,
+    category TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (username, category)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tree_files (
+    tree TEXT NOT NULL,
+    path TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (tree, path)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS file_imports (
+    digest TEXT PRIMARY KEY,
+    modules TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rate_limits (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_rate_limits_updated ON rate_limits(updated);
+"""
+JOB_RETENTION = 24 * 3600
+# Longer than any bucket takes to refill: an older row is as good as none
+RATE_LIMIT_RETENTION = 3600
+
+# Per-table change counters, bumped by triggers in the writing transaction so
+# readers in any process can tell whether their cached copy is stale.
+VERSIONED_TABLES = ["users", "bots", "stats"]
+VERSION_TRIGGERS = "".join(
+    f"INSERT OR IGNORE INTO meta (key, value) VALUES ('{table}_version', 0);\n" +
+    "".join(
+        f"CREATE TRIGGER IF NOT EXISTS {table}_version_{op.lower()} AFTER {op} ON {table} "
+        f"BEGIN UPDATE meta SET value = value + 1 WHERE key = '{table}_version'; END;\n"
+        for op in ("INSERT", "UPDATE", "DELETE")
+    )
+    for table in VERSIONED_TABLES
+)
+
+_local = threading.local()
+
+def get_connection():
+    """Return this thread's connection, reopening it after a fork"""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA + VERSION_TRIGGERS)
+        _local.conn = conn
+        _local.pid = os.getpid()
+        _local.depth = 0
+        migrate_json()
+    return conn
+
+def table_version(table):
+    row = get_connection().execute("SELECT value FROM meta WHERE key = ?", (f"{table}_version",)).fetchone()
+    return int(row["value"]) if row else None
+
+@contextmanager
+def transaction():
+    """Run the block as one atomic write; nested blocks join the outer one"""
+    conn = get_connection()
+    if _local.depth:
+        _local.depth += 1
+        try:
+            yield conn
+        finally:
+            _local.depth -= 1
+        return
+
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    locked = time.perf_counter()
+    instrument.observe("registry_lock_wait_seconds", locked - started)
+    _local.depth = 1
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    else:
+        conn.execute("COMMIT")
+    finally:
+        _local.depth = 0
+        instrument.observe("registry_transaction_seconds", time.perf_counter() - locked)
+
+# -------------------------------
+# BOTS
+# -------------------------------
+def get_bot(bot_id):
+    row = get_connection().execute("SELECT data FROM bots WHERE id = ?", (bot_id,)).fetchone()
+    return json.loads(row["data"]) if row else None
+
+def _bot_filter(username=None, status=None, language=None):
+    clauses, args = [], []
+    for column, value in (("username", username), ("status", status), ("language", language)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            args.append(value)
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), args
+
+def list_bots(username=None, status=None, language=None):
+    where, args = _bot_filter(username, status, language)
+    rows = get_connection().execute("SELECT data FROM bots" + where + " ORDER BY rowid", args).fetchall()
+    return [json.loads(row["data"]) for row in rows]
+
+def count_bots(username=None, status=None, language=None):
+    where, args = _bot_filter(username, status, language)
+    return get_connection().execute("SELECT COUNT(*) FROM bots" + where, args).fetchone()[0]
+
+def put_bot(bot):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO bots (id, username, status, language, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET username = excluded.username, status = excluded.status, "
+            "language = excluded.language, data = excluded.data",
+            (bot["id"], bot["username"], bot.get("status", "stopped"), bot.get("language"), json.dumps(bot))
+        )
+
+def update_bot(bot_id, fn):
+    """Atomically apply fn(bot) to one bot record; returns the new record or None"""
+    with transaction():
+        bot = get_bot(bot_id)
+        if bot is None:
+            return None
+        fn(bot)
+        put_bot(bot)
+        return bot
+
+def delete_bot(bot_id):
+    with transaction() as conn:
+        conn.execute("DELETE FROM bots WHERE id = ?", (bot_id,))
+
+# -------------------------------
+# USERS
+# -------------------------------
+def get_user(username):
+    row = get_connection().execute("SELECT data FROM users WHERE username = ?", (username,)).fetchone()
+    return json.loads(row["data"]) if row else None
+
+def list_users():
+    rows = get_connection().execute("SELECT username, data FROM users ORDER BY rowid").fetchall()
+    return {row["username"]: json.loads(row["data"]) for row in rows}
+
+def count_users():
+    return get_connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+def put_user(username, user):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO users (username, data) VALUES (?, ?) "
+            "ON CONFLICT(username) DO UPDATE SET data = excluded.data",
+            (username, json.dumps(user))
+        )
+
+def update_user(username, fn):
+    """Atomically apply fn(user) to one user record; returns the new record or None"""
+    with transaction():
+        user = get_user(username)
+        if user is None:
+            return None
+        fn(user)
+        put_user(username, user)
+        return user
+
+def delete_user(username):
+    with transaction() as conn:
+        conn.execute("DELETE FROM users WHERE username = ?", (username,))
+
+# -------------------------------
+# STATS
+# -------------------------------
+def get_stats():
+    """Stored counters merged with live counts from the bot/user indexes"""
+    rows = get_connection().execute("SELECT key, value FROM stats").fetchall()
+    stats = {row["key"]: json.loads(row["value"]) for row in rows}
+    stats["total_bots"] = count_bots()
+    stats["running_bots"] = count_bots(status="running")
+    stats["total_users"] = count_users()
+    stats.setdefault("total_uploads", 0)
+    stats.setdefault("uptime", datetime.now().isoformat())
+    return stats
+
+def set_stat(key, value):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO stats (key, value) VALUES (?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value))
+        )
+
+# -------------------------------
+# DISK USAGE LEDGER
+# -------------------------------
+# Bytes each user occupies on disk per category ("files", "logs"), adjusted
+# by whoever writes or removes them; see usage.py.
+def get_usage(username):
+    rows = get_connection().execute("SELECT category, bytes FROM disk_usage WHERE username = ?", (username,)).fetchall()
+    return {row["category"]: row["bytes"] for row in rows}
+
+def total_usage(username):
+    return get_connection().execute(
+        "SELECT COALESCE(SUM(bytes), 0) FROM disk_usage WHERE username = ?", (username,)
+    ).fetchone()[0]
+
+def add_usage(username, category, delta):
+    with transaction() as conn:
+        updated = conn.execute(
+            "UPDATE disk_usage SET bytes = MAX(bytes + ?, 0) WHERE username = ? AND category = ?",
+            (delta, username, category)
+        ).rowcount
+        if not updated:
+            conn.execute("INSERT INTO disk_usage (username, category, bytes) VALUES (?, ?, ?)",
+                         (username, category, max(delta, 0)))
+
+def set_usage(username, category, nbytes):
+    with transaction() as conn:
+        conn.execute(
+            "INSERT INTO disk_usage (username, category, bytes) VALUES (?, ?, ?) "
+            "ON CONFLICT(username, category) DO UPDATE SET bytes = excluded.bytes",
+            (username, category, nbytes)
+        )
+
+# -------------------------------
+# BLOB REFERENCES
+# -------------------------------
+# Which content-addressed blob each file of each working tree under
+# BOTS_DIR is a copy of; see blobs.py.
+def add_tree_file(tree, path, digest, size):
+    with transaction() as conn:
+        conn.execute("INSERT OR IGNORE INTO blobs (digest, size, refs) VALUES (?, ?, 0)", (digest, size))
+        conn.execute("INSERT INTO tree_files (tree, path, digest) VALUES (?, ?, ?)", (tree, path, digest))
+        conn.execute("UPDATE blobs SET refs = refs + 1 WHERE digest = ?", (digest,))
+
+def release_tree_files(tree):
+    """Drop a tree's references; returns the digests nothing references any more"""
+    with transaction() as conn:
+        counts = conn.execute(
+            "SELECT digest, COUNT(*) AS n FROM tree_files WHERE tree = ? GROUP BY digest", (tree,)
+        ).fetchall()
+        conn.execute("DELETE FROM tree_files WHERE tree = ?", (tree,))
+        orphans = []
+        for row in counts:
+            conn.execute("UPDATE blobs SET refs = refs - ? WHERE digest = ?", (row["n"], row["digest"]))
+            if conn.execute("SELECT refs FROM blobs WHERE digest = ?", (row["digest"],)).fetchone()["refs"] <= 0:
+                conn.execute("DELETE FROM blobs WHERE digest = ?", (row["digest"],))
+                orphans.append(row["digest"])
+        return orphans
+
+def rename_tree(old, new):
+    with transaction() as conn:
+        conn.execute("UPDATE tree_files SET tree = ? WHERE tree = ?", (new, old))
+
+# -------------------------------
+# IMPORT CACHE
+# -------------------------------
+# Modules a Python source file imports, by sha256 of its content; see depscan.py.
+def get_file_imports(digest):
+    row = get_connection().execute("SELECT modules FROM file_imports WHERE digest = ?", (digest,)).fetchone()
+    return json.loads(row["modules"]) if row else None
+
+def put_file_imports(digest, modules):
+    with transaction() as conn:
+        conn.execute("INSERT OR REPLACE INTO file_imports (digest, modules) VALUES (?, ?)", (digest, json.dumps(modules)))
+
+# -------------------------------
+# RATE LIMITS
+# -------------------------------
+# Token buckets shared by every worker; see throttle.py.
+def take_token(key, capacity, per_second, cost=1):
+    """Refill key's bucket and, if it holds a whole token, take `cost` from it.
+
+    Returns 0 when allowed, else the seconds until a token is available.
+    A missing bucket is full.
+    """
+    now = time.time()
+    with transaction() as conn:
+        conn.execute("DELETE FROM rate_limits WHERE updated < ?", (now - RATE_LIMIT_RETENTION,))
+        row = conn.execute("SELECT tokens, updated FROM rate_limits WHERE key = ?", (key,)).fetchone()
+        tokens = capacity if row is None else min(capacity, row["tokens"] + (now - row["updated"]) * per_second)
+        if tokens < 1:
+            return (1 - tokens) / per_second
+        if cost:
+            conn.execute("INSERT OR REPLACE INTO rate_limits (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens - cost, now))
+        return 0
+
+def reset_tokens(key):
+    with transaction() as conn:
+        conn.execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+
+# -------------------------------
+# JOBS
+# -------------------------------
+# Background operations run by the supervisor. Any web worker can report
+# their progress because the state lives here, not in the supervisor.
+def create_job(kind, bot_id=None, username=None):
+    job_id = uuid.uuid4().hex[:12]
+    now = time.time()
+    with transaction() as conn:
+        conn.execute("DELETE FROM jobs WHERE created_at < ?", (now - JOB_RETENTION,))
+        conn.execute(
+            "INSERT INTO jobs (id, kind, bot_id, username, status, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, 'pending', ?, ?)",
+            (job_id, kind, bot_id, username, now, now)
+        )
+    return job_id
+
+def update_job(job_id, progress):
+    """Mark a job running, with progress for pollers in its result"""
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = 'running', result = ?, updated_at = ? WHERE id = ?",
+            (json.dumps(progress), time.time(), job_id)
+        )
+
+def finish_job(job_id, result):
+    with transaction() as conn:
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, updated_at = ? WHERE id = ?",
+            ("done" if result.get("ok") else "failed", json.dumps(result), time.time(), job_id)
+        )
+
+def expire_job(job_id, before, result):
+    """Fail a job still pending or running with no update since before; True if it was"""
+    with transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE jobs SET status = 'failed', result = ?, updated_at = ? "
+            "WHERE id = ? AND status IN ('pending', 'running') AND updated_at < ?",
+            (json.dumps(result), time.time(), job_id, before)
+        )
+        return cursor.rowcount > 0
+
+def get_job(job_id):
+    row = get_connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = dict(row)
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+# -------------------------------
+# ONE-SHOT MIGRATION FROM data/*.json
+# -------------------------------
+def migrate_json():
+    """Import the legacy JSON registry once, then rename the files to *.migrated"""
+    with transaction() as conn:
+        if conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            return False
+
+        legacy = {}
+        for name, path in LEGACY_FILES.items():
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r') as f:
+                        legacy[name] = json.load(f)
+                except Exception as e:
+                    print(f"Skipping unreadable {path}: {e}")
+
+        for username, user in legacy.get("users", {}).items():
+            put_user(username, user)
+        for bot_id, bot in legacy.get("bots", {}).items():
+            put_bot({**bot, "id": bot_id})
+        for key, value in legacy.get("stats", {}).items():
+            if key not in ("total_bots", "running_bots", "total_users") and value != "":
+                set_stat(key, value)
+        if not conn.execute("SELECT 1 FROM stats WHERE key = 'uptime'").fetchone():
+            set_stat("uptime", datetime.now().isoformat())
+
+        conn.execute("INSERT INTO meta (key, value) VALUES ('json_migrated', ?)", (datetime.now().isoformat(),))
+
+    for path in LEGACY_FILES.values():
+        if os.path.exists(path):
+            os.replace(path, path + ".migrated")
+    return True
@@ -0,0 +1,5 @@
+import os, sys, tempfile
+
+# State goes to a scratch home, set before any module computes its paths
+os.environ["DEVIL_CLOUD_HOME"] = tempfile.mkdtemp(prefix="devil-cloud-tests-")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
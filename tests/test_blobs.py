@@ -0,0 +1,60 @@
+import os, stat, uuid
+
+import pytest
+
+import blobs
+import storage
+from paths import BOTS_DIR
+
+def make_tree(text):
+    tree = f"tree-{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.join(BOTS_DIR, tree))
+    with open(os.path.join(BOTS_DIR, tree, "main.py"), 'w') as f:
+        f.write(text)
+    blobs.adopt(tree)
+    return os.path.join(BOTS_DIR, tree, "main.py")
+
+@pytest.fixture(scope="module")
+def reflinks():
+    """Whether BOTS_DIR's filesystem can reflink"""
+    src = os.path.join(BOTS_DIR, f"probe-{uuid.uuid4().hex[:8]}")
+    with open(src, 'w') as f:
+        f.write("probe")
+    try:
+        return blobs.reflink(src, f"{src}.clone")
+    finally:
+        for path in (src, f"{src}.clone"):
+            if os.path.exists(path):
+                os.remove(path)
+
+def test_adopted_files_stay_private_and_writable(reflinks):
+    text = f"print({uuid.uuid4().hex!r})\n"
+    first, second = make_tree(text), make_tree(text)
+    blob = blobs.blob_path(blobs.file_digest(first))
+
+    # Only a reflink-capable filesystem gets a blob; otherwise it would be a second full copy
+    assert os.path.exists(blob) == reflinks
+    if reflinks:
+        assert stat.S_IMODE(os.stat(blob).st_mode) == 0o444
+    for path in (first, second):
+        assert not os.path.exists(blob) or os.stat(path).st_ino != os.stat(blob).st_ino
+        assert os.stat(path).st_mode & stat.S_IWUSR
+
+    with open(first, 'a') as f:
+        f.write("print('changed')\n")
+    with open(second) as f:
+        assert f.read() == text
+
+def test_release_drops_references_with_last_tree(reflinks):
+    text = f"print({uuid.uuid4().hex!r})\n"
+    first, second = make_tree(text), make_tree(text)
+    digest = blobs.file_digest(first)
+    refs = lambda: storage.get_connection().execute("SELECT refs FROM blobs WHERE digest = ?", (digest,)).fetchone()
+
+    assert refs()["refs"] == 2
+    blobs.release(os.path.relpath(os.path.dirname(first), BOTS_DIR))
+    assert refs()["refs"] == 1
+    assert os.path.exists(blobs.blob_path(digest)) == reflinks
+    blobs.release(os.path.relpath(os.path.dirname(second), BOTS_DIR))
+    assert refs() is None
+    assert not os.path.exists(blobs.blob_path(digest))
@@ -0,0 +1,32 @@
+import pytest
+
+import app as panel
+
+@pytest.fixture
+def client():
+    return panel.app.test_client()
+
+def log_in(client, username, is_admin=False):
+    with client.session_transaction() as session:
+        session.update(logged_in=True, username=username, is_admin=is_admin)
+
+@pytest.mark.parametrize("bot_ids", ["abc", [{"id": "abc"}], [["abc"]], {"abc": 1}, None])
+def test_bulk_rejects_bot_ids_that_are_not_a_list_of_strings(client, bot_ids):
+    log_in(client, "alice")
+    response = client.post('/api/bots/bulk', json={"action": "stop", "bot_ids": bot_ids})
+    assert response.status_code == 400
+
+def test_bulk_reports_bots_the_user_does_not_own(client):
+    log_in(client, "alice")
+    response = client.post('/api/bots/bulk', json={"action": "delete", "bot_ids": ["missing", "missing"]})
+    assert response.status_code == 200
+    assert response.json["results"] == {"missing": {"ok": False, "error": "Bot not found"}}
+
+def test_admin_panel_is_served_to_admins_only(client):
+    log_in(client, "alice")
+    assert client.get('/admin').status_code == 302
+
+    log_in(client, "root", is_admin=True)
+    response = client.get('/admin')
+    assert response.status_code == 200
+    assert b"bulkBotAction" in response.data
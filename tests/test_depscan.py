@@ -0,0 +1,52 @@
+import textwrap
+
+import depscan
+
+def imports(source):
+    return depscan.parse_imports(textwrap.dedent(source).encode())
+
+def test_plain_and_from_imports():
+    assert imports("""
+        import os, requests.adapters
+        from google import genai
+        from . import local
+        from .sibling import thing
+    """) == {"os", "requests.adapters", "google", "google.genai"}
+
+def test_imports_guarded_by_import_errors_are_optional():
+    assert imports("""
+        try:
+            import ujson as json
+        except ImportError:
+            import json
+        try:
+            import uvloop
+        except (ModuleNotFoundError, OSError):
+            uvloop = None
+    """) == {"json"}
+
+def test_broad_handlers_do_not_make_imports_optional():
+    assert imports("""
+        try:
+            import requests
+        except Exception:
+            requests = None
+        try:
+            import aiohttp
+        except:
+            pass
+    """) == {"requests", "aiohttp"}
+
+def test_nested_try_keeps_outer_guard():
+    assert imports("""
+        try:
+            try:
+                import yaml
+            except ValueError:
+                pass
+        except ImportError:
+            pass
+    """) == set()
+
+def test_unparsable_source_falls_back_to_matching_lines():
+    assert depscan.parse_imports(b"print 'py2'\nimport telebot\nfrom flask import Flask\n") == {"telebot", "flask"}
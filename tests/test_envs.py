@@ -0,0 +1,29 @@
+import os, uuid
+
+import envs
+from paths import BOTS_DIR
+
+def make_tree(files):
+    dirname = f"tree-{uuid.uuid4().hex[:8]}"
+    for name, text in files.items():
+        path = os.path.join(BOTS_DIR, dirname, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(text)
+    return dirname
+
+def test_unresolved_python_bots_have_no_recorded_set():
+    assert envs.recorded_requirements({"language": "python", "filename": "x.py"}) is None
+    assert envs.recorded_requirements({"language": "node", "filename": "x.js"}) == ([], False)
+
+def test_shipped_requirements_are_recorded_as_strict():
+    dirname = make_tree({"main.py": "import requests\n", "requirements.txt": "requests==2.31.0\n# pinned\n"})
+    bot = {"language": "python", "filename": f"{dirname}/main.py"}
+    envs.record_requirements(bot)
+    assert envs.recorded_requirements(bot) == (["requests==2.31.0"], True)
+
+def test_guessed_requirements_are_recorded_best_effort():
+    dirname = make_tree({"main.py": "import os\nimport yaml\n"})
+    bot = {"language": "python", "filename": f"{dirname}/main.py"}
+    envs.record_requirements(bot)
+    assert envs.recorded_requirements(bot) == (["PyYAML"], False)
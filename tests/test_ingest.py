@@ -0,0 +1,74 @@
+import io, os, stat, time, uuid, zipfile
+
+import pytest
+
+import ingest
+import storage
+from paths import BOTS_DIR
+
+def member(name, mode=None):
+    info = zipfile.ZipInfo(name)
+    if mode is not None:
+        info.external_attr = mode << 16
+    return info
+
+@pytest.mark.parametrize("name, path", [
+    ("bot/main.py", "bot/main.py"),
+    ("./bot//main.py", "bot/main.py"),
+    ("bot\\lib\\util.py", "bot/lib/util.py"),
+    ("bot/", "bot"),
+    ("./", ""),
+])
+def test_member_path_normalizes_safe_names(name, path):
+    assert ingest.member_path(member(name)) == path
+
+@pytest.mark.parametrize("name", ["/etc/passwd", "../evil.py", "bot/../../evil.py", "..\\evil.py", "C:/evil.py", "\\\\host\\share"])
+def test_member_path_rejects_escaping_names(name):
+    with pytest.raises(ingest.IngestError):
+        ingest.member_path(member(name))
+
+def test_member_path_rejects_symlinks():
+    with pytest.raises(ingest.IngestError):
+        ingest.member_path(member("bot/link", stat.S_IFLNK | 0o777))
+
+def test_extract_stops_at_the_byte_budget(tmp_path):
+    archive = tmp_path / "upload.zip"
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as f:
+        f.writestr("main.py", "print('hi')\n")
+        f.writestr("data.bin", b"\0" * 4096)
+    with pytest.raises(ingest.IngestError):
+        ingest.extract(str(archive), str(tmp_path / "out"), max_bytes=1024)
+
+def staged_job(files):
+    job_id = storage.create_job("ingest", username="alice")
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as f:
+        for name, text in files.items():
+            f.writestr(name, text)
+    with open(ingest.archive_path(job_id), 'wb') as f:
+        f.write(buffer.getvalue())
+    ingest.run(job_id, 1024 * 1024, {"name": "bot", "bot_name": "bot"})
+    return job_id
+
+def test_claim_reports_a_taken_folder():
+    job_id = staged_job({"main.py": "print('hi')\n"})
+    assert storage.get_job(job_id)["result"]["candidates"] == ["main.py"]
+
+    dirname = f"alice_{uuid.uuid4().hex[:8]}"
+    os.makedirs(os.path.join(BOTS_DIR, dirname, "other"))
+    with pytest.raises(ingest.IngestError):
+        ingest.claim(job_id, dirname)
+
+    # The staged upload is untouched and can still be claimed elsewhere
+    assert ingest.claim(job_id, f"{dirname}-2")
+    assert os.path.isfile(os.path.join(BOTS_DIR, f"{dirname}-2", "main.py"))
+    assert not ingest.claim(job_id, f"{dirname}-3")
+
+def test_stale_jobs_are_reported_failed(monkeypatch):
+    job_id = storage.create_job("ingest", username="alice")
+    assert ingest.get_job(job_id)["status"] == "pending"
+
+    monkeypatch.setattr(time, "time", lambda now=time.time(): now + ingest.STALE_AFTER + 1)
+    job = ingest.get_job(job_id)
+    assert job["status"] == "failed"
+    assert job["result"]["ok"] is False
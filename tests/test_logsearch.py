@@ -0,0 +1,40 @@
+import os, uuid
+
+import logsearch
+
+def test_block_trigrams_do_not_span_lines():
+    assert logsearch.block_trigrams(b"abC\nDef") == {b"abc", b"def"}
+
+def test_query_trigrams_of_a_literal():
+    pattern = logsearch.compile_query("Timeout")
+    assert set(logsearch.query_trigrams(pattern)) == {b"tim", b"ime", b"meo", b"eou", b"out"}
+
+def test_query_trigrams_skip_newlines():
+    pattern = logsearch.compile_query("ab\ncd", regex=True)
+    assert logsearch.query_trigrams(pattern) == []
+
+def test_query_trigrams_of_a_character_class_are_empty():
+    assert logsearch.query_trigrams(logsearch.compile_query("[0-9]+", regex=True)) == []
+
+def test_query_trigrams_ignore_case_skips_non_ascii():
+    pattern = logsearch.compile_query("ÉTÉ", ignore_case=True)
+    assert all(trigram.isascii() for trigram in logsearch.query_trigrams(pattern))
+
+def test_query_trigrams_required_repeat():
+    pattern = logsearch.compile_query("(error)+x", regex=True)
+    assert b"err" in logsearch.query_trigrams(pattern)
+
+def test_multiline_literal_is_found_in_an_indexed_block():
+    bot = {"id": uuid.uuid4().hex[:8], "name": "b", "log_file": f"{uuid.uuid4().hex[:8]}.log"}
+    data = b"first ab\ncd last\n"
+    with open(os.path.join(logsearch.LOGS_DIR, bot["log_file"]), 'wb') as f:
+        f.write(data)
+    index = logsearch.LogIndex()
+    index._add_block(bot["id"], "u", bot["log_file"], 0, data, 1.0, 2.0)
+    found = logsearch.search([bot], "ab\ncd", regex=True)
+    assert [result["offset"] for result in found["results"]] == [0]
+
+def test_search_stops_at_the_deadline(monkeypatch):
+    monkeypatch.setattr(logsearch, "MAX_SEARCH_SECONDS", -1)
+    bots = [{"id": uuid.uuid4().hex[:8], "log_file": "none.log"} for _ in range(3)]
+    assert logsearch.search(bots, "x") == {"results": [], "truncated": True}
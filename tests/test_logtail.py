@@ -0,0 +1,53 @@
+import os, tempfile
+
+import logtail
+
+def write(data):
+    fd, path = tempfile.mkstemp()
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    return path
+
+def test_tail_offset_counts_lines_from_the_end():
+    path = write(b"one\ntwo\nthree\n")
+    assert logtail.tail_offset(path, 1) == 8
+    assert logtail.tail_offset(path, 2) == 4
+    assert logtail.tail_offset(path, 10) == 0
+    assert logtail.tail_offset(path, 0) == 14
+
+def test_tail_offset_without_trailing_newline():
+    path = write(b"one\ntwo")
+    assert logtail.tail_offset(path, 1) == 4
+
+def test_tail_offset_across_blocks(monkeypatch):
+    monkeypatch.setattr(logtail, "BLOCK_SIZE", 4)
+    path = write(b"aaaaaa\nbbbbbbbbb\ncc\n")
+    assert logtail.tail_offset(path, 2) == 7
+
+def test_read_tail():
+    path = write(b"one\ntwo\nthree\n")
+    assert logtail.read_tail(path, 2) == "two\nthree\n"
+
+def test_read_page_backwards_and_forwards():
+    path = write(b"l1\nl2\nl3\nl4\n")
+    last = logtail.read_page(path, limit=2)
+    assert last["lines"] == ["l3\n", "l4\n"]
+    assert last["has_older"] and not last["has_newer"]
+
+    older = logtail.read_page(path, before=last["start"], limit=2)
+    assert older["lines"] == ["l1\n", "l2\n"]
+    assert not older["has_older"]
+
+    newer = logtail.read_page(path, after=older["end"], limit=1)
+    assert newer["lines"] == ["l3\n"]
+    assert newer["has_newer"]
+
+def test_read_page_stops_after_the_last_complete_line():
+    path = write(b"l1\npartial")
+    assert logtail.read_page(path, after=0, limit=5)["lines"] == ["l1\n"]
+
+def test_read_page_of_missing_file():
+    assert logtail.read_page("/nonexistent/file.log")["lines"] == []
+
+def test_sse_event_splits_lines():
+    assert logtail.sse_event("a\nb", event="x", event_id=3) == "event: x\nid: 3\ndata: a\ndata: b\n\n"
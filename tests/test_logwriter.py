@@ -0,0 +1,48 @@
+import uuid
+
+import logwriter
+import storage
+
+def make_bot():
+    username = f"user-{uuid.uuid4().hex[:8]}"
+    storage.put_user(username, {"storage_limit": 0, "bots": []})
+    bot = {"id": uuid.uuid4().hex[:8], "username": username, "status": "running",
+           "language": "python", "log_file": f"{username}.log"}
+    storage.put_bot(bot)
+    return bot
+
+def test_quota_drops_output_and_notice_is_reserved():
+    manager = logwriter.LogManager()
+    bot = make_bot()
+    log = manager.get(bot)
+    manager.reserve(bot["username"], 0)
+    manager.allowance[bot["username"]] = 100
+
+    log.write(b"x" * 60)
+    log.write(b"y" * 60)  # over quota: dropped, with a notice only if it fits
+    assert log.dropping
+    assert manager.usage[bot["username"]] <= 100
+    assert log.size == manager.usage[bot["username"]]
+
+def test_prune_is_not_retried_until_something_changes(monkeypatch):
+    manager = logwriter.LogManager()
+    bot = make_bot()
+    log = manager.get(bot)
+    manager.reserve(bot["username"], 0)
+    manager.allowance[bot["username"]] = 10
+
+    calls = []
+    original = manager._prune
+    monkeypatch.setattr(manager, "_prune", lambda *args: calls.append(args) or original(*args))
+    for _ in range(5):
+        log.write(b"z" * 50)
+    assert len(calls) == 1
+
+    manager.release(bot["username"], 0)
+    log.write(b"z" * 50)
+    assert len(calls) == 2
+
+    manager.sync_usage()
+    manager.allowance[bot["username"]] = 10
+    log.write(b"z" * 50)
+    assert len(calls) == 3
@@ -0,0 +1,72 @@
+import os, subprocess, time
+
+import metrics
+
+def sample(value):
+    return dict.fromkeys(metrics.FIELDS, value)
+
+def test_series_reads_back_samples_and_gaps():
+    series = metrics.Series(60, 10)
+    series.add(600, sample(1.0))
+    series.add(720, sample(3.0))
+    data = series.read(720, 3)
+    assert data["start"] == 600
+    assert data["step"] == 60
+    assert data["series"]["cpu"] == [1.0, None, 3.0]
+
+def test_series_overwrites_wrapped_slots():
+    series = metrics.Series(1, 4)
+    for t in range(6):
+        series.add(t, sample(float(t)))
+    assert series.read(5, 10)["series"]["cpu"] == [2.0, 3.0, 4.0, 5.0]
+
+def test_series_allocates_lazily_and_releases_when_expired():
+    series = metrics.Series(1, 4)
+    assert series.periods is None
+    assert series.read(0, 2)["series"]["cpu"] == [None, None]
+    series.add(10, sample(1.0))
+    assert not series.expired(13)
+    assert series.expired(14)
+
+def test_rollup_averages_a_period():
+    series = metrics.Series(60, 10)
+    rollup = metrics.Rollup(series)
+    rollup.add(60, sample(1.0))
+    rollup.add(90, sample(3.0))
+    rollup.add(120, sample(10.0))  # next minute: the first one is stored
+    assert series.read(60, 1)["series"]["cpu"] == [2.0]
+
+def test_stopped_bot_metrics_are_freed():
+    bot = metrics.BotMetrics()
+    bot.add(0, sample(1.0))
+    assert not bot.prune(30)
+    assert bot.series["second"].periods is not None
+    assert not bot.prune(3600)
+    assert bot.series["second"].periods is None
+    assert bot.prune(3600 * 24 * 31)
+
+def test_sampler_skips_the_process_table_without_bots(monkeypatch):
+    def unexpected(*args, **kwargs):
+        raise AssertionError("walked the process table with no bots")
+    monkeypatch.setattr(metrics.psutil, "process_iter", unexpected)
+    assert metrics.Sampler().sample({}) == {}
+
+def test_sampler_reads_only_bot_processes(monkeypatch):
+    sleeper = subprocess.Popen(["sh", "-c", "sleep 30 & wait"])
+    try:
+        time.sleep(0.2)
+        read = []
+        as_dict = metrics.psutil.Process.as_dict
+        def counting_as_dict(proc, attrs=None, *args, **kwargs):
+            if attrs and "cpu_times" in attrs:
+                read.append(proc.pid)
+            return as_dict(proc, attrs, *args, **kwargs)
+        monkeypatch.setattr(metrics.psutil.Process, "as_dict", counting_as_dict)
+        samples = metrics.Sampler().sample({sleeper.pid: "bot"})
+        assert samples["bot"]["memory"] > 0
+        assert samples["bot"]["threads"] >= 2
+        assert sleeper.pid in read and os.getpid() not in read
+        assert set(read) <= {sleeper.pid} | {child.pid for child in metrics.psutil.Process(sleeper.pid).children()}
+    finally:
+        sleeper.kill()
+        sleeper.wait()
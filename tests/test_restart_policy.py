@@ -0,0 +1,28 @@
+import runner
+
+def test_backoff_doubles_up_to_the_cap():
+    policy = runner.RestartPolicy(base_delay=1, max_delay=5, crash_window=0, max_crashes=100)
+    now = 1000.0
+    delays = []
+    for _ in range(5):
+        delays.append(policy.next_delay(now - 1, now))
+        now += 10
+    assert delays == [1, 2, 4, 5, 5]
+
+def test_a_stable_run_resets_the_backoff():
+    policy = runner.RestartPolicy(base_delay=1, stable_after=60, crash_window=0)
+    assert policy.next_delay(0, 1) == 1
+    assert policy.next_delay(1, 2) == 2
+    assert policy.next_delay(2, 100) == 1
+
+def test_crash_loop_gives_up():
+    policy = runner.RestartPolicy(crash_window=120, max_crashes=3)
+    assert policy.next_delay(0, 1) is not None
+    assert policy.next_delay(1, 2) is not None
+    assert policy.next_delay(2, 3) is None
+
+def test_old_crashes_leave_the_window():
+    policy = runner.RestartPolicy(stable_after=1000, crash_window=10, max_crashes=3)
+    policy.next_delay(0, 1)
+    policy.next_delay(1, 2)
+    assert policy.next_delay(50, 60) is not None
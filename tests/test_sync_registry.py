@@ -0,0 +1,56 @@
+import uuid
+
+import pytest
+
+import runner
+import storage
+
+created = []
+
+@pytest.fixture
+def supervisor(monkeypatch):
+    supervisor = runner.Supervisor()
+    monkeypatch.setattr(supervisor.boot_starts, "run", lambda: None)
+    # Only the bots a test creates
+    monkeypatch.setattr(storage, "list_bots", lambda: [storage.get_bot(bot_id) for bot_id in created])
+    created.clear()
+    yield supervisor
+    supervisor.build_pool.shutdown()
+
+def make_bot(status, pid=None):
+    bot_id = uuid.uuid4().hex[:8]
+    storage.put_bot({
+        "id": bot_id, "name": bot_id, "filename": f"{bot_id}.py", "username": "alice", "language": "python",
+        "status": status, "pid": pid, "pid_identity": "gone", "cpu_usage": 1.5, "memory_usage": 20,
+        "restart_count": 0, "created_at": "2024-01-01T00:00:00",
+    })
+    created.append(bot_id)
+    return bot_id
+
+def queued(supervisor):
+    return {bot_id for _, _, bot_id in supervisor.boot_starts.queue}
+
+def test_dead_bots_are_queued_or_marked_stopped(supervisor):
+    running, stopping, stopped = make_bot("running", pid=999999), make_bot("stopping", pid=999999), make_bot("stopped")
+    supervisor.sync_registry()
+
+    assert storage.get_bot(running)["status"] == "restarting"
+    assert storage.get_bot(running)["pid"] is None
+    assert storage.get_bot(stopping)["status"] == "stopped"
+    assert storage.get_bot(stopping)["memory_usage"] == 0
+    assert storage.get_bot(stopped)["status"] == "stopped"
+    assert queued(supervisor) == {running}
+    assert supervisor.boot_report["queued"] == 1
+
+def test_panel_changes_made_during_the_pass_stand(supervisor, monkeypatch):
+    bot_id = make_bot("running", pid=999999)
+    snapshot = [storage.get_bot(bot_id)]
+    monkeypatch.setattr(storage, "list_bots", lambda: snapshot)
+    # Stopped from the panel after the supervisor read the registry
+    bot = storage.get_bot(bot_id)
+    bot["status"] = "stopped"
+    storage.put_bot(bot)
+
+    supervisor.sync_registry()
+    assert storage.get_bot(bot_id)["status"] == "stopped"
+    assert queued(supervisor) == set()
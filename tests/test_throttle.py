@@ -0,0 +1,36 @@
+import uuid
+
+import throttle
+
+def fresh_user():
+    return f"user-{uuid.uuid4().hex[:8]}"
+
+def test_attempts_are_limited_per_address():
+    ip, username = "10.0.0.1", fresh_user()
+    for _ in range(3):
+        assert throttle.login_allowed(ip, username, attempts_per_minute=3) == 0
+    assert throttle.login_allowed(ip, username, attempts_per_minute=3) > 0
+    # Another address has its own bucket
+    assert throttle.login_allowed("10.0.0.2", username, attempts_per_minute=3) == 0
+
+def test_failures_lock_out_only_the_failing_address():
+    username = fresh_user()
+    for _ in range(2):
+        assert throttle.login_allowed("10.0.1.1", username, failures_allowed=2) == 0
+        throttle.login_failed("10.0.1.1", username, failures_allowed=2)
+    assert throttle.login_allowed("10.0.1.1", username, failures_allowed=2) > 0
+    # The account owner elsewhere can still log in
+    assert throttle.login_allowed("10.0.1.2", username, failures_allowed=2) == 0
+
+def test_success_resets_failures():
+    ip, username = "10.0.2.1", fresh_user()
+    throttle.login_failed(ip, username, failures_allowed=2)
+    throttle.login_succeeded(ip, username)
+    throttle.login_failed(ip, username, failures_allowed=2)
+    assert throttle.login_allowed(ip, username, failures_allowed=2) == 0
+
+def test_zero_turns_limits_off():
+    ip, username = "10.0.3.1", fresh_user()
+    for _ in range(50):
+        throttle.login_failed(ip, username, failures_allowed=0)
+        assert throttle.login_allowed(ip, username, attempts_per_minute=0, failures_allowed=0) == 0
@@ -0,0 +1,45 @@
+import storage
+
+# -------------------------------
+# LOGIN THROTTLING
+# -------------------------------
+# Checking a password costs a scrypt hash, tens of milliseconds of CPU, so
+# an unthrottled burst of logins pins every web worker. Attempts are
+# limited by token buckets in the registry, shared by all workers, and a
+# rejected attempt never reaches the hash:
+#
+#   - every attempt takes a token from its client IP's bucket;
+#   - every failed attempt takes one from the bucket of that IP and
+#     username, so guessing at one account stops well before the IP's
+#     limit does. It is keyed by both so nobody can lock a user (or the
+#     admin) out of their account by failing logins from elsewhere.
+#
+# The limits come from the panel config (login_attempts_per_minute,
+# login_failures_allowed); 0 turns a bucket off. Buckets are (burst,
+# tokens refilled per second).
+LOGIN_ATTEMPTS_PER_MINUTE = 10
+LOGIN_FAILURES_ALLOWED = 5
+FAILURE_REFILL = 1 / 60
+
+def _ip_key(ip):
+    return f"login:ip:{ip}"
+
+def _failures_key(ip, username):
+    return f"login:user:{ip}:{username}"
+
+def login_allowed(ip, username, attempts_per_minute=LOGIN_ATTEMPTS_PER_MINUTE,
+                  failures_allowed=LOGIN_FAILURES_ALLOWED):
+    """Seconds to wait before this attempt may be checked; 0 if it may"""
+    retry_after = 0
+    if attempts_per_minute:
+        retry_after = storage.take_token(_ip_key(ip), attempts_per_minute, attempts_per_minute / 60)
+    if not retry_after and failures_allowed:
+        retry_after = storage.take_token(_failures_key(ip, username), failures_allowed, FAILURE_REFILL, cost=0)
+    return retry_after
+
+def login_failed(ip, username, failures_allowed=LOGIN_FAILURES_ALLOWED):
+    if failures_allowed:
+        storage.take_token(_failures_key(ip, username), failures_allowed, FAILURE_REFILL)
+
+def login_succeeded(ip, username):
+    storage.reset_tokens(_failures_key(ip, username))
@@ -0,0 +1,86 @@
+import os
+
+from paths import BOTS_DIR
+import storage
+import limits
+import logwriter
+
+# -------------------------------
+# DISK USAGE ACCOUNTING
+# -------------------------------
+# The disk_usage ledger in storage holds every user's bytes on disk, kept
+# current by whoever adds or removes them: uploads and deletes in the web
+# workers ("files") and the supervisor's log writers ("logs"). A quota
+# check is then one indexed read instead of a walk over BOTS_DIR and
+# LOGS_DIR. reconcile() walks the disk now and then to correct drift, e.g.
+# from a crash between writing a file and recording it.
+RECONCILE_INTERVAL = 3600
+RECONCILE_DELAY = 60  # first pass after the supervisor starts
+
+def path_size(path):
+    """Apparent size of a file, or of everything below a directory"""
+    try:
+        if not os.path.isdir(path):
+            return os.lstat(path).st_size
+    except OSError:
+        return 0
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def bot_tree(bot):
+    """Name under BOTS_DIR of the bot's file, or of the directory a ZIP upload was extracted to"""
+    return bot["filename"].split("/")[0]
+
+def bot_code_path(bot):
+    return os.path.join(BOTS_DIR, bot_tree(bot))
+
+def bot_usage(bot):
+    """{category: bytes} a bot occupies, measured from disk"""
+    return {"files": path_size(bot_code_path(bot)), "logs": logwriter.log_disk_usage(bot["log_file"])}
+
+def room(username, user=None):
+    """Bytes the user may still add, or None when unlimited"""
+    limit = limits.storage_limit(user if user is not None else storage.get_user(username))
+    return None if limit is None else max(0, limit - storage.total_usage(username))
+
+def has_room(username, nbytes, user=None):
+    available = room(username, user)
+    return available is None or nbytes <= available
+
+def reserve(username, nbytes):
+    """Record nbytes of new files if they fit the user's storage limit"""
+    with storage.transaction():
+        if not has_room(username, nbytes):
+            return False
+        storage.add_usage(username, "files", nbytes)
+        return True
+
+def record(username, **deltas):
+    """Adjust a user's ledger by category, e.g. record(name, files=-n, logs=-m)"""
+    with storage.transaction():
+        for category, delta in deltas.items():
+            if delta:
+                storage.add_usage(username, category, delta)
+
+def reconcile(log_manager=None):
+    """Recount every user's usage from disk and overwrite the ledger.
+
+    Pass the supervisor's LogManager so its in-memory log totals are
+    replaced along with the ledger's.
+    """
+    for username in storage.list_users():
+        totals = {"files": 0, "logs": 0}
+        for bot in storage.list_bots(username=username):
+            for category, nbytes in bot_usage(bot).items():
+                totals[category] += nbytes
+        storage.set_usage(username, "files", totals["files"])
+        if log_manager is not None:
+            log_manager.reconcile(username, totals["logs"])
+        else:
+            storage.set_usage(username, "logs", totals["logs"])
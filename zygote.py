@@ -0,0 +1,243 @@
+import os, sys, json, signal, socket, selectors, subprocess
+from collections import deque
+
+import cache
+import limits
+
+# -------------------------------
+# PYTHON BOT ZYGOTES
+# -------------------------------
+# Starting python3 and importing a bot's libraries costs hundreds of
+# milliseconds of CPU per bot, which adds up when every bot starts at once
+# (auto_start_bots after a reboot). With zygote_mode on, the supervisor keeps
+# one warm interpreter per Python environment that has the zygote_preload
+# modules imported, and each bot is a fork() of it: it shares the imported
+# code copy-on-write and starts in milliseconds.
+#
+# The supervisor talks to a zygote over a SOCK_SEQPACKET socketpair: a spawn
+# request carries the bot's output pipe as an SCM_RIGHTS fd, the reply is
+# the new pid. Bots are the zygote's children, so it reaps them and reports
+# each exit code back. If the zygote goes away its bots keep running and the
+# supervisor watches them like adopted processes.
+SPAWN_TIMEOUT = 10
+MAX_MESSAGE = 65536
+DEFAULT_PRELOAD = [
+    "asyncio", "json", "logging", "sqlite3", "ssl", "http.client", "urllib.request",
+    "requests", "aiohttp", "telebot", "telegram", "discord",
+]
+
+# The bot gets the environment the zygote started with, not whatever
+# preloaded modules have set since
+ENVIRON = dict(os.environ)
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def settings():
+    """(enabled, preload modules) from config.json"""
+    def read_settings():
+        with open(limits.CONFIG_FILE, 'r') as f:
+            config = json.load(f)
+        return bool(config.get("zygote_mode", False)), list(config.get("zygote_preload", DEFAULT_PRELOAD))
+    try:
+        return cache.cached("zygote_settings", lambda: cache.file_version(limits.CONFIG_FILE), read_settings)
+    except (OSError, ValueError):
+        return False, DEFAULT_PRELOAD
+
+# -------------------------------
+# SUPERVISOR SIDE
+# -------------------------------
+class ZygoteError(Exception):
+    pass
+
+class Zygote:
+    """The supervisor's handle on one zygote process"""
+
+    def __init__(self, python, preload):
+        self.sock, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        try:
+            self.process = subprocess.Popen(
+                [python, os.path.abspath(__file__), str(theirs.fileno()), *preload],
+                pass_fds=[theirs.fileno()],
+                stdin=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        except Exception:
+            self.sock.close()
+            raise
+        finally:
+            theirs.close()
+        self.sock.settimeout(SPAWN_TIMEOUT)
+        # Exit reports that arrived while waiting for a spawn reply
+        self.exits = deque()
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def _receive(self):
+        """The next message; None if the socket is non-blocking and nothing is waiting"""
+        try:
+            data = self.sock.recv(MAX_MESSAGE)
+        except BlockingIOError:
+            return None
+        except OSError as e:
+            raise ZygoteError(f"Zygote unreachable: {e}")
+        if not data:
+            raise ZygoteError("Zygote exited")
+        return json.loads(data)
+
+    def spawn(self, bot_path, output_fd, cgroup_dir, bot_limits):
+        """Fork a bot writing to output_fd; returns its pid or raises ZygoteError"""
+        request = {"path": bot_path, "cgroup": cgroup_dir, "limits": bot_limits}
+        try:
+            socket.send_fds(self.sock, [json.dumps(request).encode()], [output_fd])
+        except OSError as e:
+            raise ZygoteError(f"Zygote unreachable: {e}")
+
+        while True:
+            message = self._receive()
+            if "exit" not in message:
+                break
+            self.exits.append((message["exit"], message["code"]))
+        if "error" in message:
+            raise ZygoteError(message["error"])
+        return message["pid"]
+
+    def read_exits(self):
+        """[(pid, exit code)] reported so far; raises ZygoteError once the zygote is gone"""
+        self.sock.setblocking(False)
+        try:
+            while True:
+                message = self._receive()
+                if message is None:
+                    break
+                self.exits.append((message["exit"], message["code"]))
+        finally:
+            self.sock.settimeout(SPAWN_TIMEOUT)
+
+        exits = list(self.exits)
+        self.exits.clear()
+        return exits
+
+    def close(self):
+        """Let the zygote exit; the bots it forked keep running"""
+        self.sock.close()
+        try:
+            self.process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+# -------------------------------
+# ZYGOTE SIDE
+# -------------------------------
+def preload(modules):
+    for name in modules:
+        try:
+            __import__(name)
+        except Exception:
+            pass  # not installed in this environment
+
+def reap(sock):
+    while True:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            return
+        if pid == 0:
+            return
+        sock.send(json.dumps({"exit": pid, "code": os.waitstatus_to_exitcode(status)}).encode())
+
+def serve(sock):
+    """Fork a bot per request until the supervisor hangs up.
+
+    Returns the request in the forked child, which goes on to run the bot;
+    returns None in the zygote once the socket closes.
+    """
+    wakeup_r, wakeup_w = os.pipe()
+    os.set_blocking(wakeup_r, False)
+    os.set_blocking(wakeup_w, False)
+    signal.set_wakeup_fd(wakeup_w)
+    signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+
+    selector = selectors.DefaultSelector()
+    selector.register(wakeup_r, selectors.EVENT_READ)
+    selector.register(sock, selectors.EVENT_READ)
+
+    while True:
+        for key, mask in selector.select():
+            if key.fileobj == wakeup_r:
+                try:
+                    while os.read(wakeup_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+                reap(sock)
+                continue
+
+            data, fds, _, _ = socket.recv_fds(sock, MAX_MESSAGE, 1)
+            if not data:
+                return None
+            request = json.loads(data)
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            try:
+                pid = os.fork()
+            except OSError as e:
+                for fd in fds:
+                    os.close(fd)
+                sock.send(json.dumps({"error": f"fork failed: {e}"}).encode())
+                continue
+
+            if pid == 0:
+                selector.close()
+                signal.set_wakeup_fd(-1)
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                os.close(wakeup_r)
+                os.close(wakeup_w)
+                sock.close()
+                become(request, fds[0])
+                return request
+
+            for fd in fds:
+                os.close(fd)
+            sock.send(json.dumps({"pid": pid}).encode())
+
+def become(request, output_fd):
+    """Turn the forked child into the bot's process, as Popen in the supervisor would"""
+    os.setsid()
+    limits.preexec(request["cgroup"], request["limits"], "python")()
+
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.dup2(output_fd, 1)
+    os.dup2(output_fd, 2)
+    os.close(devnull)
+    os.close(output_fd)
+
+    os.environ.clear()
+    os.environ.update(ENVIRON)
+
+    bot_dir = os.path.dirname(request["path"])
+    os.chdir(bot_dir)
+    sys.argv = [request["path"]]
+    sys.path[0] = bot_dir
+
+    # The bot's own modules win over ours and over preloaded ones
+    local = {name.split(".", 1)[0] for name in os.listdir(bot_dir)}
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, "__file__", None) or ""
+        if name != "__main__" and (os.path.dirname(path) == APP_DIR or name.split(".", 1)[0] in local):
+            del sys.modules[name]
+
+def main():
+    sock = socket.socket(fileno=int(sys.argv[1]))
+    preload(sys.argv[2:])
+    request = serve(sock)
+    if request is None:
+        return
+
+    import runpy
+    runpy.run_path(request["path"], run_name="__main__")
+
+if __name__ == "__main__":
+    main()